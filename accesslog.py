@@ -0,0 +1,220 @@
+import struct
+import utime
+
+import log
+import metrics
+import phone
+
+segment_file = "access%d.bin"  # segment files, numbered from 0
+segments = 8  # segments in the ring, the oldest one is reused when the newest is full
+segment_records = 255  # records per segment, with the header a segment is one 4 KB flash block
+batch_records = 16  # records written or read at a time
+ram_batches = 2  # batches kept in RAM until the idle flush, further records are dropped
+
+RECORD = 16
+RECORD_FORMAT = "<IQBxH"  # time, canonical number key (0 if not shown), decision, latency in us
+HEADER_FORMAT = "<4sI8x"  # magic, sequence number of the segment
+MAGIC = b"ALOG"
+LATENCY_MAX = 0xFFFF
+
+# Decisions
+OPENED = 1  # authorized, the gate was opened
+DENIED = 2  # number not authorized or not shown
+LOCKED_OUT = 3  # authorized, the gate was opened moments before
+
+DECISION_NAMES = {OPENED: "open", DENIED: "denied", LOCKED_OUT: "lockout"}
+
+
+def format_record(record):
+    """
+    :param record: tuple (time, key, decision, latency)
+    :return: text, e.g. 05-17 12:00 +48503815525 open
+    """
+    t, key, decision, latency = record
+    tm = utime.localtime(t)
+    number = phone.international(key) if key else "hidden"
+    return f"{tm[1]:02d}-{tm[2]:02d} {tm[3]:02d}:{tm[4]:02d} {number} {DECISION_NAMES.get(decision, decision)}"
+
+
+class AccessLog:
+    """
+    Journal of call decisions on the flash filesystem.
+
+    Records are fixed width and written to a ring of preallocated segment files,
+    so the journal never grows beyond segments * segment_records records. New
+    records are collected in RAM and written only by flush(), which the main
+    loop calls while the modem is idle, so a call only costs a pack_into. When
+    a burst of calls fills the RAM before the modem is idle, further records
+    are dropped and counted.
+    Only the sequence number and the record count of each segment are kept in
+    RAM; queries read the records newest first, a few at a time.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or segment_file
+        self.seqs = [0] * segments  # sequence number of each segment, 0 if not created
+        self.counts = [0] * segments  # records in each segment
+        self.current = 0  # segment written to
+        self.batch = bytearray(ram_batches * batch_records * RECORD)
+        self.batch_mv = memoryview(self.batch)
+        self.pending = 0  # records in batch
+        self.dropped = 0  # records dropped with the batch full
+        self.buf = bytearray(batch_records * RECORD)  # read buffer of the queries
+        self.open()
+
+    def segment_path(self, i):
+        return self.path % i
+
+    def open(self):
+        """
+        Reads the segment headers and finds the end of the newest segment.
+        """
+        header = bytearray(RECORD)
+        for i in range(segments):
+            self.seqs[i] = 0
+            self.counts[i] = 0
+            try:
+                with open(self.segment_path(i), "rb") as f:
+                    if f.readinto(header) != RECORD:
+                        continue
+                    magic, seq = struct.unpack(HEADER_FORMAT, header)
+                    if magic != MAGIC:
+                        continue
+                    self.seqs[i] = seq
+                    self.counts[i] = self.count_records(f, header)
+            except OSError:
+                pass
+        self.current = max(range(segments), key=lambda i: self.seqs[i])
+
+    def count_records(self, f, buf):
+        """
+        Binary search for the first empty record of a segment, the records are
+        written in order and an empty one has decision 0.
+
+        :param f: segment file
+        :param buf: bytearray of RECORD bytes
+        :return: number of records
+        """
+        lo, hi = 0, segment_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(RECORD * (1 + mid))
+            if f.readinto(buf) == RECORD and buf[12]:  # decision
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def add(self, key, decision, latency=0):
+        """
+        Records a decision in RAM, never writes to flash. The record is dropped
+        if the batch is full.
+
+        :param key: canonical key of the caller, None if the number was not shown
+        :param decision: OPENED, DENIED or LOCKED_OUT
+        :param latency: +CLIP: -> decision time in microseconds
+        :return: True if recorded, False if dropped
+        """
+        if self.pending == ram_batches * batch_records:
+            self.dropped += 1
+            metrics.count("access_dropped")
+            return False
+        struct.pack_into(RECORD_FORMAT, self.batch, self.pending * RECORD,
+                         utime.time(), key or 0, decision, min(latency, LATENCY_MAX))
+        self.pending += 1
+        return True
+
+    def flush(self):
+        """
+        Writes the records collected in RAM.
+
+        :return: number of records written
+        """
+        written = 0
+        try:
+            while written < self.pending:
+                if not self.seqs[self.current] or self.counts[self.current] == segment_records:
+                    self.rotate()
+                i = self.current
+                n = min(self.pending - written, segment_records - self.counts[i])
+                with open(self.segment_path(i), "r+b") as f:
+                    f.seek(RECORD * (1 + self.counts[i]))
+                    f.write(self.batch_mv[written * RECORD:(written + n) * RECORD])
+                self.counts[i] += n
+                written += n
+        except OSError as e:
+            log.error("Access log write failed: %s", e)
+        self.pending = 0
+        return written
+
+    def rotate(self):
+        """
+        Starts a new segment, the oldest one is overwritten.
+        """
+        if self.seqs[self.current]:
+            self.current = (self.current + 1) % segments
+        seq = max(self.seqs) + 1
+        with open(self.segment_path(self.current), "wb") as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, seq))
+            empty = bytes(RECORD * batch_records)
+            for start in range(0, segment_records, batch_records):
+                f.write(empty[:RECORD * min(batch_records, segment_records - start)])
+        self.seqs[self.current] = seq
+        self.counts[self.current] = 0
+
+    def records(self):
+        """
+        Stored records, newest first. Reads batch_records records at a time.
+
+        :return: generator of (time, key, decision, latency)
+        """
+        self.flush()
+        order = sorted((i for i in range(segments) if self.seqs[i]), key=lambda i: -self.seqs[i])
+        for i in order:
+            end = self.counts[i]
+            with open(self.segment_path(i), "rb") as f:
+                while end > 0:
+                    start = max(0, end - batch_records)
+                    f.seek(RECORD * (1 + start))
+                    f.readinto(self.buf)
+                    for j in range(end - start - 1, -1, -1):
+                        yield struct.unpack_from(RECORD_FORMAT, self.buf, j * RECORD)
+                    end = start
+
+    def latest(self, n):
+        """
+        :param n: number of records
+        :return: list of the newest records, newest first
+        """
+        return self.select(None, n)
+
+    def find(self, key, n):
+        """
+        :param key: canonical key of the number
+        :param n: number of records
+        :return: list of the newest records of the number, newest first
+        """
+        return self.select(key, n)
+
+    def select(self, key, n):
+        """
+        :param key: canonical key of the number, None for every number
+        :param n: number of records
+        :return: list of the newest matching records, newest first
+        """
+        found = []
+        if n <= 0:
+            return found
+        records = self.records()
+        try:
+            for record in records:
+                if key is None or record[1] == key:
+                    found.append(record)
+                    if len(found) >= n:
+                        break
+        finally:
+            records.close()  # closes the segment file now, not when the generator is collected
+        return found
+
+    def __len__(self):
+        return sum(self.counts) + self.pending
@@ -0,0 +1,125 @@
+"""
+Parsers of modem lines that work on the bytes in the RX buffer (bytes, bytearray
+or memoryview), so a line does not have to be decoded to a str and split to be
+recognized. Fields are returned as positions in the line or as ints.
+"""
+
+QUOTE = 34  # "
+COMMA = 44  # ,
+
+
+def starts(buf, prefix, start=0):
+    """
+    :param buf: line
+    :param prefix: bytes
+    :param start: position in buf to compare from
+    :return: True if buf has prefix at start
+    """
+    n = len(prefix)
+    if len(buf) - start < n:
+        return False
+    for i in range(n):
+        if buf[start + i] != prefix[i]:
+            return False
+    return True
+
+
+def find(buf, c, start=0, end=None):
+    """
+    :param buf: line
+    :param c: byte value to look for
+    :param start: first position searched
+    :param end: position the search stops at, None for the end of buf
+    :return: position of c or -1
+    """
+    if end is None:
+        end = len(buf)
+    for i in range(start, end):
+        if buf[i] == c:
+            return i
+    return -1
+
+
+def parse_int(buf, start, end=None):
+    """
+    Parses an unsigned decimal number, skipping leading spaces.
+
+    :param buf: line
+    :param start: position of the number
+    :param end: position it stops at, None for the end of buf
+    :return: tuple (value, position after the last digit), value is None if there are no digits
+    """
+    if end is None:
+        end = len(buf)
+    while start < end and buf[start] == 32:
+        start += 1
+    value = None
+    while start < end:
+        d = buf[start] - 48
+        if not 0 <= d <= 9:
+            break
+        value = d if value is None else value * 10 + d
+        start += 1
+    return value, start
+
+
+def match(buf, table):
+    """
+    :param buf: line
+    :param table: tuple of (prefix bytes, name)
+    :return: name of the first matching prefix or None
+    """
+    for prefix, name in table:
+        if starts(buf, prefix):
+            return name
+    return None
+
+
+def quoted(buf, start):
+    """
+    :param buf: line
+    :param start: position to look for the opening quote from
+    :return: tuple (first, end) of the quoted text without the quotes, (-1, -1) if there is none
+    """
+    first = find(buf, QUOTE, start)
+    if first < 0:
+        return -1, -1
+    end = find(buf, QUOTE, first + 1)
+    if end < 0:
+        return -1, -1
+    return first + 1, end
+
+
+def clip_fields(buf):
+    """
+    :param buf: +CLIP: "<number>",<type>,...
+    :return: tuple (first, end, type) of the number, first is -1 if the line has no
+             number, type is None if it is not given
+    """
+    first, end = quoted(buf, 6)
+    if first < 0:
+        return -1, -1, None
+    toa = None
+    if end + 1 < len(buf) and buf[end + 1] == COMMA:
+        toa = parse_int(buf, end + 2)[0]
+    return first, end, toa
+
+
+def cpbr_fields(buf):
+    """
+    :param buf: +CPBR: <index>,"<number>",<type>,"<text>"
+    :return: tuple (index, first, end, type) with the position of the number,
+             None if the line is not a valid entry
+    """
+    if not starts(buf, b"+CPBR:"):
+        return None
+    idx, i = parse_int(buf, 6)
+    if idx is None or i >= len(buf) or buf[i] != COMMA:
+        return None
+    first, end = quoted(buf, i + 1)
+    if first < 0 or end + 1 >= len(buf) or buf[end + 1] != COMMA:
+        return None
+    number_type = parse_int(buf, end + 2)[0]
+    if number_type is None:
+        return None
+    return idx, first, end, number_type
@@ -0,0 +1,257 @@
+import os
+
+import log
+
+auth_file = "auth.bin"  # sorted records, rewritten on compaction
+auth_log = "auth.log"  # changes since the last compaction, append only
+log_max = 64  # logged changes before the log is compacted into auth_file
+index_size = 64  # numbers sampled from auth_file to narrow the binary search
+
+NUMBER_BYTES = 8  # up to 15 digits, packed BCD padded with 0xF
+RECORD = NUMBER_BYTES + 1  # packed number + role
+
+# Roles
+ROLE_NONE = 0
+ROLE_USER = 1  # may open the gate
+ROLE_ADMIN = 2  # may also send SMS commands
+ROLE_SIM = 3  # copy of a SIM phonebook contact, may open the gate, removed with the contact
+
+OP_ADD = 0x2B  # +
+OP_DELETE = 0x2D  # -
+
+
+def pack_number(number):
+    """
+    Packs a phone number as fixed width BCD, so records sort by their bytes.
+
+    :param number: phone number, digits with an optional leading +, or its canonical key
+    :return: bytes of length NUMBER_BYTES
+    """
+    number = str(number)
+    if number.startswith("+"):
+        number = number[1:]
+    if not number.isdigit() or len(number) >= NUMBER_BYTES * 2:
+        raise ValueError("invalid number: " + number)
+    packed = bytearray(b"\xff" * NUMBER_BYTES)
+    for i, c in enumerate(number):
+        d = ord(c) - 48
+        if i % 2:
+            packed[i // 2] = (packed[i // 2] & 0xF0) | d
+        else:
+            packed[i // 2] = (d << 4) | 0x0F
+    return bytes(packed)
+
+
+def unpack_number(packed):
+    """
+    :param packed: packed number (the first NUMBER_BYTES bytes are used)
+    :return: phone number digits
+    """
+    digits = []
+    for i in range(NUMBER_BYTES):
+        for d in (packed[i] >> 4, packed[i] & 0x0F):
+            if d > 9:
+                return "".join(digits)
+            digits.append(chr(48 + d))
+    return "".join(digits)
+
+
+class AuthStore:
+    """
+    Authorized numbers on the flash filesystem.
+
+    auth_file holds fixed width records (packed number, role) sorted by number
+    and is searched with seeks, so only index_size numbers and the changes of
+    the log are kept in RAM no matter how many numbers are stored. Changes are
+    appended to auth_log and merged into auth_file once log_max of them pile up.
+    """
+
+    def __init__(self, path=None, log_path=None):
+        self.path = path or auth_file
+        self.log_path = log_path or auth_log
+        self.file = None
+        self.count = 0  # records in auth_file
+        self.step = 1  # records between two index entries
+        self.index = []  # packed number of every step-th record
+        self.changes = {}  # packed number -> role from the log, ROLE_NONE for deleted
+        self.logged = 0  # entries in the log
+        self.buf = bytearray(RECORD)
+        self.open()
+
+    def open(self):
+        """
+        Opens auth_file, samples its index and replays the log.
+        """
+        self.close()
+        try:
+            self.count = os.stat(self.path)[6] // RECORD
+            self.file = open(self.path, "rb")
+        except OSError:
+            self.count = 0
+        self.step = max(1, -(-self.count // index_size))
+        self.index = [bytes(self.read_record(i)[:NUMBER_BYTES]) for i in range(0, self.count, self.step)]
+
+        self.changes = {}
+        self.logged = 0
+        try:
+            with open(self.log_path, "rb") as f:
+                while True:
+                    entry = f.read(RECORD + 1)
+                    if len(entry) < RECORD + 1:
+                        break
+                    key = bytes(entry[1:1 + NUMBER_BYTES])
+                    self.changes[key] = entry[RECORD] if entry[0] == OP_ADD else ROLE_NONE
+                    self.logged += 1
+        except OSError:
+            pass
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def read_record(self, i):
+        """
+        :param i: record number in auth_file
+        :return: the record in a shared buffer, valid until the next read
+        """
+        self.file.seek(i * RECORD)
+        self.file.readinto(self.buf)
+        return self.buf
+
+    def search(self, key):
+        """
+        Binary search of auth_file.
+
+        :param key: packed number
+        :return: role of the number, ROLE_NONE if it is not in auth_file
+        """
+        lo, hi = 0, len(self.index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.index[mid] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if not lo:
+            return ROLE_NONE
+        lo = (lo - 1) * self.step
+        hi = min(lo + self.step, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self.read_record(mid)
+            found = bytes(record[:NUMBER_BYTES])
+            if found == key:
+                return record[NUMBER_BYTES]
+            if found < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return ROLE_NONE
+
+    def role(self, number):
+        """
+        :param number: phone number
+        :return: ROLE_USER, ROLE_ADMIN, ROLE_SIM or ROLE_NONE if the number is not stored
+        """
+        try:
+            key = pack_number(number)
+        except ValueError:
+            return ROLE_NONE
+        role = self.changes.get(key)
+        if role is not None:
+            return role
+        return self.search(key)
+
+    def __contains__(self, number):
+        return self.role(number) != ROLE_NONE
+
+    def add(self, number, role=ROLE_USER):
+        """
+        Stores a number or changes its role.
+
+        :param number: phone number
+        :param role: ROLE_USER, ROLE_ADMIN or ROLE_SIM
+        :return: True if the store changed, False if the number was already stored with that role
+        """
+        if self.role(number) == role:
+            return False
+        self.log(OP_ADD, pack_number(number), role)
+        return True
+
+    def remove(self, number):
+        """
+        :param number: phone number
+        :return: True if the number was removed, False if it was not stored
+        """
+        if self.role(number) == ROLE_NONE:
+            return False
+        self.log(OP_DELETE, pack_number(number), ROLE_NONE)
+        return True
+
+    def log(self, op, key, role):
+        """
+        Appends a change to the log, compacts it when it is full.
+        """
+        with open(self.log_path, "ab") as f:
+            f.write(bytes((op,)) + key + bytes((role,)))
+        self.changes[key] = role
+        self.logged += 1
+        if self.logged >= log_max:
+            self.compact()
+
+    def records(self):
+        """
+        Stored numbers in order, auth_file merged with the log.
+
+        :return: generator of (packed number, role)
+        """
+        changes = sorted(self.changes.items())
+        c = 0
+        for i in range(self.count):
+            record = self.read_record(i)
+            key = bytes(record[:NUMBER_BYTES])
+            role = record[NUMBER_BYTES]
+            while c < len(changes) and changes[c][0] < key:
+                if changes[c][1]:
+                    yield changes[c]
+                c += 1
+            if c < len(changes) and changes[c][0] == key:
+                role = changes[c][1]
+                c += 1
+            if role:
+                yield key, role
+        for key, role in changes[c:]:
+            if role:
+                yield key, role
+
+    def numbers(self):
+        """
+        :return: generator of (phone number digits, role)
+        """
+        for key, role in self.records():
+            yield unpack_number(key), role
+
+    def compact(self):
+        """
+        Merges the log into a new auth_file and clears the log.
+
+        :return: number of stored numbers
+        """
+        tmp = self.path + ".tmp"
+        count = 0
+        with open(tmp, "wb") as f:
+            for key, role in self.records():
+                f.write(key + bytes((role,)))
+                count += 1
+        self.close()
+        try:
+            os.rename(tmp, self.path)
+        except OSError:
+            os.remove(self.path)
+            os.rename(tmp, self.path)
+        with open(self.log_path, "wb"):
+            pass
+        self.open()
+        log.info("Authorized numbers compacted: %s numbers.", count)
+        return count
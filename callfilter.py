@@ -0,0 +1,126 @@
+import utime
+
+denied_cache_size = 32  # denied numbers remembered
+denied_ttl_ms = 600000  # how long a number stays cached as denied, at most pb_sync_ms is safe
+number_calls_max = 3  # calls of a denied number per number_window_ms before they are throttled
+number_window_ms = 60000
+rings_max = 30  # RINGs per rings_window_ms before RINGs and denied calls are throttled
+rings_window_ms = 60000
+
+THROTTLED = 0  # decision of a denied call that is hung up without being logged or queued
+
+
+class CallFilter:
+    """
+    Fixed-size cache of recently denied callers with rate limits.
+
+    A cached number is denied without looking it up in the phonebook and the
+    flash store. Denied calls above number_calls_max per number, or while more
+    than rings_max RINGs arrived in the window, are throttled: still hung up,
+    but neither logged nor queued for the handler, so a redialing caller
+    cannot flood the event queue. Authorized callers are never throttled.
+    Entries live in preallocated parallel lists, the least recently used one
+    is replaced when the cache is full.
+    """
+
+    def __init__(self, size=denied_cache_size):
+        self.size = size
+        self.keys = [None] * size
+        self.added = [0] * size  # ticks_ms when the number was denied, for the TTL
+        self.used = [0] * size  # ticks_ms of the last call, for the LRU
+        self.window = [0] * size  # ticks_ms when the rate window of the number started
+        self.calls = [0] * size  # calls of the number in the window
+        self.ring_window = utime.ticks_ms()
+        self.rings = 0  # RINGs in the global window
+
+    def find(self, key, now):
+        """
+        :param key: canonical key
+        :param now: ticks_ms
+        :return: entry index or -1 if the number is not cached or its entry expired
+        """
+        if key is None:
+            return -1
+        for i in range(self.size):
+            if self.keys[i] == key:
+                if utime.ticks_diff(now, self.added[i]) >= denied_ttl_ms:
+                    self.keys[i] = None
+                    return -1
+                return i
+        return -1
+
+    def is_denied(self, key, now=None):
+        """
+        :param key: canonical key of the caller, None if not shown
+        :param now: ticks_ms, now if not given
+        :return: True if the number is cached as denied
+        """
+        return self.find(key, utime.ticks_ms() if now is None else now) >= 0
+
+    def deny(self, key, now):
+        """
+        Caches a denied number, replacing an empty entry or the least recently used one.
+
+        :param key: canonical key, None is not cached
+        :param now: ticks_ms
+        """
+        if key is None or self.find(key, now) >= 0:
+            return
+        oldest = 0
+        for i in range(self.size):
+            if self.keys[i] is None:
+                oldest = i
+                break
+            if utime.ticks_diff(self.used[i], self.used[oldest]) < 0:
+                oldest = i
+        self.keys[oldest] = key
+        self.added[oldest] = now
+        self.used[oldest] = now
+        self.window[oldest] = now
+        self.calls[oldest] = 0
+
+    def forget(self, key):
+        """
+        Removes a number, to be called when it is authorized.
+
+        :param key: canonical key
+        """
+        for i in range(self.size):
+            if self.keys[i] == key:
+                self.keys[i] = None
+
+    def clear(self):
+        for i in range(self.size):
+            self.keys[i] = None
+
+    def ring(self, now):
+        """
+        Counts a RING in the global window.
+
+        :param now: ticks_ms
+        :return: False if RINGs are over the limit and the event should be dropped
+        """
+        if utime.ticks_diff(now, self.ring_window) >= rings_window_ms:
+            self.ring_window = now
+            self.rings = 0
+        self.rings += 1
+        return self.rings <= rings_max
+
+    def throttle(self, key, now):
+        """
+        Counts a denied call of the number.
+
+        :param key: canonical key of the caller, None if not shown
+        :param now: ticks_ms
+        :return: True if the call is over the per-number or the global limit
+        """
+        i = self.find(key, now)
+        if i >= 0:
+            self.used[i] = now
+            if utime.ticks_diff(now, self.window[i]) >= number_window_ms:
+                self.window[i] = now
+                self.calls[i] = 0
+            self.calls[i] += 1
+            if self.calls[i] > number_calls_max:
+                return True
+        return self.rings > rings_max and utime.ticks_diff(now, self.ring_window) < rings_window_ms
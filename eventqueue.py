@@ -0,0 +1,81 @@
+import utime
+
+
+class EventQueue:
+    """
+    Fixed-capacity FIFO of URC events (name, line, ticks_us when received).
+
+    The fields are kept in preallocated parallel lists, so queuing an event does
+    not allocate. When the queue is full the oldest event is dropped.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.names = [None] * size
+        self.lines = [None] * size
+        self.received = [0] * size
+        self.start = 0  # position of the oldest event
+        self.count = 0
+        self.dropped = 0  # events dropped because the queue was full
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def push(self, name, line, received):
+        """
+        Queues an event.
+
+        :param name: URC name, None for an unexpected response line
+        :param line: URC line
+        :param received: ticks_us when the line was read
+        """
+        if self.count == self.size:
+            self.start = (self.start + 1) % self.size
+            self.count -= 1
+            self.dropped += 1
+        i = (self.start + self.count) % self.size
+        self.names[i] = name
+        self.lines[i] = line
+        self.received[i] = received
+        self.count += 1
+
+    def popleft(self):
+        """
+        :return: the oldest event as a tuple (name, line, received)
+        """
+        if not self.count:
+            raise IndexError("pop from an empty queue")
+        i = self.start
+        event = (self.names[i], self.lines[i], self.received[i])
+        self.lines[i] = None  # not kept alive until the slot is reused
+        self.start = (i + 1) % self.size
+        self.count -= 1
+        return event
+
+    def clear(self):
+        for i in range(self.size):
+            self.lines[i] = None
+        self.start = 0
+        self.count = 0
+
+    def __iter__(self):
+        for n in range(self.count):
+            i = (self.start + n) % self.size
+            yield self.names[i], self.lines[i], self.received[i]
+
+    def has(self, name, since=None):
+        """
+        Checks for a queued event without building tuples.
+
+        :param name: URC name
+        :param since: ticks_us, events received before are not counted
+        :return: True if an event with the name is queued
+        """
+        for n in range(self.count):
+            i = (self.start + n) % self.size
+            if self.names[i] == name and (since is None or utime.ticks_diff(self.received[i], since) >= 0):
+                return True
+        return False
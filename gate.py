@@ -0,0 +1,57 @@
+import machine
+import utime
+
+# using pin defined
+relay_pin = 15  # pin driving the gate relay
+pulse_ms = 1000  # how long the relay stays closed
+debounce_ms = 300  # open requests closer than this to the previous one are ignored
+lockout_ms = 5000  # minimum time between the start of two pulses
+
+
+class Gate:
+    """
+    Gate actuator: pulses a relay on a machine.Pin.
+    """
+
+    def __init__(self, pin=relay_pin, pulse=pulse_ms, debounce=debounce_ms, lockout=lockout_ms):
+        self.relay = machine.Pin(pin, machine.Pin.OUT)
+        self.relay.value(0)
+        self.timer = machine.Timer()
+        self.pulse = pulse
+        self.debounce = debounce
+        self.lockout = lockout
+        self.active = False
+        self.last_request = None
+        self.last_pulse = None
+        self.pulses = 0
+
+    def open(self):
+        """
+        Closes the relay for the pulse duration. Does not block, the relay is
+        released from a timer callback.
+        
+        :return: True if the relay was pulsed, False if the request was debounced or locked out
+        """
+        now = utime.ticks_ms()
+        last_request = self.last_request
+        self.last_request = now
+        if last_request is not None and utime.ticks_diff(now, last_request) < self.debounce:
+            return False
+        if self.active:
+            return False
+        if self.last_pulse is not None and utime.ticks_diff(now, self.last_pulse) < self.lockout:
+            return False
+
+        self.relay.value(1)
+        self.active = True
+        self.last_pulse = now
+        self.pulses += 1
+        self.timer.init(mode=machine.Timer.ONE_SHOT, period=self.pulse, callback=self.release)
+        return True
+
+    def release(self, timer=None):
+        """
+        Opens the relay, ending the pulse.
+        """
+        self.relay.value(0)
+        self.active = False
@@ -0,0 +1,161 @@
+"""
+UART link speed benchmark on the simulated SIM868.
+
+Measures a full phonebook read (load_phonebook, ranged AT+CPBR) and an inbox
+read (drain_inbox, AT+CMGL) at every AT+IPR rate, then the negotiation at
+boot on a clean line and on a line that loses bytes above 230400 baud, and
+the fallback when the losses only show up in bulk reads. Results are
+written as JSON for CI, to the temp directory unless --out is given.
+
+Usage: python host/bench_link.py [--iterations N] [--out results.json]
+"""
+import argparse
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+import simenv
+from simclock import clock
+from modem import run_sync
+import metrics
+from bench_modem import Bench, percentile
+
+MESSAGES = 30
+TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam"
+
+
+def fixed_rate(rate):
+    """
+    Modem already switched to the rate, found by check_start, no negotiation.
+    """
+    import linkspeed
+
+    linkspeed.negotiate = False
+    try:
+        return Bench(baud=rate)
+    finally:
+        linkspeed.negotiate = True
+
+
+def measure(bench, run, iterations):
+    """
+    :param run: function doing one read
+    :return: (samples in ms, bytes from the modem per second)
+    """
+    samples = []
+    received = 0
+    for _ in range(iterations):
+        t = clock.now()
+        tx = bench.model.bytes_tx
+        with redirect_stdout(bench.sink):
+            run()
+        samples.append((clock.now() - t) / 1000)
+        received += bench.model.bytes_tx - tx
+        bench.step()
+    return samples, received * 1000 / sum(samples)
+
+
+def read_phonebook(bench):
+    run_sync(bench.modem.load_phonebook())
+
+
+def read_inbox(bench):
+    for i in range(1, MESSAGES + 1):
+        bench.model.messages[i] = ["REC UNREAD", "+48600%06d" % i, "24/05/17,12:00:00+08", TEXT, 0]
+    run_sync(bench.modem.drain_inbox())
+
+
+def rates(iterations):
+    import linkspeed
+
+    results = []
+    for name, run in (("phonebook", read_phonebook), ("cmgl", read_inbox)):
+        base = None
+        for rate in sorted(linkspeed.rates):
+            bench = fixed_rate(rate)
+            samples, throughput = measure(bench, lambda: run(bench), iterations)
+            p50 = percentile(samples, 50)
+            base = base or p50
+            results.append({
+                "scenario": "%s_%d" % (name, rate),
+                "samples": len(samples),
+                "p50_ms": p50,
+                "p95_ms": percentile(samples, 95),
+                "bytes_per_s": throughput,
+                "speedup": base / p50,
+            })
+    return results
+
+
+def negotiation(name, **line):
+    """
+    Boot of a modem at the default rate, the link is negotiated by init_device.
+    """
+    bench = Bench(**line)
+    link = bench.modem.link
+    return {
+        "scenario": "negotiate_" + name,
+        "rate": link.rate,
+        "rejected": list(link.failed),
+        "link_ms": dict(bench.modem.boot_phases)["link"],
+        "saved": link.saved,
+    }
+
+
+def fallback(iterations):
+    """
+    Losses rare enough to pass the echo test at 460800: the garbled +CPBR:
+    lines of the bulk reads make the Supervisor fall back to 230400.
+    """
+    import supervisor
+
+    bench = Bench(error_baud=230400, error_interval=3000)
+    link = bench.modem.link
+    sup = supervisor.Supervisor(bench.modem)
+    sup.state = supervisor.REGISTERED
+    negotiated = link.rate
+    metrics.reset()
+    t = clock.now()
+    reads = 0
+    while link.rate == negotiated and reads < iterations * 10:
+        with redirect_stdout(bench.sink):
+            run_sync(bench.modem.load_phonebook())
+            run_sync(sup.tick())
+        reads += 1
+    return {
+        "scenario": "fallback",
+        "negotiated": negotiated,
+        "rate": link.rate,
+        "phonebook_reads": reads,
+        "link_errors": metrics.counters.get("link_errors", 0),
+        "sim_time_s": (clock.now() - t) / 1000000,
+        "contacts": len(bench.modem.phonebook),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "bench_link.json"))
+    args = parser.parse_args()
+
+    results = rates(args.iterations)
+    for res in results:
+        print("%-18s p50 %8.1f ms  p95 %8.1f ms  %8.0f B/s  x%.2f"
+              % (res["scenario"], res["p50_ms"], res["p95_ms"], res["bytes_per_s"], res["speedup"]))
+    for res in (negotiation("clean"), negotiation("noisy", error_baud=230400)):
+        results.append(res)
+        print("%-18s %d baud, rejected %s, %d ms" % (res["scenario"], res["rate"], res["rejected"], res["link_ms"]))
+    res = fallback(args.iterations)
+    results.append(res)
+    print("%-18s %d -> %d baud after %d reads, %d link errors, %d contacts"
+          % (res["scenario"], res["negotiated"], res["rate"], res["phonebook_reads"], res["link_errors"], res["contacts"]))
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results written to", os.path.abspath(args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Call authorization and SMS command benchmarks on the simulated SIM868.
+
+Drives the Modem class like the firmware does (poll the UART, dispatch the
+queued events) against a model with realistic per-command latencies and
+reports p50/p95/p99 latency, simulated wall time and bytes moved over the
+UART for each scenario. Results are written as JSON for CI,
+to the temp directory unless --out is given.
+
+Usage: python host/bench_modem.py [--iterations N] [--out results.json] [--scenario NAME ...]
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+import simenv
+from simclock import clock
+from modem import run_sync
+import metrics
+
+ADMIN = "+48503815525"
+PB_SIZE = 250
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
+
+
+class Bench:
+    """
+    One scenario run: a fresh model with a full phonebook and an initialized Modem.
+    With sms_direct False incoming SMS are stored on the SIM and announced with +CMTI:.
+    """
+
+    def __init__(self, latency_ms=20, contacts=PB_SIZE, sms_direct=True, **kwargs):
+        numbers = ["+48%09d" % (500000000 + i) for i in range(1, contacts + 1)]
+        self.model = simenv.create(contacts=numbers, pb_size=PB_SIZE, latency_ms=latency_ms, **kwargs)
+        self.numbers = numbers
+        import modem
+        from modem import Modem, GK_numbers
+
+        if ADMIN not in GK_numbers:
+            GK_numbers.append(ADMIN)
+        metrics.reset()
+        self.sink = io.StringIO()
+        direct, modem.sms_direct = modem.sms_direct, sms_direct
+        try:
+            with redirect_stdout(self.sink):
+                self.modem = Modem(0, 115200)
+                start = clock.now()
+                run_sync(self.modem.init_device())
+                self.boot_us = clock.now() - start
+        finally:
+            modem.sms_direct = direct
+        self.start_rx = self.model.bytes_rx
+        self.start_tx = self.model.bytes_tx
+        self.start = clock.now()
+        self.samples = []
+
+    def step(self):
+        """
+        One iteration of the firmware main loop.
+        """
+        with redirect_stdout(self.sink):
+            self.modem.poll()
+            run_sync(self.modem.dispatch())
+        self.sink.seek(0)
+        self.sink.truncate()
+
+    def run_until(self, done, limit_us=120000000):
+        deadline = clock.now() + limit_us
+        while not done():
+            if clock.now() > deadline:
+                raise RuntimeError("scenario did not finish in simulated time")
+            self.step()
+
+    def commands_since(self, t, prefix):
+        return [at for at, line in self.model.history if at >= t and line.startswith(prefix)]
+
+    def result(self, name):
+        samples_ms = [s / 1000 for s in self.samples]
+        return {
+            "scenario": name,
+            "samples": len(samples_ms),
+            "p50_ms": percentile(samples_ms, 50),
+            "p95_ms": percentile(samples_ms, 95),
+            "p99_ms": percentile(samples_ms, 99),
+            "sim_time_s": (clock.now() - self.start) / 1000000,
+            "boot_s": self.boot_us / 1000000,
+            "bytes_to_modem": self.model.bytes_rx - self.start_rx,
+            "bytes_from_modem": self.model.bytes_tx - self.start_tx,
+        }
+
+
+def ring_at_slot(slot, iterations):
+    """
+    RING/+CLIP from the number stored at the given slot until ATH.
+    """
+    bench = Bench()
+    number = bench.numbers[slot - 1]
+    for _ in range(iterations):
+        t = clock.now()
+        bench.model.call(number, at=t)
+        bench.run_until(lambda: bench.commands_since(t, "ATH"))
+        bench.samples.append(bench.commands_since(t, "ATH")[0] - t)
+        clock.advance(6000000)  # past the gate lockout
+        bench.step()
+    res = bench.result("ring_slot_%d" % slot)
+    clip = bench.modem.clip_latency.summary()
+    res["clip_to_relay_p99_us"] = clip["p99"]
+    return res
+
+
+def ring_unknown(iterations):
+    """
+    RING/+CLIP from a number that is not stored until ATH.
+    """
+    bench = Bench()
+    for i in range(iterations):
+        t = clock.now()
+        bench.model.call("+48%09d" % (600000000 + i), at=t)
+        bench.run_until(lambda: bench.commands_since(t, "ATH"))
+        bench.samples.append(bench.commands_since(t, "ATH")[0] - t)
+        bench.step()
+    return bench.result("ring_unknown")
+
+
+def ring_storm(count, iterations):
+    """
+    count calls from one redialing unknown number, then a call from a stored
+    number. Latency is RING -> ATH of the stored number's call.
+    """
+    bench = Bench()
+    for _ in range(iterations):
+        for _ in range(count):
+            t = clock.now()
+            bench.model.call("+48600000001", at=t)
+            bench.run_until(lambda: bench.commands_since(t, "ATH"))
+            clock.advance(300000)
+        t = clock.now()
+        bench.model.call(bench.numbers[0], at=t)
+        bench.run_until(lambda: bench.commands_since(t, "ATH"))
+        bench.samples.append(bench.commands_since(t, "ATH")[0] - t)
+        clock.advance(6000000)  # past the gate lockout
+        bench.step()
+    res = bench.result("ring_storm_%d" % count)
+    res["calls_throttled"] = metrics.counters.get("calls_throttled", 0)
+    res["gate_opened"] = metrics.counters.get("gate_opened", 0)
+    return res
+
+
+def sms_burst(count, iterations):
+    """
+    count admin query SMS arrive at once, latency is delivery -> reply sent. The
+    messages are stored on the SIM, announced with +CMTI: and read with one AT+CMGL.
+    """
+    bench = Bench(sms_direct=False)
+    for _ in range(iterations):
+        t = clock.now()
+        sent = len(bench.model.sent)
+        for i in range(count):
+            bench.model.sms(ADMIN, "?%s" % bench.numbers[i % len(bench.numbers)][3:], at=t)
+        bench.run_until(lambda: len(bench.model.sent) >= sent + count)
+        bench.samples.extend(at - t for at in bench.commands_since(t, "SEND"))
+    res = bench.result("cmti_burst_%d" % count)
+    res["commands_per_min"] = count * iterations * 60 / res["sim_time_s"]
+    res["inbox_reads"] = len(bench.commands_since(bench.start, "AT+CMGL"))
+    return res
+
+
+def add_delete_storm(count, iterations):
+    """
+    count add commands followed by count delete commands, one SMS each.
+    """
+    bench = Bench(contacts=PB_SIZE - count)
+    for _ in range(iterations):
+        for op in "+-":
+            for i in range(count):
+                t = clock.now()
+                sent = len(bench.model.sent)
+                bench.model.sms(ADMIN, "%s%09d" % (op, 700000000 + i), at=t)
+                bench.run_until(lambda: len(bench.model.sent) > sent)
+                bench.samples.append(bench.commands_since(t, "SEND")[0] - t)
+    res = bench.result("add_delete_storm_%d" % count)
+    res["commands_per_min"] = 2 * count * iterations * 60 / res["sim_time_s"]
+    return res
+
+
+def recovery(fault, iterations):
+    """
+    Modem fault while idle, latency is fault -> registered again with the
+    supervisor running its recovery.
+
+    :param fault: "restart" (modem reboots on its own), "power_down" or "hang" (stops answering)
+    """
+    import supervisor
+
+    bench = Bench()
+    sup = supervisor.Supervisor(bench.modem)
+    with redirect_stdout(bench.sink):
+        run_sync(sup.boot())
+    model = bench.model
+
+    def hang():
+        model.powered = model.ready = model.registered = False
+
+    inject = {"restart": model.boot, "power_down": model.power_down, "hang": hang}[fault]
+    for _ in range(iterations):
+        t = clock.now()
+        inject()
+        tick = t
+        down = False
+        while not down or sup.state != supervisor.REGISTERED:
+            if clock.now() >= tick:
+                with redirect_stdout(bench.sink):
+                    run_sync(sup.tick())
+                tick = clock.now() + supervisor.tick_ms * 1000
+            bench.step()
+            down = down or sup.state != supervisor.REGISTERED
+            clock.advance(1000)
+            if clock.now() - t > 300000000:
+                raise RuntimeError("modem not recovered in simulated time")
+        bench.samples.append(clock.now() - t)
+        clock.advance(1000000)
+    return bench.result("recovery_" + fault)
+
+
+def batch_add(count, iterations):
+    """
+    One SMS adding count numbers, then one deleting them again. Latency is
+    delivery -> reply sent, per SMS.
+    """
+    bench = Bench(contacts=PB_SIZE - count)
+    numbers = ["%09d" % (700000000 + i) for i in range(count)]
+    for _ in range(iterations):
+        for op in "+-":
+            t = clock.now()
+            sent = len(bench.model.sent)
+            bench.model.sms(ADMIN, " ".join(op + number for number in numbers), at=t)
+            bench.run_until(lambda: len(bench.model.sent) > sent)
+            bench.samples.append(bench.commands_since(t, "SEND")[0] - t)
+    res = bench.result("batch_add_%d" % count)
+    res["commands_per_min"] = 2 * count * iterations * 60 / res["sim_time_s"]
+    return res
+
+
+SCENARIOS = {
+    "ring_slot_1": lambda n: ring_at_slot(1, n),
+    "ring_slot_250": lambda n: ring_at_slot(PB_SIZE, n),
+    "ring_unknown": ring_unknown,
+    "ring_storm_50": lambda n: ring_storm(50, max(1, n // 10)),
+    "cmti_burst_20": lambda n: sms_burst(20, max(1, n // 10)),
+    "add_delete_storm": lambda n: add_delete_storm(10, max(1, n // 10)),
+    "batch_add_10": lambda n: batch_add(10, max(1, n // 10)),
+    "recovery_restart": lambda n: recovery("restart", max(1, n // 10)),
+    "recovery_power_down": lambda n: recovery("power_down", max(1, n // 10)),
+    "recovery_hang": lambda n: recovery("hang", max(1, n // 10)),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "bench_output.json"))
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    args = parser.parse_args()
+
+    results = []
+    for name in args.scenario or SCENARIOS:
+        res = SCENARIOS[name](args.iterations)
+        results.append(res)
+        print(
+            "%-20s p50 %8.1f ms  p95 %8.1f ms  p99 %8.1f ms  sim %7.1f s  tx %6d B  rx %7d B"
+            % (res["scenario"], res["p50_ms"], res["p95_ms"], res["p99_ms"], res["sim_time_s"],
+               res["bytes_to_modem"], res["bytes_from_modem"])
+        )
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results written to", os.path.abspath(args.out))
+
+
+if __name__ == "__main__":
+    main()
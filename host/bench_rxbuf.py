@@ -0,0 +1,126 @@
+"""
+Benchmark of the modem receive path on a host-side fake UART.
+
+Feeds 10 KB +CPBR/+CMGL style responses in random chunk sizes and compares
+the old byte-at-a-time bytes concatenation with RingBuffer line extraction.
+
+Usage: python host/bench_rxbuf.py [--size BYTES] [--runs N]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ringbuf import RingBuffer
+
+
+class FakeUART:
+    """
+    Minimal machine.UART stand-in that delivers the payload in random chunks,
+    like bytes trickling into the hardware FIFO.
+    """
+
+    def __init__(self, payload, seed=1):
+        self.payload = payload
+        self.pos = 0
+        self.rand = random.Random(seed)
+        self.ready = 0
+
+    def _arrive(self):
+        if not self.ready and self.pos < len(self.payload):
+            self.ready = min(self.rand.randint(1, 64), len(self.payload) - self.pos)
+
+    def any(self):
+        self._arrive()
+        return self.ready
+
+    def read(self, n=None):
+        self._arrive()
+        n = self.ready if n is None else min(n, self.ready)
+        data = self.payload[self.pos:self.pos + n]
+        self.pos += n
+        self.ready -= n
+        return data
+
+    def readinto(self, buf, n=None):
+        self._arrive()
+        n = min(len(buf) if n is None else n, self.ready)
+        buf[:n] = self.payload[self.pos:self.pos + n]
+        self.pos += n
+        self.ready -= n
+        return n
+
+
+def make_payload(size):
+    """
+    :param size: approximate payload size in bytes
+    :return: phonebook listing followed by OK
+    """
+    lines = []
+    total = 0
+    i = 1
+    while total < size:
+        line = '+CPBR: %d,"+48%09d",145,"Resident %d"\r\n' % (i, 500000000 + i, i)
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return ("".join(lines) + "\r\nOK\r\n").encode()
+
+
+def old_reader(uart):
+    # Pre-RingBuffer Modem.send_at loop
+    info = b""
+    while uart.any():
+        info = b"".join([info, uart.read(1)])
+    return len(info.split(b"\r\n"))
+
+
+def ring_reader(uart, rx):
+    lines = 0
+    while rx.fill(uart) or len(rx):
+        while rx.readline() is not None:
+            lines += 1
+        if not uart.any():
+            break
+    return lines
+
+
+def measure(name, payload, fn, runs):
+    gc.collect()
+    best = None
+    for _ in range(runs):
+        uart = FakeUART(payload)
+        start = time.perf_counter()
+        fn(uart)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    uart = FakeUART(payload)
+    tracemalloc.start()
+    fn(uart)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:12s} {len(payload) / best:14.0f} B/s   peak alloc {peak:8d} B")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=10 * 1024)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = make_payload(args.size)
+    rx = RingBuffer(1024)
+    print(f"payload {len(payload)} bytes, best of {args.runs} runs")
+    measure("bytes.join", payload, old_reader, args.runs)
+    measure("RingBuffer", payload, lambda uart: ring_reader(uart, rx), args.runs)
+
+
+if __name__ == "__main__":
+    main()
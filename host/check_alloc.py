@@ -0,0 +1,39 @@
+"""
+Prints the allocation figures of the call path checked by test_alloc.py.
+
+Exits with status 1 if a bound is exceeded.
+
+Usage: python host/check_alloc.py [--calls N] [--growth BYTES] [--peak BYTES]
+"""
+import argparse
+import sys
+
+import test_alloc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=test_alloc.CALLS)
+    parser.add_argument("--warmup", type=int, default=test_alloc.WARMUP)
+    parser.add_argument("--growth", type=int, default=test_alloc.GROWTH_MAX, help="allowed growth of firmware memory, bytes")
+    parser.add_argument("--peak", type=int, default=test_alloc.PEAK_MAX, help="allowed peak allocation per call, bytes")
+    args = parser.parse_args()
+
+    res = test_alloc.measure(args.calls, args.warmup)
+    print(f"calls: {args.calls}, gate pulses: {res['pulses']}")
+    print(f"firmware memory growth: {res['growth_half']} B after {args.calls // 2} calls, {res['growth']} B after {args.calls}")
+    print(f"peak allocation per call: {res['peak']} B")
+    failed = False
+    if res["growth"] > args.growth:
+        print(f"FAIL: growth above {args.growth} B")
+        failed = True
+    if res["peak"] > args.peak:
+        print(f"FAIL: peak above {args.peak} B")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
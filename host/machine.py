@@ -0,0 +1,222 @@
+"""
+machine shim for the host simulation.
+
+UART(port) talks to the simulated modem attached to that port with
+sim868.attach(); Pin, Timer and WDT run on simclock.clock.
+"""
+from simclock import clock
+
+ports = {}  # UART port -> simulated device (see sim868.SIM868)
+pins = {}  # pin id -> current value
+pin_listeners = {}  # pin id -> list of callbacks called with the new value
+poll_quantum_us = 500  # time a UART poll loop spins before it sees new bytes
+
+
+class UART:
+
+    def __init__(self, port, baudrate=115200, rxbuf=256, **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.rxbuf = rxbuf
+        self.fifo = bytearray()
+        self.overruns = 0  # bytes lost because the RX buffer was full
+        self.framing_errors = 0
+        self.handler = None
+
+    def init(self, baudrate=None, rxbuf=None, **kwargs):
+        if baudrate is not None:
+            self.baudrate = baudrate
+        if rxbuf is not None:
+            self.rxbuf = rxbuf
+
+    def deinit(self):
+        pass
+
+    @property
+    def device(self):
+        return ports.get(self.port)
+
+    def byte_us(self):
+        """
+        :return: time in microseconds to transfer one byte (8N1)
+        """
+        return 10000000 / self.baudrate
+
+    def deliver(self):
+        """
+        Moves the bytes the device has finished sending into the RX buffer.
+        """
+        device = self.device
+        if device is None:
+            return
+        data = device.transmit(clock.now(), self)
+        if not data:
+            return
+        room = self.rxbuf - len(self.fifo)
+        if len(data) > room:
+            self.overruns += len(data) - room
+            data = data[:room]
+        self.fifo += data
+        if self.handler:
+            self.handler(self)
+
+    def any(self):
+        clock.service()
+        self.deliver()
+        if not self.fifo:
+            # Nothing yet: spin like a poll loop would, or until the next byte arrives
+            device = self.device
+            next_byte = device.next_byte_time(self) if device else None
+            wait = poll_quantum_us
+            if next_byte is not None:
+                wait = max(wait, next_byte - clock.now())
+            clock.advance(wait)
+            self.deliver()
+        return len(self.fifo)
+
+    def read(self, n=None):
+        self.deliver()
+        if not self.fifo:
+            return None
+        if n is None:
+            n = len(self.fifo)
+        data = bytes(self.fifo[:n])
+        del self.fifo[:n]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        self.deliver()
+        if not self.fifo:
+            return None
+        n = min(len(buf) if nbytes is None else nbytes, len(self.fifo))
+        buf[:n] = self.fifo[:n]
+        del self.fifo[:n]
+        return n
+
+    def readline(self):
+        self.deliver()
+        end = self.fifo.find(b"\n")
+        if end < 0:
+            return self.read()
+        return self.read(end + 1)
+
+    def write(self, buf):
+        data = bytes(buf)
+        device = self.device
+        if device is not None:
+            device.receive(data, clock.now() + int(len(data) * self.byte_us()), self)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def txdone(self):
+        return True
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self.handler = handler
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        pins.setdefault(id, 0)
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return pins[self.id]
+        v = 1 if v else 0
+        if pins[self.id] != v:
+            pins[self.id] = v
+            for callback in pin_listeners.get(self.id, ()):
+                callback(v)
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(1 - pins[self.id])
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.handle = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, freq=None, callback=None):
+        self.deinit()
+        if freq:
+            period = 1000 / freq
+        self.mode = mode
+        self.period = int(period * 1000)
+        self.callback = callback
+        self.schedule()
+
+    def schedule(self):
+        self.handle = clock.call_at(clock.now() + self.period, self.fire)
+
+    def fire(self):
+        self.handle = None
+        if self.mode == Timer.PERIODIC:
+            self.schedule()
+        if self.callback:
+            self.callback(self)
+
+    def deinit(self):
+        if self.handle is not None:
+            clock.cancel(self.handle)
+            self.handle = None
+
+
+class WDT:
+    """
+    Watchdog: counts expirations instead of resetting the host.
+    """
+
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout * 1000
+        self.expired = 0
+        self.handle = None
+        self.feed()
+
+    def feed(self):
+        if self.handle is not None:
+            clock.cancel(self.handle)
+        self.handle = clock.call_at(clock.now() + self.timeout, self.expire)
+
+    def expire(self):
+        self.expired += 1
+        self.handle = clock.call_at(clock.now() + self.timeout, self.expire)
+
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+def soft_reset():
+    raise SystemExit("machine.soft_reset()")
+
+
+def freq():
+    return 125000000
+
+
+def unique_id():
+    return b"\x00\x01\x02\x03\x04\x05\x06\x07"
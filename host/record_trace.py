@@ -0,0 +1,75 @@
+"""
+Records a UART trace of the firmware on the simulated SIM868.
+
+Runs pico_gsm (boot, Listener, Handler, Supervisor, ...) on the simulated
+clock with uarttrace enabled while a scripted scenario plays: calls from a
+stored and an unknown number, an admin SMS and a ?stats query. The trace
+has the same format as one recorded on the Pico and can be replayed with
+host/replay.py.
+
+Usage: python host/record_trace.py [--out trace.bin] [--duration S]
+"""
+import argparse
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+import simenv
+import simloop
+from simclock import clock
+import uarttrace
+
+ADMIN = "+48503815525"
+CONTACTS = ["+48%09d" % (500000000 + i) for i in range(1, 101)]
+
+
+def scenario(model, t):
+    """
+    Schedules the scenario on the model.
+
+    :param t: start time in microseconds
+    """
+    # The model has one call at a time, each one starts when it is due
+    clock.call_at(t + 5000000, lambda: model.call(CONTACTS[41]))
+    clock.call_at(t + 12000000, lambda: model.call("+48600000001"))
+    clock.call_at(t + 20000000, lambda: model.sms(ADMIN, "+600000002"))
+    clock.call_at(t + 30000000, lambda: model.call("+48600000002"))
+    clock.call_at(t + 38000000, lambda: model.sms(ADMIN, "?stats"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "trace.bin"))
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds after the boot")
+    args = parser.parse_args()
+
+    model = simenv.create(contacts=CONTACTS)
+    uarttrace.enabled = True
+    uarttrace.trace_file = os.path.abspath(args.out)
+    start = clock.now()
+    end = start + int(args.duration * 1000000)
+
+    def on_idle():
+        if clock.now() >= end:
+            raise simloop.Stop()
+
+    simloop.install(on_idle)
+    scenario(model, start)
+    sink = io.StringIO()
+    with redirect_stdout(sink):
+        import pico_gsm
+
+        try:
+            pico_gsm.main()
+        except simloop.Stop:
+            pass
+    trace = pico_gsm.modem.trace
+    trace.save()
+    print("%d bytes, %.1f s simulated, %d calls, %d SMS sent -> %s"
+          % (trace.written, (clock.now() - start) / 1000000, len([1 for at, line in model.history if line == "ATH"]),
+             len(model.sent), trace.path))
+
+
+if __name__ == "__main__":
+    main()
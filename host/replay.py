@@ -0,0 +1,349 @@
+"""
+Replays a UART trace recorded with uarttrace against the firmware and profiles it.
+
+The unmodified firmware (pico_gsm: Modem, Listener, Handler, Supervisor, ...)
+runs on CPython on the simulated clock, with a device in place of the modem
+that answers from the trace. Every received chunk is released relative to
+the transmitted bytes recorded before it: with the recorded delay
+(--speed recorded, field timing) or as soon as it could be transferred
+(--speed fast, no modem latency). The bytes the firmware writes are compared
+with the recorded ones, the first difference is reported.
+
+Reports the time per AT command, per URC handler and where the time went:
+firmware CPU, waits for the modem during a command, UART polls without a
+command, utime sleeps and idle time of the event loop. CPU time is the
+host's, compare it between runs rather than with the Pico.
+
+Usage: python host/replay.py TRACE [--speed recorded|fast] [--out results.json]
+"""
+import argparse
+import io
+import json
+import os
+from contextlib import redirect_stdout
+
+import simenv
+import simloop
+from simclock import clock
+import machine
+import linkspeed
+import uarttrace
+from bench_modem import percentile
+
+stall_us = 60000000  # the replay ends when the firmware does not write what the trace waits for
+settle_us = 1000000  # time given to the handlers after the last received chunk
+
+
+def load(path):
+    """
+    :return: tuple (records, saved rate): records as (kind, time since the start in us, data),
+             the rate the firmware switched to before writing anything, None if it did not
+    """
+    records = []
+    t = 0
+    saved = None
+    transmitted = False
+    for kind, dt, data in uarttrace.records(path):
+        t += dt
+        records.append((kind, t, data))
+        if kind == uarttrace.TX:
+            transmitted = True
+        elif kind == uarttrace.RATE and records[0] is not records[-1] and not transmitted:
+            saved = int.from_bytes(data, "little")  # From link.txt of the recording Pico
+    return records, saved
+
+
+class TraceDevice:
+    """
+    Stands in for the modem on machine.UART: releases the received chunks of
+    a trace once the firmware has written the bytes recorded before them.
+    """
+
+    def __init__(self, records, fast=False):
+        self.fast = fast
+        self.chunks = []  # (transmitted bytes before, delay after the last of them in us, data)
+        self.expected = bytearray()  # transmitted bytes of the trace
+        sent = 0
+        sent_at = 0
+        for kind, t, data in records:
+            if kind == uarttrace.TX:
+                self.expected += data
+                sent += len(data)
+                sent_at = t
+            elif kind == uarttrace.RX:
+                self.chunks.append((sent, t - sent_at, data))
+        self.duration = records[-1][1] if records else 0
+        self.start = clock.now()
+        self.next = 0  # next chunk to release
+        self.release = None  # release time of the next chunk, once its bytes were written
+        self.released = self.start  # release time of the previous chunk
+        self.written = bytearray()  # bytes written by the firmware
+        self.writes = []  # (bytes written so far, time the last byte arrived)
+        self.w = 0  # first write that may complete the bytes of the next chunk
+        self.diverged = None  # offset of the first written byte that differs from the trace
+
+    def done(self):
+        return self.next >= len(self.chunks)
+
+    def waiting(self):
+        """
+        :return: number of recorded bytes the next chunk waits for, 0 if it does not wait
+        """
+        if self.done():
+            return 0
+        return max(0, self.chunks[self.next][0] - len(self.written))
+
+    def anchor(self, sent):
+        """
+        :param sent: number of bytes
+        :return: time the firmware finished writing that many bytes, None if it has not yet
+        """
+        if not sent:
+            return self.start
+        while self.w < len(self.writes) and self.writes[self.w][0] < sent:
+            self.w += 1
+        if self.w == len(self.writes):
+            return None
+        return self.writes[self.w][1]
+
+    def release_time(self, uart):
+        """
+        :return: time the next chunk is released, None if it still waits for written bytes
+        """
+        if self.done():
+            return None
+        if self.release is None:
+            sent, delay, data = self.chunks[self.next]
+            anchor = self.anchor(sent)
+            if anchor is None:
+                return None
+            if self.fast:
+                self.release = max(anchor, self.released) + len(data) * uart.byte_us()
+            else:
+                self.release = max(anchor + delay, self.released)
+        return self.release
+
+    # sim868.SIM868 device interface of machine.UART
+
+    def transmit(self, now, uart):
+        out = bytearray()
+        while True:
+            t = self.release_time(uart)
+            if t is None or t > now:
+                break
+            out += self.chunks[self.next][2]
+            self.next += 1
+            self.released = t
+            self.release = None
+        return bytes(out)
+
+    def next_byte_time(self, uart):
+        # Like the model: only a chunk already on the wire, a poll loop does not skip ahead to later ones
+        t = self.release_time(uart)
+        if t is None or t - len(self.chunks[self.next][2]) * uart.byte_us() > clock.now():
+            return None
+        return int(t) + 1
+
+    def receive(self, data, at, uart):
+        start = len(self.written)
+        self.written += data
+        self.writes.append((len(self.written), at))
+        if self.diverged is None:
+            expected = self.expected[start:start + len(data)]
+            for i in range(len(expected)):
+                if data[i] != expected[i]:
+                    self.diverged = start + i
+                    break
+
+
+class Profiler:
+    """
+    Collects the time per AT command and per URC handler and splits the
+    elapsed time by where it went, patching the firmware from the outside.
+    """
+
+    def __init__(self):
+        self.commands = {}  # command -> list of (us, status)
+        self.handlers = {}  # URC name -> list of time splits
+        self.wait_us = 0  # UART polls while an AT command was in progress
+        self.poll_us = 0  # UART polls without a command
+        self.modem = None
+        self.loop = None
+
+    def patch(self, modem_module):
+        profiler = self
+        transaction = modem_module.Transaction
+        start, finish = transaction.start, transaction.finish
+        uart_any = machine.UART.any
+
+        def traced_start(tr, uart):
+            tr.profile_started = clock.now()
+            start(tr, uart)
+
+        def traced_finish(tr, status, error=None):
+            started = getattr(tr, "profile_started", None)
+            if started is not None:
+                profiler.commands.setdefault(command_name(tr), []).append((clock.now() - started, status))
+            finish(tr, status, error)
+
+        def traced_any(uart):
+            skipped = clock.skipped
+            n = uart_any(uart)
+            busy = profiler.modem is not None and profiler.modem.current is not None
+            if busy:
+                profiler.wait_us += clock.skipped - skipped
+            else:
+                profiler.poll_us += clock.skipped - skipped
+            return n
+
+        transaction.start = traced_start
+        transaction.finish = traced_finish
+        machine.UART.any = traced_any
+
+    def wrap_handlers(self, modem):
+        self.modem = modem
+        for name, handler in list(modem.urc_handlers.items()):
+            modem.urc_handlers[name] = self.wrap(name, handler)
+
+    def wrap(self, name, handler):
+        async def traced(line, received=None):
+            before = self.split()
+            try:
+                return await handler(line, received)
+            finally:
+                after = self.split()
+                self.handlers.setdefault(name, []).append({k: after[k] - before[k] for k in after})
+        return traced
+
+    def split(self):
+        """
+        :return: dict of the elapsed time so far in us: total, cpu, modem_wait, poll, sleep, idle
+        """
+        idle = simloop.current.sim_selector.idle_us if simloop.current else 0
+        return {
+            "total": clock.now(),
+            "cpu": clock.now() - clock.skipped,
+            "modem_wait": self.wait_us,
+            "poll": self.poll_us,
+            "sleep": clock.sleep_us,
+            "idle": idle,
+        }
+
+
+def command_name(tr):
+    """
+    :param tr: modem.Transaction
+    :return: command without its arguments, e.g. AT+CPBR=, AT+CREG?, ATH
+    """
+    if tr.cmd is None:
+        return "<data>" if tr.raw is not None else "<wait>"
+    for i, c in enumerate(tr.cmd):
+        if c in "=?":
+            return tr.cmd[:i + 1]
+    return tr.cmd
+
+
+def report(path, speed, device, profiler, totals):
+    ms = lambda us: us / 1000
+    commands = []
+    for name, samples in sorted(profiler.commands.items(), key=lambda item: -sum(us for us, _ in item[1])):
+        times = [us for us, _ in samples]
+        commands.append({
+            "command": name,
+            "count": len(samples),
+            "total_ms": ms(sum(times)),
+            "p50_ms": ms(percentile(times, 50)),
+            "max_ms": ms(max(times)),
+            "timeouts": sum(1 for _, status in samples if status == "TIMEOUT"),
+        })
+    handlers = []
+    for name, calls in sorted(profiler.handlers.items(), key=lambda item: -sum(c["total"] for c in item[1])):
+        entry = {"handler": name, "calls": len(calls)}
+        for key in ("total", "cpu", "modem_wait", "poll", "sleep", "idle"):
+            entry[key + "_ms"] = ms(sum(c[key] for c in calls))
+        handlers.append(entry)
+    return {
+        "trace": path,
+        "speed": speed,
+        "recorded_s": device.duration / 1000000,
+        "replayed_s": totals["total"] / 1000000,
+        "chunks": len(device.chunks),
+        "released": device.next,
+        "diverged_at": device.diverged,
+        "time_ms": {key: ms(value) for key, value in totals.items()},
+        "commands": commands,
+        "handlers": handlers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace")
+    parser.add_argument("--speed", choices=("recorded", "fast"), default="recorded")
+    parser.add_argument("--out", help="JSON results file")
+    args = parser.parse_args()
+
+    records, saved = load(args.trace)
+    simenv.flash()
+    if saved:
+        with open(linkspeed.rate_file, "w") as f:
+            f.write(str(saved))
+    device = TraceDevice(records, args.speed == "fast")
+    machine.ports[0] = device
+    profiler = Profiler()
+    progress = [0, clock.now()]  # released chunks, when the count last changed
+
+    def on_idle():
+        if device.next != progress[0]:
+            progress[:] = [device.next, clock.now()]
+        modem = profiler.modem
+        idle = modem is not None and not modem.busy() and not modem.events
+        if device.done() and idle and clock.now() - device.released >= settle_us:
+            raise simloop.Stop()
+        if clock.now() - progress[1] >= stall_us:
+            raise simloop.Stop()
+
+    simloop.install(on_idle)
+    sink = io.StringIO()
+    with redirect_stdout(sink):
+        import modem as modem_module
+
+        profiler.patch(modem_module)
+        start = profiler.split()
+        import pico_gsm
+
+        profiler.wrap_handlers(pico_gsm.modem)
+        try:
+            pico_gsm.main()
+        except simloop.Stop:
+            pass
+    end = profiler.split()
+    totals = {key: end[key] - start[key] for key in end}
+    res = report(args.trace, args.speed, device, profiler, totals)
+
+    print("%s: %d chunks, %.1f s recorded, replayed in %.1f s (%s)"
+          % (res["trace"], res["chunks"], res["recorded_s"], res["replayed_s"], res["speed"]))
+    if not device.done():
+        print("stalled: chunk %d of %d waits for %d bytes the firmware did not write"
+              % (device.next + 1, len(device.chunks), device.waiting()))
+    if device.diverged is not None:
+        i = device.diverged
+        print("diverged at byte %d: recorded %r, written %r"
+              % (i, bytes(device.expected[i:i + 24]), bytes(device.written[i:i + 24])))
+    print("time: " + ", ".join("%s %.0f ms" % (key, value) for key, value in res["time_ms"].items()))
+    print("%-20s %6s %10s %8s %8s %8s" % ("AT command", "count", "total ms", "p50 ms", "max ms", "timeouts"))
+    for c in res["commands"]:
+        print("%-20s %6d %10.1f %8.1f %8.1f %8d"
+              % (c["command"], c["count"], c["total_ms"], c["p50_ms"], c["max_ms"], c["timeouts"]))
+    print("%-20s %6s %10s %8s %10s %8s %8s" % ("handler", "calls", "total ms", "cpu ms", "wait ms", "poll ms", "sleep ms"))
+    for h in res["handlers"]:
+        print("%-20s %6d %10.1f %8.1f %10.1f %8.1f %8.1f"
+              % (h["handler"], h["calls"], h["total_ms"], h["cpu_ms"], h["modem_wait_ms"], h["poll_ms"], h["sleep_ms"]))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(res, f, indent=2)
+        print("results written to", os.path.abspath(args.out))
+
+
+if __name__ == "__main__":
+    main()
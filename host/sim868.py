@@ -0,0 +1,711 @@
+"""
+Scriptable SIM868 model for the host simulation.
+
+Answers the AT commands the firmware uses (phonebook, SMS storage, text
+mode SMS, call control, registration) with configurable per-command
+latency, transfers every byte at the simulated baud rate and can inject
+URCs (RING/+CLIP, +CMTI, +CMT, status) and faults.
+
+    model = sim868.SIM868()
+    sim868.attach(model)  # machine.UART(0, ...) now talks to the model
+    model.add_contact("+48503815525")
+    model.call("+48503815525")
+"""
+from collections import deque
+
+import machine
+from simclock import clock
+
+INTERNATIONAL = 145
+UNKNOWN = 129
+RATES = (0, 1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200, 230400, 460800)  # AT+IPR, 0 is autobaud
+
+
+def split_args(text):
+    """
+    Splits AT command arguments on commas outside of quotes.
+
+    :param text: argument string, e.g. 1,"+48503815525",145,"a,b"
+    :return: list of arguments with quotes removed
+    """
+    args = []
+    current = ""
+    quoted = False
+    for c in text:
+        if c == '"':
+            quoted = not quoted
+        elif c == "," and not quoted:
+            args.append(current)
+            current = ""
+        else:
+            current += c
+    args.append(current)
+    return [a.strip() for a in args]
+
+
+def ucs2(text):
+    """
+    :param text: text
+    :return: text in the UCS2 character set (hex encoded UTF-16BE)
+    """
+    return text.encode("utf-16-be").hex().upper()
+
+
+class SIM868:
+
+    def __init__(self, baud=115200, pb_size=250, sms_size=30, latency_ms=20, boot_ms=3000, error_baud=None,
+                 error_interval=200, register_ms=0):
+        self.baud = baud
+        self.pb_size = pb_size
+        self.sms_size = sms_size
+        self.boot_ms = boot_ms
+        self.register_ms = register_ms  # network registration after Call Ready
+        self.boots = 0  # power-ons and resets, timers of an earlier boot are ignored
+        # Per-command processing time in milliseconds, by command name (+CPBR, H, ...),
+        # "SEND" is the network time of AT+CMGS after the message body
+        self.latency = {"default": latency_ms, "SEND": 1500, "+CFUN": 200, "+CIICR": 1000}
+        self.slot_read_ms = 1  # extra time per slot of a ranged AT+CPBR read
+        self.message_read_ms = 5  # extra time per message of AT+CMGL
+        self.error_baud = error_baud  # rates above this lose bytes in both directions, like a long or noisy line
+        self.error_interval = error_interval  # every n-th byte is lost above error_baud
+        self.line_bytes = 0  # bytes transferred above error_baud
+
+        self.phonebook = {}  # slot -> (number, type, text)
+        self.messages = {}  # index -> [stat, sender, timestamp, text, dcs]
+        self.sent = []  # (number, text) of messages sent with AT+CMGS
+        self.mr = 0
+
+        self.powered = True
+        self.ready = True  # finished booting
+        self.sim_ready = True
+        self.registered = True
+        self.roaming = False  # registered to a visited network, +CREG: stat 5
+        self.echo = True
+        self.cmgf = 1
+        self.cscs = "GSM"
+        self.csdh = 0
+        self.clip = 0
+        self.creg = 0
+        self.cnmi = [2, 1, 0, 0, 0]
+        self.call_active = False
+        self.ring_handle = None
+
+        self.failures = {}  # command name -> [count, error]
+        self.drops = {}  # command name -> count
+        self.lost_sms = 0
+
+        self.wire = deque()  # [start_us, data, sent, baud] chunks waiting to be transferred
+        self.wire_end = 0
+        self.input = b""
+        self.recipient = None  # AT+CMGS recipient while the message body is being typed
+        self.body_data = b""
+        self.uart = None
+
+        self.bytes_rx = 0  # bytes received from the host
+        self.bytes_tx = 0  # bytes sent to the host
+        self.commands = {}  # command name -> count
+        self.history = []  # (time_us, command line) of every command received
+
+    # ------------------------------------------------------------------ wire
+
+    def byte_us(self):
+        return 10000000 / self.baud
+
+    def emit(self, data, at=None):
+        """
+        Queues bytes to be sent to the host.
+
+        :param data: bytes or str
+        :param at: time in microseconds when the modem starts sending, default now
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        if not data:
+            return
+        start = max(clock.now() if at is None else at, self.wire_end)
+        self.wire.append([start, data, 0, self.baud])
+        self.wire_end = start + len(data) * self.byte_us()
+
+    def emit_lines(self, lines, at=None):
+        self.emit("".join("\r\n%s\r\n" % line for line in lines), at)
+
+    def urc(self, line, at=None):
+        """
+        Injects an unsolicited result code.
+
+        :param line: URC line, e.g. "NORMAL POWER DOWN"
+        :param at: time in microseconds, default now
+        """
+        self.emit_lines([line], at)
+
+    def transmit(self, now, uart):
+        """
+        Called by machine.UART: returns the bytes that have been fully sent by now.
+        """
+        out = bytearray()
+        while self.wire:
+            chunk = self.wire[0]
+            start, data, sent, baud = chunk
+            done = min(len(data), int((now - start) * baud / 10000000))
+            if done > sent:
+                part = data[sent:done]
+                chunk[2] = done
+                self.bytes_tx += len(part)
+                if uart.baudrate != baud:
+                    # Baud rate mismatch: the host only sees framing errors
+                    uart.framing_errors += len(part)
+                    part = b"\xff" * len(part)
+                else:
+                    kept = self.line_errors(part, baud)
+                    uart.framing_errors += len(part) - len(kept)
+                    part = kept
+                out += part
+            if done < len(data):
+                break
+            self.wire.popleft()
+        return bytes(out)
+
+    def line_errors(self, data, baud):
+        """
+        Drops the bytes lost on a line that is too slow for the rate, the UART
+        discards bytes with a framing error.
+
+        :param data: bytes sent
+        :param baud: rate they were sent at
+        :return: the bytes that got through
+        """
+        if self.error_baud is None or baud <= self.error_baud:
+            return data
+        kept = bytearray()
+        for c in data:
+            self.line_bytes += 1
+            if self.line_bytes % self.error_interval:
+                kept.append(c)
+        return kept
+
+    def next_byte_time(self, uart):
+        """
+        :return: time in microseconds when the next byte is complete, None if nothing is queued
+        """
+        if not self.wire:
+            return None
+        start, data, sent, baud = self.wire[0]
+        return int(start + (sent + 1) * 10000000 / baud) + 1
+
+    def receive(self, data, at, uart):
+        """
+        Called by machine.UART.write with bytes from the host.
+
+        :param data: bytes written
+        :param at: time in microseconds when the last byte arrives
+        :param uart: writing UART
+        """
+        self.bytes_rx += len(data)
+        self.uart = uart
+        if not self.powered or uart.baudrate != self.baud:
+            return
+        data = bytes(self.line_errors(data, self.baud))
+        if self.recipient is not None:
+            self.typing(data, at)
+            return
+        self.input += data
+        while b"\r" in self.input:
+            line, self.input = self.input.split(b"\r", 1)
+            line = line.strip(b"\n").decode("utf-8", "replace").strip()
+            if line:
+                self.command(line, at)
+                if self.recipient is not None:
+                    rest, self.input = self.input.lstrip(b"\n"), b""
+                    if rest:
+                        self.typing(rest, at)
+                    return
+
+    # -------------------------------------------------------------- commands
+
+    def command(self, line, at):
+        if not self.ready:
+            return
+        if self.echo:
+            self.emit(line + "\r", at)
+
+        upper = line.upper()
+        if not upper.startswith("AT"):
+            self.emit_lines(["ERROR"], at)
+            return
+        body = line[2:]
+        if body.startswith("+"):
+            name = "+"
+            for c in body[1:]:
+                if c in "=?":
+                    break
+                name += c
+            name = name.upper()
+            rest = body[len(name):]
+        else:
+            name = body[:1].upper()  # E, H, I, Z, ...
+            rest = body[1:]
+        name = name or "AT"  # plain AT
+        self.commands[name] = self.commands.get(name, 0) + 1
+        self.history.append((at, line))
+        at += self.latency.get(name, self.latency["default"]) * 1000
+
+        drop = self.drops.get(name)
+        if drop:
+            self.drops[name] = drop - 1
+            return
+        failure = self.failures.get(name)
+        if failure and failure[0]:
+            failure[0] -= 1
+            self.emit_lines([failure[1]], at)
+            return
+
+        handler = getattr(self, "at_" + name.strip("+").replace("&", "_").lower(), None)
+        if handler is None:
+            self.emit_lines(["ERROR"], at)
+            return
+        try:
+            result = handler(rest, at)
+        except (ValueError, IndexError, KeyError):
+            result = ([], "ERROR")
+        if result is None:
+            return
+        lines, final = result
+        if isinstance(final, tuple):  # (final result code, extra delay in microseconds)
+            final, extra = final
+            at += extra
+        self.emit_lines(lines + ([final] if final else []), at)
+
+    def at_at(self, rest, at):
+        return [], "OK"
+
+    def at_e(self, rest, at):
+        self.echo = rest.strip() != "0"
+        return [], "OK"
+
+    def at_h(self, rest, at):
+        self.hang_up()
+        return [], "OK"
+
+    def at_i(self, rest, at):
+        return ["SIM868 R14.18"], "OK"
+
+    def at_z(self, rest, at):
+        return [], "OK"
+
+    def at__(self, rest, at):
+        return [], "OK"
+
+    def at_cfun(self, rest, at):
+        if rest == "?":
+            return ["+CFUN: 1"], "OK"
+        args = split_args(rest[1:])
+        if len(args) > 1 and args[1] == "1":
+            clock.call_at(at + 100000, lambda: self.boot(clock.now()))
+        return [], "OK"
+
+    def at_cpin(self, rest, at):
+        if not self.sim_ready:
+            return [], "+CME ERROR: 10"
+        return ["+CPIN: READY"], "OK"
+
+    def at_csq(self, rest, at):
+        return ["+CSQ: 20,0" if self.registered else "+CSQ: 99,99"], "OK"
+
+    def at_cops(self, rest, at):
+        if rest == "?":
+            return ['+COPS: 0,0,"Orange PL"' if self.registered else "+COPS: 0"], "OK"
+        return [], "OK"
+
+    def at_creg(self, rest, at):
+        if rest == "?":
+            return ["+CREG: %d,%d" % (self.creg, self.creg_stat())], "OK"
+        self.creg = int(rest[1:])
+        return [], "OK"
+
+    def creg_stat(self):
+        if not self.registered:
+            return 0
+        return 5 if self.roaming else 1
+
+    def at_cstt(self, rest, at):
+        if rest == "?":
+            return ['+CSTT: "internet","",""'], "OK"
+        return [], "OK"
+
+    def at_ciicr(self, rest, at):
+        return [], "OK"
+
+    def at_cifsr(self, rest, at):
+        return ["10.64.0.2"], None
+
+    def at_cipshut(self, rest, at):
+        return ["SHUT OK"], None
+
+    def at_clip(self, rest, at):
+        if rest == "?":
+            return ["+CLIP: %d,1" % self.clip], "OK"
+        self.clip = int(rest[1:])
+        return [], "OK"
+
+    def at_cmgf(self, rest, at):
+        if rest == "?":
+            return ["+CMGF: %d" % self.cmgf], "OK"
+        self.cmgf = int(rest[1:])
+        return [], "OK"
+
+    def at_cscs(self, rest, at):
+        if rest == "?":
+            return ['+CSCS: "%s"' % self.cscs], "OK"
+        self.cscs = split_args(rest[1:])[0]
+        return [], "OK"
+
+    def at_csdh(self, rest, at):
+        if rest == "?":
+            return ["+CSDH: %d" % self.csdh], "OK"
+        self.csdh = int(rest[1:])
+        return [], "OK"
+
+    def at_cnmi(self, rest, at):
+        if rest == "?":
+            return ["+CNMI: " + ",".join(str(x) for x in self.cnmi)], "OK"
+        args = [int(x) for x in split_args(rest[1:]) if x]
+        self.cnmi[:len(args)] = args
+        return [], "OK"
+
+    def at_ipr(self, rest, at):
+        if rest == "?":
+            return ["+IPR: %d" % self.baud], "OK"
+        rate = int(rest[1:])
+        if rate not in RATES:
+            return [], "ERROR"
+        if not rate:
+            return [], "OK"  # Autobaud is not modeled, the rate stays
+        # OK is sent at the old rate, the new one applies afterwards
+        self.emit_lines(["OK"], at)
+        clock.call_at(int(self.wire_end) + 1, lambda: setattr(self, "baud", rate))
+        return None
+
+    # ------------------------------------------------------------- phonebook
+
+    def at_cpbs(self, rest, at):
+        if rest == "?":
+            return ['+CPBS: "SM",%d,%d' % (len(self.phonebook), self.pb_size)], "OK"
+        return [], "OK"
+
+    def entry_line(self, slot):
+        number, number_type, text = self.phonebook[slot]
+        if self.cscs == "UCS2":
+            number, text = ucs2(number), ucs2(text)
+        return '+CPBR: %d,"%s",%d,"%s"' % (slot, number, number_type, text)
+
+    def at_cpbr(self, rest, at):
+        if rest == "=?":
+            return ["+CPBR: (1-%d),40,14" % self.pb_size], "OK"
+        args = split_args(rest[1:])
+        start = int(args[0])
+        end = int(args[1]) if len(args) > 1 else start
+        if start < 1 or end > self.pb_size or start > end:
+            return [], "+CME ERROR: 21"
+        lines = [self.entry_line(i) for i in range(start, end + 1) if i in self.phonebook]
+        return lines, ("OK", (end - start + 1) * self.slot_read_ms * 1000)
+
+    def at_cpbw(self, rest, at):
+        args = split_args(rest[1:])
+        if not args[0]:
+            free = [i for i in range(1, self.pb_size + 1) if i not in self.phonebook]
+            if not free:
+                return [], "+CME ERROR: 20"
+            slot = free[0]
+        else:
+            slot = int(args[0])
+        if slot < 1 or slot > self.pb_size:
+            return [], "+CME ERROR: 21"
+        if len(args) == 1:
+            self.phonebook.pop(slot, None)
+        else:
+            number = args[1]
+            number_type = int(args[2]) if len(args) > 2 and args[2] else (INTERNATIONAL if number.startswith("+") else UNKNOWN)
+            text = args[3] if len(args) > 3 else ""
+            self.phonebook[slot] = (number, number_type, text)
+        return [], "OK"
+
+    def add_contact(self, number, text="", slot=None):
+        """
+        Stores a contact directly, as if written from a phone.
+
+        :return: slot
+        """
+        if slot is None:
+            slot = min(i for i in range(1, self.pb_size + 1) if i not in self.phonebook)
+        self.phonebook[slot] = (number, INTERNATIONAL if number.startswith("+") else UNKNOWN, text)
+        return slot
+
+    # ------------------------------------------------------------------- SMS
+
+    def header_fields(self, sender, timestamp, text, dcs, short=False):
+        """
+        :param short: +CMGL: header, AT+CSDH=1 only adds type of address and length
+        """
+        tooa = INTERNATIONAL if sender.startswith("+") else UNKNOWN
+        if self.cscs == "UCS2":
+            sender = ucs2(sender)
+        fields = '"%s","","%s"' % (sender, timestamp)
+        length = len(text) * 2 if dcs == 8 else len(text)
+        if self.csdh and short:
+            fields += ",%d,%d" % (tooa, length)
+        elif self.csdh:
+            fields += ',%d,17,0,%d,"+48790998250",145,%d' % (tooa, dcs, length)
+        return fields
+
+    def encode_text(self, text, dcs):
+        return ucs2(text) if dcs == 8 or self.cscs == "UCS2" else text
+
+    def at_cmgr(self, rest, at):
+        index = int(rest[1:])
+        message = self.messages.get(index)
+        if message is None:
+            return [], "OK"
+        stat, sender, timestamp, text, dcs = message
+        message[0] = "REC READ"
+        return ['+CMGR: "%s",%s' % (stat, self.header_fields(sender, timestamp, text, dcs)), self.encode_text(text, dcs)], "OK"
+
+    def at_cmgl(self, rest, at):
+        wanted = split_args(rest[1:])[0] if rest.startswith("=") else "REC UNREAD"
+        lines = []
+        for index in sorted(self.messages):
+            message = self.messages[index]
+            stat, sender, timestamp, text, dcs = message
+            if wanted != "ALL" and stat != wanted:
+                continue
+            lines.append('+CMGL: %d,"%s",%s' % (index, stat, self.header_fields(sender, timestamp, text, dcs, True)))
+            lines.append(self.encode_text(text, dcs))
+            message[0] = "REC READ"
+        return lines, ("OK", len(lines) // 2 * self.message_read_ms * 1000)
+
+    def at_cmgd(self, rest, at):
+        args = split_args(rest[1:])
+        index = int(args[0])
+        flag = int(args[1]) if len(args) > 1 else 0
+        if flag == 0:
+            self.messages.pop(index, None)
+        else:
+            stats = {1: ("REC READ",), 2: ("REC READ", "STO SENT"), 3: ("REC READ", "STO SENT", "STO UNSENT")}.get(flag)
+            for i in list(self.messages):
+                if stats is None or self.messages[i][0] in stats:
+                    del self.messages[i]
+        return [], "OK"
+
+    def at_cpms(self, rest, at):
+        used = len(self.messages)
+        return ['+CPMS: "SM",%d,%d,"SM",%d,%d,"SM",%d,%d' % ((used, self.sms_size) * 3)], "OK"
+
+    def at_csmp(self, rest, at):
+        return [], "OK"
+
+    def at_cmgs(self, rest, at):
+        self.recipient = split_args(rest[1:])[0]
+        self.body_data = b""
+        self.emit("\r\n> ", at)
+        return None
+
+    def typing(self, data, at):
+        """
+        Collects the message body after the > prompt until Ctrl-Z (send) or ESC (cancel).
+        """
+        self.body_data += data
+        if self.echo:
+            self.emit(data.replace(b"\x1a", b"").replace(b"\x1b", b""), at)
+        if b"\x1b" in self.body_data:
+            self.recipient = None
+            self.emit_lines(["OK"], at)
+            return
+        if b"\x1a" not in self.body_data:
+            return
+        text = self.body_data.split(b"\x1a", 1)[0].decode("utf-8", "replace")
+        number = self.recipient
+        self.recipient = None
+        at += self.latency.get("SEND", self.latency["default"]) * 1000
+        failure = self.failures.get("SEND")
+        if failure and failure[0]:
+            failure[0] -= 1
+            self.emit_lines([failure[1]], at)
+            return
+        self.sent.append((number, text))
+        self.history.append((at, "SEND " + number))
+        self.mr = (self.mr + 1) % 256
+        self.emit_lines(["+CMGS: %d" % self.mr, "OK"], at)
+
+    def sms(self, sender, text, timestamp="24/05/17,12:00:00+08", at=None, ucs2=False):
+        """
+        Delivers an incoming SMS: +CMT: directly or stored and announced with +CMTI:,
+        depending on AT+CNMI.
+
+        :param ucs2: UCS2 coded message (data coding scheme 8) instead of GSM 7 bit
+        :return: storage index, or None if the message was not stored
+        """
+        at = clock.now() if at is None else at
+        dcs = 8 if ucs2 else 0
+        if self.cnmi[1] == 2:
+            header = self.header_fields(sender, timestamp, text, dcs)
+            body = self.encode_text(text, dcs).replace("\n", "\r\n")
+            self.emit("\r\n+CMT: %s\r\n%s\r\n" % (header, body), at)
+            return None
+        free = [i for i in range(1, self.sms_size + 1) if i not in self.messages]
+        if not free:
+            self.lost_sms += 1
+            return None
+        index = free[0]
+        self.messages[index] = ["REC UNREAD", sender, timestamp, text, dcs]
+        if self.cnmi[1] == 1:
+            self.urc('+CMTI: "SM",%d' % index, at)
+        return index
+
+    # ----------------------------------------------------------------- calls
+
+    def call(self, number, rings=3, interval_ms=3000, at=None):
+        """
+        Incoming call: RING (+CLIP: if enabled) every interval until the host hangs
+        up with ATH or the caller gives up after the given number of rings.
+        """
+        self.call_active = True
+        at = clock.now() if at is None else at
+
+        def ring(left):
+            self.ring_handle = None
+            if not self.call_active:
+                return
+            if left <= 0:
+                self.call_active = False
+                self.urc("NO CARRIER")
+                return
+            lines = ["RING"]
+            if self.clip:
+                lines.append('+CLIP: "%s",%d,"",0,"",0' % (number, INTERNATIONAL if number.startswith("+") else UNKNOWN))
+            self.emit_lines(lines)
+            self.ring_handle = clock.call_at(clock.now() + interval_ms * 1000, lambda: ring(left - 1))
+
+        self.ring_handle = clock.call_at(at, lambda: ring(rings))
+
+    def hang_up(self):
+        self.call_active = False
+        if self.ring_handle is not None:
+            clock.cancel(self.ring_handle)
+            self.ring_handle = None
+
+    # ---------------------------------------------------------------- faults
+
+    def fail(self, name, count=1, error="ERROR"):
+        """
+        Makes the next count commands with the given name (AT+CPBW -> "+CPBW") fail.
+        "SEND" fails the message body step of AT+CMGS after the > prompt.
+        """
+        self.failures[name] = [count, error]
+
+    def drop(self, name, count=1):
+        """
+        Makes the modem ignore the next count commands with the given name.
+        """
+        self.drops[name] = count
+
+    def power_down(self):
+        self.urc("NORMAL POWER DOWN")
+        self.boots += 1
+        self.powered = False
+        self.ready = False
+        self.registered = False
+        self.hang_up()
+
+    def boot(self, at=None):
+        """
+        Power on / reset: unresponsive until RDY, registered register_ms after Call Ready.
+        """
+        at = clock.now() if at is None else at
+        self.powered = True
+        self.ready = False
+        self.registered = False
+        self.echo = True
+        self.clip = 0
+        self.cmgf = 0
+        self.hang_up()
+        self.wire.clear()
+        self.wire_end = at
+        self.input = b""
+        self.recipient = None
+        self.boots += 1
+        boot = self.boots
+
+        def rdy():
+            if boot != self.boots:
+                return
+            self.ready = True
+            self.urc("RDY")
+            self.urc("+CFUN: 1")
+            self.urc("+CPIN: READY" if self.sim_ready else "+CPIN: NOT INSERTED")
+
+        def call_ready():
+            if boot != self.boots:
+                return
+            if not self.register_ms:
+                self.registered = self.sim_ready
+            if self.sim_ready:
+                self.urc("Call Ready")
+                self.urc("SMS Ready")
+            if self.register_ms:
+                clock.call_at(clock.now() + self.register_ms * 1000, registered)
+            else:
+                registered()
+
+        def registered():
+            if boot != self.boots or not self.powered:
+                return
+            self.registered = self.sim_ready
+            if self.creg:
+                self.urc("+CREG: %d" % self.creg_stat())
+
+        clock.call_at(at + self.boot_ms * 300, rdy)
+        clock.call_at(at + self.boot_ms * 1000, call_ready)
+
+    def power_key(self, pulse_ms):
+        """
+        PWRKEY pulse from the host: toggles the power.
+        """
+        if pulse_ms < 1000:
+            return
+        if self.powered:
+            self.power_down()
+        else:
+            self.boot()
+
+    def remove_sim(self):
+        self.sim_ready = False
+        self.registered = False
+        self.urc("+CPIN: NOT INSERTED")
+
+    def deregister(self):
+        self.registered = False
+        if self.creg:
+            self.urc("+CREG: 2")
+
+    def register(self):
+        self.registered = True
+        if self.creg:
+            self.urc("+CREG: %d" % self.creg_stat())
+
+
+def attach(model, port=0, pwr_pin=14):
+    """
+    Connects a model to machine.UART(port) and its power key to machine.Pin(pwr_pin).
+
+    :return: the model
+    """
+    machine.ports[port] = model
+    pressed = {}
+
+    def power_key(value):
+        if value:
+            pressed["at"] = clock.now()
+        elif "at" in pressed:
+            model.power_key((clock.now() - pressed.pop("at")) // 1000)
+
+    machine.pin_listeners[pwr_pin] = [power_key]
+    return model
@@ -0,0 +1,92 @@
+"""
+Clock of the host simulation.
+
+Time is real elapsed time plus everything that was skipped: sleeps and
+waits for the simulated modem return immediately and move the clock
+forward instead. Code under test therefore measures its own CPU cost as on
+a real board while waiting costs nothing.
+"""
+import heapq
+import time
+
+
+class Clock:
+
+    def __init__(self, realtime=False):
+        self.t0 = time.perf_counter()
+        self.skipped = 0  # microseconds skipped by sleeps and waits
+        self.realtime = realtime  # sleep for real instead of skipping
+        self.timers = []  # heap of (due_us, seq, callback)
+        self.seq = 0
+        self.sleep_us = 0  # total time spent in utime.sleep*()
+        self.firing = False
+
+    def now(self):
+        """
+        :return: current time in microseconds
+        """
+        return int((time.perf_counter() - self.t0) * 1000000) + self.skipped
+
+    def service(self):
+        """
+        Runs the callbacks of timers that are due.
+        """
+        if self.firing:
+            return
+        self.firing = True
+        try:
+            while self.timers and self.timers[0][0] <= self.now():
+                _, _, callback = heapq.heappop(self.timers)
+                callback()
+        finally:
+            self.firing = False
+
+    def advance(self, us):
+        """
+        Moves the clock forward, running due timers in order on the way.
+
+        :param us: time in microseconds
+        """
+        if us <= 0:
+            self.service()
+            return
+        if self.realtime:
+            time.sleep(us / 1000000)
+            self.service()
+            return
+        target = self.now() + us
+        while self.timers and self.timers[0][0] <= target:
+            due = self.timers[0][0]
+            if due > self.now():
+                self.skipped += due - self.now()
+            self.service()
+        if target > self.now():
+            self.skipped += target - self.now()
+        self.service()
+
+    def advance_to(self, t):
+        """
+        :param t: time in microseconds to move the clock to
+        """
+        self.advance(t - self.now())
+
+    def call_at(self, due, callback):
+        """
+        Schedules a callback.
+
+        :param due: time in microseconds
+        :param callback: function without arguments
+        :return: handle for cancel()
+        """
+        self.seq += 1
+        entry = (due, self.seq, callback)
+        heapq.heappush(self.timers, entry)
+        return entry
+
+    def cancel(self, handle):
+        if handle in self.timers:
+            self.timers.remove(handle)
+            heapq.heapify(self.timers)
+
+
+clock = Clock()
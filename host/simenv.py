@@ -0,0 +1,69 @@
+"""
+Host simulation environment.
+
+Importing this module puts the machine/utime shims of this directory and
+the firmware modules of the repository on sys.path, so the unmodified
+Modem runs on CPython against a simulated SIM868:
+
+    import simenv
+    model = simenv.create()
+    from modem import Modem
+    modem = Modem(0, 115200)
+
+CPython's built-in _thread already provides allocate_lock and
+start_new_thread, so it needs no shim.
+"""
+import os
+import sys
+import tempfile
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HOST)
+
+for path in (ROOT, HOST):
+    if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, path)
+
+import accesslog
+import authstore
+import linkspeed
+import machine
+import modem
+import sim868
+import uarttrace
+from simclock import clock
+
+
+def flash():
+    """
+    Points the firmware files (authorized number store, access log, link
+    rate, UART trace, stats dump) to a fresh temporary directory.
+
+    :return: directory path
+    """
+    path = tempfile.mkdtemp(prefix="pico_flash_")
+    authstore.auth_file = os.path.join(path, "auth.bin")
+    authstore.auth_log = os.path.join(path, "auth.log")
+    accesslog.segment_file = os.path.join(path, "access%d.bin")
+    linkspeed.rate_file = os.path.join(path, "link.txt")
+    uarttrace.trace_file = os.path.join(path, "trace.bin")
+    modem.stats_file = os.path.join(path, "stats.txt")
+    return path
+
+
+def create(port=0, contacts=(), **kwargs):
+    """
+    Creates a SIM868 model and attaches it to machine.UART(port).
+
+    :param port: UART port
+    :param contacts: numbers stored in the phonebook, from slot 1
+    :param kwargs: SIM868 arguments (baud, pb_size, sms_size, latency_ms, boot_ms,
+                   error_baud, error_interval, register_ms)
+    :return: SIM868
+    """
+    flash()
+    model = sim868.SIM868(**kwargs)
+    for number in contacts:
+        model.add_contact(number)
+    return sim868.attach(model, port)
@@ -0,0 +1,83 @@
+"""
+asyncio event loop on simclock for the host simulation.
+
+The loop reads the time from simclock.clock and, instead of blocking in
+select() until the next timer, moves the clock forward to it. The asyncio
+tasks of the firmware (pico_gsm with scheduler.Scheduler) therefore run
+against the simulated modem without waiting in real time:
+
+    import simloop
+    simloop.install()
+    import pico_gsm
+    pico_gsm.main()  # asyncio.run() now creates a SimLoop
+"""
+import asyncio
+import selectors
+
+from simclock import clock
+
+current = None  # the SimLoop created last
+
+
+class Stop(BaseException):
+    """
+    Raised by an on_idle callback to end the loop, passes through the
+    firmware's except Exception handlers.
+    """
+
+
+class SimSelector(selectors.SelectSelector):
+
+    def __init__(self):
+        super().__init__()
+        self.idle_us = 0  # time skipped while every task was waiting
+        self.on_idle = None  # called before the clock moves forward, may raise Stop
+        self.stopped = False
+
+    def select(self, timeout=None):
+        ready = super().select(0)  # call_soon_threadsafe() wakeups
+        if ready or timeout == 0 or self.stopped:
+            return ready
+        if self.on_idle is not None:
+            try:
+                self.on_idle()
+            except Stop:
+                self.stopped = True  # Raised once, the tasks are cancelled without waiting
+                raise
+        t = clock.now()
+        clock.advance(1000 if timeout is None else int(timeout * 1000000))
+        self.idle_us += clock.now() - t
+        return ready
+
+
+class SimLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, on_idle=None):
+        global current
+        self.sim_selector = SimSelector()
+        self.sim_selector.on_idle = on_idle
+        super().__init__(self.sim_selector)
+        current = self
+
+    def time(self):
+        return clock.now() / 1000000
+
+
+class SimPolicy(asyncio.DefaultEventLoopPolicy):
+
+    def __init__(self, on_idle=None):
+        super().__init__()
+        self.on_idle = on_idle
+
+    def new_event_loop(self):
+        return SimLoop(self.on_idle)
+
+
+def install(on_idle=None):
+    """
+    Makes asyncio.run() and new_event_loop() create a SimLoop.
+
+    :param on_idle: called whenever every task waits, before the clock moves
+                    forward, raise Stop in it to end the loop
+    """
+    asyncio.set_event_loop_policy(SimPolicy(on_idle))
@@ -0,0 +1,61 @@
+"""
+Access log on the +CLIP: path: ATH is queued before the decision is logged,
+a burst of calls is kept in RAM without flash writes, records past the RAM
+batches are dropped and counted, and the idle flush writes the rest.
+
+Usage: python -m pytest host/test_accesslog.py
+"""
+import os
+
+import simenv
+import accesslog
+import metrics
+from accesslog import AccessLog, OPENED, DENIED
+from bench_modem import Bench
+from simclock import clock
+
+
+def test_ath_before_log():
+    bench = Bench()
+    modem = bench.modem
+    order = []
+    begin, add = modem.begin, modem.access.add
+    modem.begin = lambda command, **kwargs: order.append(command) or begin(command, **kwargs)
+    modem.access.add = lambda *args: order.append("log") or add(*args)
+    t = clock.now()
+    bench.model.call(bench.numbers[0], at=t)
+    bench.run_until(lambda: bench.commands_since(t, "ATH"))
+    assert order[:2] == ["ATH", "log"]
+    assert modem.access.latest(1)[0][1:3] == (48500000001, OPENED)
+
+
+def test_burst_stays_in_ram():
+    bench = Bench()
+    modem = bench.modem
+    capacity = accesslog.ram_batches * accesslog.batch_records
+    calls = capacity + 5
+    for i in range(calls):
+        t = clock.now()
+        bench.model.call("+48%09d" % (600000000 + i), at=t)
+        bench.run_until(lambda: bench.commands_since(t, "ATH"))
+        clock.advance(3000000)  # under the global ring limit
+    assert not os.path.exists(accesslog.segment_file % 0)  # nothing written during the calls
+    assert modem.access.pending == capacity
+    assert modem.access.dropped == metrics.counters["access_dropped"] == calls - capacity
+    assert modem.access.flush() == capacity
+    assert len(modem.access) == capacity
+    assert [r[1] for r in modem.access.latest(2)] == [48600000000 + capacity - 1, 48600000000 + capacity - 2]
+
+
+def test_flush_across_segments():
+    simenv.flash()
+    log = AccessLog()
+    added = 0
+    while added < accesslog.segment_records + 40:
+        for _ in range(accesslog.ram_batches * accesslog.batch_records):
+            assert log.add(48600000000 + added, DENIED)
+            added += 1
+        log.flush()
+    assert len(log) == added
+    assert log.latest(1)[0][1] == 48600000000 + added - 1
+    assert len(AccessLog()) == added  # reopened from the segment headers
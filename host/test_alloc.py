@@ -0,0 +1,111 @@
+"""
+Steady-state allocation check of the call path on the simulated SIM868.
+
+Runs calls from an authorized number through the firmware main loop (poll,
+dispatch, the housekeeping between calls) and checks with tracemalloc that, after a warm-up:
+
+- memory held by the firmware modules does not grow with the number of calls
+- the peak of memory allocated while a call is handled stays under a bound
+
+Usage: python -m pytest host/test_alloc.py, or python host/check_alloc.py for the numbers
+"""
+import io
+import os
+import tracemalloc
+from contextlib import redirect_stdout
+
+import pytest
+
+import simenv
+from simclock import clock
+from modem import run_sync
+
+CALLER = "+48500000001"
+CALLS = 200
+WARMUP = 50
+GROWTH_MAX = 2048  # allowed growth of firmware memory, bytes
+PEAK_MAX = 16384  # allowed peak allocation per call, bytes
+
+
+def firmware_bytes(snapshot):
+    """
+    :return: bytes held by allocations made in the firmware modules (repository root)
+    """
+    filters = [
+        tracemalloc.Filter(True, os.path.join(simenv.ROOT, "*.py")),
+        tracemalloc.Filter(False, os.path.join(simenv.HOST, "*")),
+    ]
+    return sum(stat.size for stat in snapshot.filter_traces(filters).statistics("filename"))
+
+
+def measure(calls=CALLS, warmup=WARMUP):
+    """
+    :param calls: measured calls
+    :param warmup: calls before the baseline is taken
+    :return: dict of growth_half (bytes after calls // 2), growth, peak (bytes) and gate pulses
+    """
+    model = simenv.create(contacts=[CALLER])
+    from modem import Modem
+
+    sink = io.StringIO()
+    with redirect_stdout(sink):
+        modem = Modem(0, 115200)
+        run_sync(modem.init_device())
+
+    def call():
+        t = clock.now()
+        model.call(CALLER, at=t)
+        with redirect_stdout(sink):
+            while not any(at >= t and line.startswith("ATH") for at, line in model.history) or modem.busy():
+                modem.poll()
+                run_sync(modem.dispatch())
+        sink.seek(0)
+        sink.truncate()
+
+    def idle():
+        # Housekeeping of the main loop between calls, not part of the call path
+        modem.access.flush()
+        clock.advance(6000000)  # past the gate lockout
+        modem.poll()
+
+    # Traced from the start, so that buffers filled during the warm-up (log ring,
+    # histograms) count as the baseline and not as growth once they wrap
+    tracemalloc.start(1)
+    try:
+        for _ in range(warmup):
+            model.history.clear()
+            call()
+            idle()
+        base = firmware_bytes(tracemalloc.take_snapshot())
+        peak = 0
+        half = None
+        for i in range(calls):
+            model.history.clear()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            call()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+            idle()
+            if i == calls // 2 - 1:
+                half = firmware_bytes(tracemalloc.take_snapshot()) - base
+        growth = firmware_bytes(tracemalloc.take_snapshot()) - base
+    finally:
+        tracemalloc.stop()
+    return {"growth_half": half, "growth": growth, "peak": peak, "pulses": modem.gate.pulses}
+
+
+@pytest.fixture(scope="module")
+def result():
+    return measure()
+
+
+def test_every_call_opens(result):
+    assert result["pulses"] == CALLS + WARMUP
+
+
+def test_no_growth(result):
+    assert result["growth"] <= GROWTH_MAX
+
+
+def test_peak_per_call(result):
+    assert result["peak"] <= PEAK_MAX
@@ -0,0 +1,91 @@
+"""
+Flash store of authorized numbers next to the SIM phonebook: SIM contacts
+are mirrored as ROLE_SIM and dropped with the contact, store-only numbers
+and admins stay.
+
+Usage: python -m pytest host/test_auth.py
+"""
+import io
+from contextlib import redirect_stdout
+
+import simenv
+from modem import run_sync
+from authstore import ROLE_USER, ROLE_SIM, ROLE_ADMIN
+from bench_modem import Bench
+
+
+def reboot(bench):
+    """
+    New Modem on the same model and flash files, as after a power cycle of the Pico.
+    """
+    from modem import Modem
+
+    with redirect_stdout(io.StringIO()):
+        bench.modem.auth.close()
+        bench.modem = Modem(0, 115200)
+        assert run_sync(bench.modem.init_device())
+    return bench.modem
+
+
+def test_contacts_deleted_while_off_are_dropped():
+    bench = Bench(contacts=5)
+    modem = bench.modem
+    assert modem.auth.role(48500000001) == ROLE_SIM
+    with redirect_stdout(io.StringIO()):
+        assert run_sync(modem.sms_command("+48600000001")) == "Number 48600000001 added to SIM card."
+    assert modem.auth.role(48600000001) == ROLE_SIM
+
+    # Deleted with a phone while the Pico is off
+    for number in ("+48500000001", "+48600000001"):
+        slot = [s for s, entry in bench.model.phonebook.items() if entry[0] == number][0]
+        del bench.model.phonebook[slot]
+    modem = reboot(bench)
+    for number in ("+48500000001", "+48600000001"):
+        assert modem.is_number_in_sim(number) is None
+        assert not modem.is_number_authorized(number)
+        assert run_sync(modem.sms_command("?" + number)) == f"Number {number} not found."
+    assert modem.is_number_authorized("+48500000002")
+
+
+def test_store_only_numbers_and_admins_stay():
+    bench = Bench()  # full SIM phonebook
+    modem = bench.modem
+    with redirect_stdout(io.StringIO()):
+        assert run_sync(modem.sms_command("+48600000001")) == "Number 48600000001 authorised, SIM card not updated."
+    assert modem.auth.role(48600000001) == ROLE_USER  # SIM full, store only
+    modem = reboot(bench)
+    assert modem.is_number_authorized("+48600000001")
+    assert modem.auth.role(48503815525) == ROLE_ADMIN
+
+
+def test_incomplete_load_keeps_copies():
+    bench = Bench(contacts=5)
+    model = bench.model
+    at_cpbr = model.at_cpbr
+    garbled = [1]
+
+    def first_chunk_garbled(rest, at):
+        lines, final = at_cpbr(rest, at)
+        if rest.startswith("=1,") and garbled[0]:
+            garbled[0] -= 1
+            lines = ['+CPBR: 1,"+4850'] + lines
+        return lines, final
+
+    model.at_cpbr = first_chunk_garbled
+    del model.phonebook[1]
+    modem = reboot(bench)
+    assert modem.phonebook.loaded
+    assert modem.auth.role(48500000001) == ROLE_SIM
+    # Removed once a sync reads the chunk
+    run_sync(modem.sync_phonebook())
+    assert not modem.is_number_authorized("+48500000001")
+
+
+def test_unread_phonebook_stores_only():
+    bench = Bench(contacts=5)
+    modem = bench.modem
+    modem.phonebook.loaded = False  # as after a failed load_phonebook
+    with redirect_stdout(io.StringIO()):
+        assert run_sync(modem.sms_command("+48600000001")) == "Number 48600000001 authorised, SIM card not updated."
+    assert modem.auth.role(48600000001) == ROLE_USER
+    assert "+48600000001" not in [entry[0] for entry in bench.model.phonebook.values()]
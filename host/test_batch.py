@@ -0,0 +1,36 @@
+"""
+Replies to batch SMS commands: failed and invalid numbers come first and a
+long reply is split into several SMS instead of being cut.
+
+Usage: python -m pytest host/test_batch.py
+"""
+import simenv
+import modem
+from modem import run_sync
+from sms import split_reply
+from bench_modem import Bench, ADMIN
+
+
+def test_split_reply():
+    assert split_reply(["Added 1, deleted 0."], 160) == ["Added 1, deleted 0."]
+    assert split_reply(["a b", "cd", "ef"], 5) == ["a b", "cd ef"]
+    assert split_reply(["Invalid: 1 22 333."], 8) == ["Invalid:", "1 22", "333."]
+    assert split_reply(["x" * 12], 5) == ["xxxxx", "xxxxx", "xx"]
+    assert split_reply([], 160) == []
+
+
+def test_failures_first_and_split():
+    bench = Bench(contacts=10)
+    bench.model.fail("+CPBW")
+    invalid = ["12%d" % i for i in range(20)]
+    queries = ["%09d" % (500000001 + i) for i in range(10)]
+    text = " ".join(["+600000001", "+600000002"] + ["+" + n for n in invalid] + ["?" + n for n in queries])
+    run_sync(bench.modem.process_sms(ADMIN, text))
+    bench.run_until(lambda: not bench.modem.outbox.pending)
+    replies = [reply for number, reply in bench.model.sent if number == ADMIN]
+    assert len(replies) > 1
+    assert all(len(reply) <= modem.sms_max for reply in replies)
+    whole = " ".join(replies)
+    assert whole.startswith("Failed: 600000001. Invalid: " + " ".join(invalid) + ".")
+    assert "Added 1, deleted 0." in whole
+    assert whole.endswith(" ".join(n + " in SIM." for n in queries))
@@ -0,0 +1,63 @@
+"""
+Modem boot (init_device) when the network registration follows Call Ready
+by a few seconds, as it usually does, and when the modem roams.
+
+Usage: python -m pytest host/test_boot.py
+"""
+import io
+from contextlib import redirect_stdout
+
+import simenv
+from simclock import clock
+from modem import run_sync
+import modem as modem_module
+
+CONTACTS = ["+48500000001", "+48500000002"]
+
+
+def boot(model, **config):
+    saved = {name: getattr(modem_module, name) for name in config}
+    for name, value in config.items():
+        setattr(modem_module, name, value)
+    try:
+        modem = modem_module.Modem(0, 115200)
+        start = clock.now()
+        with redirect_stdout(io.StringIO()):
+            ok = run_sync(modem.init_device())
+    finally:
+        for name, value in saved.items():
+            setattr(modem_module, name, value)
+    return modem, ok, (clock.now() - start) / 1000
+
+
+def test_cold_boot_late_registration():
+    model = simenv.create(contacts=CONTACTS, register_ms=8000)
+    model.powered = model.ready = model.registered = False
+    modem, ok, ms = boot(model)
+    assert ok
+    assert modem.phonebook.loaded
+    assert modem.is_number_authorized(CONTACTS[0])
+    assert "reset" not in dict(modem.boot_phases)  # registered after the power on, no reset needed
+
+
+def test_reset_waits_for_registration():
+    model = simenv.create(contacts=CONTACTS, register_ms=5000)
+    modem, ok, ms = boot(model, fast_boot=False)
+    assert ok
+    assert dict(modem.boot_phases)["reset"] >= 5000
+    assert modem.phonebook.loaded
+
+
+def test_roaming():
+    model = simenv.create(contacts=CONTACTS, register_ms=2000)
+    model.roaming = True
+    modem, ok, ms = boot(model, fast_boot=False)
+    assert ok
+    assert run_sync(modem.is_registered())
+
+
+def test_registration_timeout():
+    model = simenv.create(contacts=CONTACTS, register_ms=120000)
+    modem, ok, ms = boot(model, fast_boot=False)
+    assert not ok
+    assert ms < modem_module.ready_timeout_ms + modem_module.register_timeout_ms + 10000
@@ -0,0 +1,34 @@
+"""
+SMS storage fallback (sms_direct off): +CMTI: -> one AT+CMGL of the unread
+messages -> commands in order -> AT+CMGD of the processed ones, with GSM 7
+bit and UCS2 bodies.
+
+Usage: python -m pytest host/test_inbox.py
+"""
+import simenv
+from bench_modem import Bench, ADMIN
+from simclock import clock
+
+
+def test_cmti_drain():
+    bench = Bench(contacts=5, sms_direct=False)
+    model = bench.model
+    assert model.cnmi[1] == 1  # stored and announced with +CMTI:
+    cmti = []
+    handle_cmti = bench.modem.urc_handlers["+CMTI:"]
+    bench.modem.urc_handlers["+CMTI:"] = lambda line, received=None: cmti.append(line) or handle_cmti(line, received)
+    t = clock.now()
+    texts = [("?48500000001", False), ("?48500000002", True), ("+48600000001 ąę", True), ("?48600000009", False)]
+    for text, ucs2 in texts:
+        model.sms(ADMIN, text, ucs2=ucs2, at=t)
+    bench.run_until(lambda: len(model.sent) >= len(texts))
+    assert cmti
+    assert len(bench.commands_since(t, "AT+CMGL")) == 1
+    assert bench.commands_since(t, "AT+CMGD")
+    assert not model.messages  # deleted once processed
+    assert [reply for number, reply in model.sent] == [
+        "Number 48500000001 is in SIM card.",
+        "Number 48500000002 is in SIM card.",
+        "Number 48600000001 added to SIM card.",
+        "Number 48600000009 not found.",
+    ]
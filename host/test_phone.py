@@ -0,0 +1,62 @@
+"""
+Canonical phone number keys (phone.key, phone.key_bytes) for every written
+form of a number, and the +CLIP: fast path that reads them from the RX buffer.
+
+Usage: python -m pytest host/test_phone.py
+"""
+import simenv
+import phone
+import atparse
+
+FORMS = ["+48503815525", "0048503815525", "48503815525", "503815525", " 503815525 "]
+
+
+def test_written_forms_share_a_key():
+    assert set(phone.key(number) for number in FORMS) == {48503815525}
+    assert phone.canonical("503815525") == "48503815525"
+    assert phone.international(48503815525) == "+48503815525"
+
+
+def test_type_of_address():
+    # International without + as shown with type 145
+    assert phone.key("447911123456", phone.INTERNATIONAL) == 447911123456
+    assert phone.key("447911123456", phone.UNKNOWN) is None
+    assert phone.key("503815525", phone.UNKNOWN) == 48503815525
+
+
+def test_invalid_numbers():
+    for number in ["", "+", "12345", "+4850381552a", "+0048503815525", "+1234567890123456", "5038155250",
+                   "Unknown", "+48 503 815 525"]:
+        assert phone.key(number) is None, number
+
+
+def test_other_countries():
+    assert phone.key("+447911123456") == phone.key("00447911123456") == 447911123456
+    assert phone.key("+12025550123") == 12025550123
+
+
+def test_trunk_prefix():
+    saved = phone.trunk_prefix, phone._trunk_prefix
+    phone.trunk_prefix, phone._trunk_prefix = "0", b"0"
+    try:
+        assert phone.key("0503815525") == 48503815525
+        assert phone.key("503815525") == 48503815525
+    finally:
+        phone.trunk_prefix, phone._trunk_prefix = saved
+
+
+def test_key_bytes_from_clip_line():
+    # Recorded +CLIP: lines, parsed undecoded like Modem.open_gate_fast does
+    for line, expected in [
+        (b'+CLIP: "+48503815525",145,"",0,"",0', 48503815525),
+        (b'+CLIP: "503815525",129,"",0,"",0', 48503815525),
+        (b'+CLIP: "48503815525",145,"",0,"Jan, brama",0', 48503815525),
+        (b'+CLIP: "",128,"",0,"",0', None),
+    ]:
+        buf = memoryview(bytearray(line))
+        start, end, toa = atparse.clip_fields(buf)
+        key = phone.key_bytes(buf, start, end, toa) if start >= 0 else None
+        assert key == expected, line
+        number, toa = phone.parse_clip(line.decode())
+        assert phone.key(number, toa) == expected, line
+    assert atparse.clip_fields(b'+CLIP: 503815525') == (-1, -1, None)
@@ -0,0 +1,99 @@
+"""
+Streaming +CPBR parser (atparse.cpbr_fields, Modem.read_chunk) against
+recorded AT+CPBR responses: quoted commas, national and international
+entries, garbled lines and lines that wrap around the RX buffer end.
+
+Usage: python -m pytest host/test_phonebook.py
+"""
+import binascii
+
+import simenv
+import modem
+from modem import run_sync
+from atparse import cpbr_fields
+from bench_modem import Bench
+
+# AT+CPBR=1,8 of a SIM868, slots 3, 4 and 7 are empty
+RECORDED = [
+    '+CPBR: 1,"+48503815525",145,"Jan, brama"',
+    '+CPBR: 2,"503815526",129,"Kowalski"',
+    '+CPBR: 5,"0048600000001",129,""',
+    '+CPBR: 6,"+48600000002",145,"Zośka \xb3"',
+    '+CPBR: 8,"+4860",145,"short"',
+]
+ENTRIES = [
+    (1, "+48503815525", 145, "Jan, brama"),
+    (2, "503815526", 129, "Kowalski"),
+    (5, "0048600000001", 129, ""),
+    (6, "+48600000002", 145, "Zośka \xb3"),
+    (8, "+4860", 145, "short"),
+]
+# Bytes lost on the link
+GARBLED = [
+    '+CPBR: 3,"+4850381',
+    '+CPBR: 4,+48503815527",145,"x"',
+    '+CPBR: ,"+48503815528",145,""',
+    '+CPBR 7,"+48503815529",145,""',
+]
+
+
+def test_cpbr_fields():
+    for line, (i, number, number_type, text) in zip(RECORDED, ENTRIES):
+        buf = line.encode()
+        idx, first, end, toa = cpbr_fields(buf)
+        assert (idx, buf[first:end].decode(), toa) == (i, number, number_type)
+    for line in GARBLED + ["+CPBR: (1-250),40,14", "OK", ""]:
+        assert cpbr_fields(line.encode()) is None, line
+
+
+def recorded_bench(lines, rxbuf=1024):
+    rx = modem.uart_rxbuf
+    modem.uart_rxbuf = rxbuf
+    try:
+        bench = Bench(contacts=0)
+    finally:
+        modem.uart_rxbuf = rx
+    bench.model.at_cpbr = lambda rest, at: (list(lines), "OK")
+    return bench
+
+
+def test_read_chunk():
+    bench = recorded_bench(RECORDED)
+    entries, fingerprint, ok = run_sync(bench.modem.read_chunk(1, 8))
+    assert entries == ENTRIES
+    assert ok
+    crc = 0
+    for line in RECORDED:
+        crc = binascii.crc32(line.encode(), crc)
+    assert fingerprint == crc
+
+
+def test_read_chunk_garbled():
+    bench = recorded_bench(RECORDED[:2] + GARBLED + RECORDED[2:])
+    entries, fingerprint, ok = run_sync(bench.modem.read_chunk(1, 8))
+    assert entries == ENTRIES
+    assert not ok
+
+
+def test_read_chunk_wrapped():
+    # Small RX buffers, the lines wrap around the buffer end at different positions
+    for rxbuf in range(96, 160, 5):
+        bench = recorded_bench(RECORDED, rxbuf)
+        for _ in range(3):
+            entries, fingerprint, ok = run_sync(bench.modem.read_chunk(1, 8))
+            assert entries == ENTRIES, rxbuf
+            assert ok
+
+
+def test_load_phonebook_index():
+    bench = recorded_bench(RECORDED)
+    bench.model.at_cpbr = lambda rest, at: (
+        ["+CPBR: (1-8),40,14"] if rest == "=?" else list(RECORDED), "OK")
+    assert run_sync(bench.modem.load_phonebook())
+    pb = bench.modem.phonebook
+    assert len(pb) == 5
+    assert pb.slot_of(48503815525) == 1
+    assert pb.slot_of(48503815526) == 2  # national
+    assert pb.slot_of(48600000001) == 5  # 00 prefix
+    assert pb.stored_number(48600000002) == "+48600000002"
+    assert sorted(pb.free_slots) == [3, 4, 7]
@@ -0,0 +1,82 @@
+"""
+RingBuffer line extraction: lines split at every position of the buffer end,
+lines as long as the longest modem line and lines longer than the buffer.
+
+Usage: python -m pytest host/test_ringbuf.py
+"""
+import simenv
+from ringbuf import RingBuffer
+from bench_modem import Bench, ADMIN
+from simclock import clock
+
+
+class ChunkUART:
+    """
+    machine.UART stand-in that delivers the payload in chunks of a fixed size.
+    """
+
+    def __init__(self, payload, chunk):
+        self.payload = payload
+        self.pos = 0
+        self.chunk = chunk
+
+    def any(self):
+        return min(self.chunk, len(self.payload) - self.pos)
+
+    def readinto(self, buf, n=None):
+        n = min(len(buf), self.any())
+        buf[:n] = self.payload[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def read_lines(rx, uart):
+    lines = []
+    while True:
+        rx.fill(uart)
+        line = rx.readline()
+        if line is None:
+            if not uart.any():
+                return lines
+            continue
+        lines.append(bytes(line))
+
+
+# Full UCS2 +CMT: body (140 octets, 280 hex digits) and its header
+UCS2_BODY = b"0041" * 70
+CMT_HEADER = b'+CMT: "+48503815525","","24/05/17,12:00:00+08",145,4,0,8,"+48790998250",145,140'
+
+
+def test_wrapped_lines_are_complete():
+    lines = [CMT_HEADER, UCS2_BODY, b"OK"]
+    payload = b"".join(b"\r\n" + line + b"\r\n" for line in lines)
+    for offset in range(1, 512, 7):
+        rx = RingBuffer(512)
+        # Moves the buffer start so the payload wraps at a different position
+        rx.start = offset
+        for chunk in (1, 13, 64, 512):
+            uart = ChunkUART(payload, chunk)
+            got = [line for line in read_lines(rx, uart) if line]
+            assert got == lines, (offset, chunk)
+            assert rx.overflows == 0
+
+
+def test_line_longer_than_buffer_is_dropped_whole():
+    payload = b"+CMT: " + b"A" * 300 + b"\r\n" + b"OK\r\n"
+    rx = RingBuffer(128)
+    lines = read_lines(rx, ChunkUART(payload, 16))
+    assert lines == [b"OK"]
+    assert rx.overflows >= 1
+
+
+def test_ucs2_sms_burst_is_not_cut():
+    bench = Bench(contacts=10)
+    received = []
+    bench.modem.process_sms = lambda sender, text: received.append(text)
+    texts = ["+6000000%02d " % i + "ąę" * 27 for i in range(8)]
+    for text in texts:
+        bench.model.sms(ADMIN, text, ucs2=True)
+    deadline = clock.now() + 10000000
+    while len(received) < len(texts) and clock.now() < deadline:
+        bench.step()
+    assert received == [text.strip() for text in texts]
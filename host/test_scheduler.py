@@ -0,0 +1,75 @@
+"""
+Awaited AT transactions under the Scheduler: while a task waits for a slow
+command the other tasks keep running and a call is still answered.
+
+Usage: python -m pytest host/test_scheduler.py
+"""
+import asyncio
+
+import pytest
+
+import simenv
+import machine
+import simloop
+from bench_modem import Bench
+from scheduler import Scheduler, sleep_ms
+from simclock import clock
+
+
+@pytest.fixture
+def no_fast_forward(monkeypatch):
+    """
+    A UART poll returns at once on the Pico, the shim instead moves the clock
+    to the next byte, which would hide the other tasks behind a single read.
+    """
+    def any(uart):
+        clock.service()
+        uart.deliver()
+        if not uart.fifo:
+            clock.advance(machine.poll_quantum_us)
+            uart.deliver()
+        return len(uart.fifo)
+
+    monkeypatch.setattr(machine.UART, "any", any)
+
+
+def test_transact_lets_tasks_run(no_fast_forward):
+    bench = Bench()
+    modem = bench.modem
+    bench.model.latency["+CPBR"] = 2000
+    scheduler = Scheduler(modem)
+    ticks = []
+
+    async def ticker():
+        while True:
+            await sleep_ms(0)
+            ticks.append(clock.now())
+
+    async def listener():
+        while True:
+            await scheduler.wait_rx()
+            scheduler.read()
+
+    async def main():
+        tasks = [asyncio.ensure_future(ticker()), asyncio.ensure_future(listener())]
+        bench.model.call(bench.numbers[0], at=clock.now() + 500000)
+        async with scheduler.lock:
+            res = await modem.transact("AT+CPBR=1,1", 10000)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return res, clock.now()
+
+    t = clock.now()
+    loop = simloop.SimLoop()
+    try:
+        res, end = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    modem.scheduler = None
+    assert res.ok
+    assert end - t >= 2000000
+    assert any(t + 500000 < at < end for at in ticks)  # the ticker ran during the command
+    ath = bench.commands_since(t, "ATH")
+    assert ath and ath[0] < end  # the call was answered before the command ended
+    assert modem.gate.pulses == 1
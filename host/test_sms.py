@@ -0,0 +1,96 @@
+"""
+SMS parsers (sms.py) against recorded +CMGL listings and +CMT: URCs: quoted
+commas, multi-line and UCS2 bodies, and the +CMT: body assembly in
+Modem.receive.
+
+Usage: python -m pytest host/test_sms.py
+"""
+import simenv
+from sms import (InboxParser, split_fields, parse_sms_header, parse_cmt_header, decode_text, decode_ucs2,
+                 body_complete, listing_dcs)
+from bench_modem import Bench, ADMIN
+from simclock import clock
+
+# AT+CMGL="REC UNREAD" of a SIM868 in text mode with AT+CSDH=1
+CMGL = [
+    '+CMGL: 1,"REC UNREAD","+48503815525","","24/05/17,12:00:00+08",145,11',
+    '+48600000001',
+    '+CMGL: 2,"REC UNREAD","+48503815525","Kowalski, Jan","24/05/17,12:01:00+08",145,22',
+    '+48600000002',
+    '-48600000003',
+    '+CMGL: 3,"REC UNREAD","+48600000009","","24/05/17,12:02:00+08",145,0',
+    '+CMGL: 4,"REC UNREAD","+48503815525","","24/05/17,12:03:00+08",145,10',
+    '003F0035003000330038',
+]
+CMT_UCS2 = '+CMT: "+48503815525","","24/05/17,12:00:00+08",145,4,0,8,"+48790998250",145,14'
+
+
+def test_split_fields_quoted_comma():
+    assert split_fields('"REC UNREAD","+48503815525","Kowalski, Jan","24/05/17,12:00:00+08"') == [
+        "REC UNREAD", "+48503815525", "Kowalski, Jan", "24/05/17,12:00:00+08"]
+
+
+def test_headers():
+    assert parse_sms_header(CMGL[2]) == (2, "REC UNREAD", "+48503815525", "24/05/17,12:01:00+08")
+    assert parse_sms_header('+CMGR: "REC READ","+48503815525","","24/05/17,12:00:00+08"') == (
+        None, "REC READ", "+48503815525", "24/05/17,12:00:00+08")
+    assert parse_cmt_header(CMT_UCS2) == ("+48503815525", "24/05/17,12:00:00+08", 8, 14)
+    # Without AT+CSDH=1
+    assert parse_cmt_header('+CMT: "+48503815525","","24/05/17,12:00:00+08"') == (
+        "+48503815525", "24/05/17,12:00:00+08", None, None)
+
+
+def test_inbox_parser():
+    messages = []
+    parser = InboxParser(lambda index, sender, text, dcs: messages.append((index, sender, text, dcs)))
+    for line in CMGL:
+        parser.feed(line)
+    parser.flush()
+    assert messages == [
+        (1, "+48503815525", "+48600000001", None),
+        (2, "+48503815525", "+48600000002\n-48600000003", None),
+        (3, "+48600000009", "", None),
+        (4, "+48503815525", "003F0035003000330038", 8),
+    ]
+
+
+def test_listing_dcs():
+    assert listing_dcs("003F0035003000330038", 10) == 8  # octets
+    assert listing_dcs("003F0035003000330038", 5) == 8  # characters
+    assert listing_dcs("003F0035003000330038", 20) is None  # GSM 7 bit digits
+    assert listing_dcs("003F0035003000330038", None) is None
+    assert listing_dcs("?500", 1) is None
+    assert listing_dcs("", 0) is None
+
+
+def test_decode():
+    assert decode_ucs2("003F0035003000330038") == "?5038"
+    assert decode_ucs2("002B00340038010501190107") == "+48ąęć"
+    assert decode_ucs2("D83DDE00") == "\U0001F600"  # surrogate pair
+    assert decode_text("003F0035", 8) == "?5"
+    assert decode_text("00 not hex", 8) == "00 not hex"
+    assert decode_text("+48600000001", 0) == "+48600000001"
+    assert decode_text("\x00x\x11", 0) == "@x_"  # GSM 7 bit characters below 0x20
+
+
+def test_body_complete():
+    assert body_complete(["+48600000001"], 0, 12)
+    assert not body_complete(["+48600000001"], 0, 25)
+    assert body_complete(["+48600000001", "-48600000002"], 0, 25)
+    assert body_complete(["", ""], 0, 1)  # a message of a single line break
+    assert body_complete(["003F"], 8, 2)
+    assert body_complete(["anything"], None, None)
+
+
+def test_cmt_bodies():
+    bench = Bench(contacts=0)
+    received = []
+    bench.modem.process_sms = lambda sender, text: received.append((sender, text))
+    texts = [("+48600000001\n-48600000002", False), ("?48600000001", True), ("+48600000003 ąę, ok", True),
+             ("", False), ("line\n\nbreaks", False)]
+    for text, ucs2 in texts:
+        bench.model.sms(ADMIN, text, ucs2=ucs2)
+    deadline = clock.now() + 10000000
+    while len(received) < len(texts) and clock.now() < deadline:
+        bench.step()
+    assert received == [(ADMIN, text.strip()) for text, ucs2 in texts]
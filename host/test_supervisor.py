@@ -0,0 +1,49 @@
+"""
+Supervisor recovery after a failed boot: the modem ends up registered with
+the setup init_device did not finish (link rate, phonebook index) done.
+
+Usage: python -m pytest host/test_supervisor.py
+"""
+import io
+from contextlib import redirect_stdout
+
+import simenv
+from simclock import clock
+from modem import run_sync
+import modem as modem_module
+import supervisor
+
+CONTACTS = ["+48500000001", "+48500000002"]
+
+
+def run_until_registered(sup, limit_us=300000000):
+    modem = sup.modem
+    deadline = clock.now() + limit_us
+    tick = clock.now()
+    while sup.state != supervisor.REGISTERED:
+        assert clock.now() < deadline, "not registered in simulated time"
+        if clock.now() >= tick:
+            run_sync(sup.tick())
+            tick = clock.now() + supervisor.tick_ms * 1000
+        modem.poll()
+        run_sync(modem.dispatch())
+        clock.advance(1000)
+
+
+def test_recovery_after_failed_boot():
+    # Registers after the boot gave up waiting
+    model = simenv.create(contacts=CONTACTS, register_ms=modem_module.register_timeout_ms + 10000)
+    model.powered = model.ready = model.registered = False
+    with redirect_stdout(io.StringIO()):
+        modem = modem_module.Modem(0, 115200)
+        sup = supervisor.Supervisor(modem)
+        assert not run_sync(sup.boot())
+        assert not modem.phonebook.loaded
+        run_until_registered(sup)
+    assert modem.phonebook.loaded
+    assert modem.link.saved
+    assert modem.is_number_authorized(CONTACTS[0])
+    assert modem.phonebook.free_slots
+    with redirect_stdout(io.StringIO()):
+        assert run_sync(modem.add_contact("+48600000001")) == "number_added"
+    assert modem.is_number_in_sim("+48600000001")
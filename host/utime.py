@@ -0,0 +1,61 @@
+"""
+utime shim for the host simulation, running on simclock.clock.
+"""
+import calendar
+import time as _time
+
+from simclock import clock
+
+EPOCH_OFFSET = 946684800  # MicroPython epoch 2000-01-01 in Unix time
+start_time = int(_time.time()) - EPOCH_OFFSET
+
+
+def ticks_us():
+    clock.service()
+    return clock.now()
+
+
+def ticks_ms():
+    return ticks_us() // 1000
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_diff(a, b):
+    return a - b
+
+
+def ticks_add(a, b):
+    return a + b
+
+
+def sleep_us(us):
+    clock.sleep_us += us
+    clock.advance(us)
+
+
+def sleep_ms(ms):
+    sleep_us(int(ms * 1000))
+
+
+def sleep(s):
+    sleep_us(int(s * 1000000))
+
+
+def time():
+    return start_time + clock.now() // 1000000
+
+
+def localtime(secs=None):
+    if secs is None:
+        secs = time()
+    return _time.gmtime(secs + EPOCH_OFFSET)[:8]
+
+
+gmtime = localtime
+
+
+def mktime(t):
+    return calendar.timegm(tuple(t[:6])) - EPOCH_OFFSET
@@ -0,0 +1,215 @@
+import utime
+
+import log
+import metrics
+
+rates = (460800, 230400, 115200)  # AT+IPR rates tried, fastest first, 460800 is the SIM868 maximum
+default_rate = 115200  # rate of a modem that was never switched
+rate_file = "link.txt"  # rate chosen by the last negotiation, used as is on the next boot
+negotiate = True  # switch to the fastest rate that passes the echo test at boot
+echo_rounds = 8  # AT+IPR? round trips a new rate must pass, about 40 bytes each
+echo_timeout_ms = 500
+probe_timeout_ms = 300  # AT timeout per rate while looking for the rate of the modem
+settle_ms = 20  # time after a rate change before the link is used
+error_limit = 3  # link errors per error_window_ms before falling back to a slower rate
+error_window_ms = 60000
+
+
+class LinkSpeed:
+    """
+    Baud rate of the modem UART link.
+
+    At boot the rate saved in rate_file is used, or the link is negotiated:
+    the modem is switched with AT+IPR (answered at the old rate, the new one
+    applies afterwards), then the Pico UART, and the link is checked with an
+    echo test. With ATE1 the modem echoes every command, so a byte lost or
+    garbled in either direction shows up as a changed echo, an extra line or
+    a timeout. Rates that fail go back to the previous one. The SIM868 keeps
+    the AT+IPR rate across resets, so when the modem does not answer the
+    candidate rates are probed before it is power cycled.
+
+    Framing errors are not reported by the UART, the bytes are dropped, so
+    AT timeouts and garbled response lines are counted as link errors.
+    error_limit of them within error_window_ms make the Supervisor step down
+    to the next slower rate.
+    """
+
+    def __init__(self, modem):
+        self.modem = modem
+        self.rate = default_rate
+        self.saved = self.load()
+        self.failed = []  # rates that failed since boot, not tried again
+        self.errors = 0  # link errors in the window
+        self.window = utime.ticks_ms()
+        self.failing = False  # error_limit reached, a fallback is due
+        if self.saved:
+            # Nothing was received yet, no need to settle
+            modem.uart.init(baudrate=self.saved)
+            self.rate = self.saved
+            metrics.count("link_switches")
+
+    def load(self):
+        """
+        :return: rate saved in rate_file, None if there is none
+        """
+        try:
+            with open(rate_file) as f:
+                rate = int(f.read())
+        except (OSError, ValueError):
+            return None
+        return rate if rate in rates else None
+
+    def save(self):
+        if self.rate == self.saved:
+            return
+        try:
+            with open(rate_file, "w") as f:
+                f.write(str(self.rate))
+            self.saved = self.rate
+        except OSError as e:
+            log.error("Link rate not saved: %s", e)
+
+    async def switch(self, rate):
+        """
+        Sets the rate of the Pico UART. The modem has to be switched already.
+
+        :param rate: baud rate
+        """
+        modem = self.modem
+        with modem.uart_lock:
+            modem.uart.init(baudrate=rate)
+        await modem.pause(settle_ms)  # Never with the lock held
+        with modem.uart_lock:
+            modem.uart.read()  # Bytes received while the rates differed
+            modem.rx.clear()
+        self.rate = rate
+        metrics.count("link_switches")
+
+    async def echo_test(self, rounds=echo_rounds):
+        """
+        :param rounds: AT+IPR? round trips
+        :return: True if every echo and answer came back intact at the current rate
+        """
+        expected = ["+IPR: %d" % self.rate]
+        for _ in range(rounds):
+            res = await self.modem.transact("AT+IPR?", echo_timeout_ms)
+            if not res.ok or res.lines != expected:
+                return False
+        return True
+
+    async def find(self, candidates=None):
+        """
+        Looks for the rate the modem answers at.
+
+        :param candidates: rates to try, by default the current, the saved and the default one, then all rates
+        :return: True if the modem answered, the UART is left at that rate, otherwise
+                 it goes back to the rate it was at
+        """
+        start = self.rate
+        if candidates is None:
+            candidates = (self.rate, self.saved, default_rate) + rates
+        tried = []
+        for rate in candidates:
+            if not rate or rate in tried:
+                continue
+            tried.append(rate)
+            if rate != self.rate:
+                await self.switch(rate)
+            if (await self.modem.transact("AT", probe_timeout_ms)).ok:
+                if len(tried) > 1:
+                    log.warning("Modem found at %s baud.", rate)
+                return True
+        if self.rate != start:
+            await self.switch(start)
+        return False
+
+    async def change(self, rate):
+        """
+        Switches the modem and then the Pico UART to a rate and runs the echo test.
+        If it fails both go back to the previous rate.
+
+        :param rate: baud rate
+        :return: True if the link works at the new rate
+        """
+        old = self.rate
+        res = await self.modem.transact("AT+IPR=%d" % rate, echo_timeout_ms)
+        if res.error is not None:  # Rate not supported
+            self.failed.append(rate)
+            return False
+        if not res.ok:
+            # Unknown if the modem switched, the answer was lost
+            await self.find((old, rate))
+            return self.rate == rate and await self.echo_test()
+        await self.switch(rate)
+        if await self.echo_test():
+            log.info("UART link at %s baud.", rate)
+            return True
+        log.warning("Echo test failed at %s baud.", rate)
+        metrics.count("link_rejected")
+        self.failed.append(rate)
+        for _ in range(3):
+            if (await self.modem.transact("AT+IPR=%d" % old, echo_timeout_ms)).ok:
+                break
+        await self.switch(old)
+        if not await self.echo_test(1):
+            await self.find()
+        return False
+
+    async def negotiate(self):
+        """
+        Switches to the fastest rate that passes the echo test, unless a rate
+        was saved by an earlier negotiation.
+
+        :return: rate in use
+        """
+        if not negotiate or self.saved:
+            return self.rate
+        for rate in rates:
+            if rate <= self.rate:
+                break
+            if rate not in self.failed and await self.change(rate):
+                break
+        self.save()
+        return self.rate
+
+    def error(self):
+        """
+        Counts a link error: an AT timeout or a garbled response line.
+        """
+        now = utime.ticks_ms()
+        if utime.ticks_diff(now, self.window) >= error_window_ms:
+            self.window = now
+            self.errors = 0
+        self.errors += 1
+        metrics.count("link_errors")
+        if self.errors >= error_limit and self.rate > rates[-1]:
+            self.failing = True
+
+    def clear(self):
+        """
+        Forgets the link errors, to be called on a modem fault: the errors
+        are not caused by the line then.
+        """
+        self.errors = 0
+        self.failing = False
+
+    async def fallback(self):
+        """
+        Steps down to the next slower rate after error_limit link errors. Run
+        by the Supervisor while the modem is idle.
+
+        :return: True if the modem answers at the slower rate, False if it does
+                 not answer at all, then the errors came from the modem
+        """
+        slower = [rate for rate in rates if rate < self.rate]
+        if not slower:
+            self.clear()
+            return True
+        metrics.count("link_fallbacks")
+        log.warning("Link errors at %s baud, falling back to %s.", self.rate, slower[0])
+        self.failed.append(self.rate)
+        ok = await self.change(slower[0]) or await self.find(slower)
+        self.clear()  # Including the timeouts of the fallback itself
+        if ok:
+            self.save()
+        return ok
@@ -0,0 +1,94 @@
+import utime
+
+# Levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+level = INFO  # lowest level that is kept
+echo_level = WARNING  # lowest level that is also printed, printing over USB serial blocks
+ring_size = 64  # entries kept in RAM
+
+# Ring buffer of (ticks_ms, level, message, args), preallocated; the message
+# is only formatted with its args when it is printed or read back
+entries = [None] * ring_size
+pos = 0
+count = 0  # entries logged since start
+
+
+def log(lvl, msg, *args):
+    """
+    Logs a message. Costs a comparison when the level is off.
+
+    :param lvl: DEBUG, INFO, WARNING or ERROR
+    :param msg: message, % formatted with args when it is read
+    :param args: message arguments
+    """
+    global pos, count
+    if lvl < level:
+        return
+    entry = (utime.ticks_ms(), lvl, msg, args)
+    entries[pos] = entry
+    pos = (pos + 1) % ring_size
+    count += 1
+    if lvl >= echo_level:
+        print(format_entry(entry))
+
+
+def debug(msg, *args):
+    if DEBUG >= level:
+        log(DEBUG, msg, *args)
+
+
+def info(msg, *args):
+    if INFO >= level:
+        log(INFO, msg, *args)
+
+
+def warning(msg, *args):
+    log(WARNING, msg, *args)
+
+
+def error(msg, *args):
+    log(ERROR, msg, *args)
+
+
+def format_entry(entry):
+    """
+    :param entry: (ticks_ms, level, message, args)
+    :return: line in the format: <ticks_ms> [<LEVEL>] <message>
+    """
+    ticks, lvl, msg, args = entry
+    if args:
+        try:
+            msg = msg % args
+        except (TypeError, ValueError):
+            msg = msg + " " + repr(args)
+    return f"{ticks} [{NAMES.get(lvl, lvl)}] {msg}"
+
+
+def lines(n=None):
+    """
+    :param n: number of the latest entries, None for all kept ones
+    :return: list of formatted entries, oldest first
+    """
+    kept = min(count, ring_size)
+    if n is None or n > kept:
+        n = kept
+    return [format_entry(entries[(pos - n + i) % ring_size]) for i in range(n)]
+
+
+def dump(stream=None):
+    """
+    Writes the kept entries, one per line.
+
+    :param stream: file opened for writing, None to print them
+    """
+    for line in lines():
+        if stream is None:
+            print(line)
+        else:
+            stream.write(line + "\n")
@@ -0,0 +1,147 @@
+import gc
+
+
+class Histogram:
+    """
+    Keeps the last samples of a measurement and reports percentiles.
+    """
+
+    def __init__(self, size=128):
+        self.samples = [0] * size
+        self.size = size
+        self.pos = 0
+        self.count = 0  # total number of samples added
+        self.max = 0
+
+    def add(self, value):
+        self.samples[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        :param p: percentile, 0-100
+        :return: value below which p percent of the kept samples fall, None if there are no samples
+        """
+        n = min(self.count, self.size)
+        if not n:
+            return None
+        ordered = sorted(self.samples[:n])
+        return ordered[min(n - 1, n * p // 100)]
+
+    def summary(self):
+        """
+        :return: dict with count, p50, p95, p99 and max
+        """
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+counters = {}  # name -> int
+histograms = {}  # name -> Histogram
+peaks = {}  # name -> highest value seen, e.g. the heap high-water mark
+
+
+def count(name, n=1):
+    """
+    Adds to a counter, creating it at 0.
+
+    :param name: counter name, e.g. sms_in
+    :param n: amount to add
+    """
+    counters[name] = counters.get(name, 0) + n
+
+
+def histogram(name, size=128):
+    """
+    :param name: histogram name, with the unit as suffix, e.g. at_ms
+    :param size: samples kept, used when the histogram is created
+    :return: the Histogram registered under the name
+    """
+    h = histograms.get(name)
+    if h is None:
+        h = histograms[name] = Histogram(size)
+    return h
+
+
+def observe(name, value):
+    """
+    Adds a sample to a histogram, creating it.
+
+    :param name: histogram name
+    :param value: sample
+    """
+    histogram(name).add(value)
+
+
+def peak(name, value):
+    """
+    Keeps the highest value of a gauge.
+
+    :param name: gauge name, with the unit as suffix, e.g. heap_used_bytes
+    :param value: current value
+    """
+    if name not in peaks or value > peaks[name]:
+        peaks[name] = value
+
+
+def sample_memory():
+    """
+    Records the heap in use and its high-water mark (heap_used_bytes). Only the
+    MicroPython gc can tell the heap usage.
+
+    :return: bytes in use, None if not known
+    """
+    if not hasattr(gc, "mem_alloc"):
+        return None
+    used = gc.mem_alloc()
+    peak("heap_used_bytes", used)
+    return used
+
+
+def reset():
+    """
+    Drops every counter, histogram and peak.
+    """
+    counters.clear()
+    histograms.clear()
+    peaks.clear()
+
+
+def report():
+    """
+    Short summary for an SMS reply: counters, peaks and the p50/p99 of each histogram.
+
+    :return: text, e.g. calls=3 sms_in=2 heap_used_bytes_max=61440 at_ms=21/40
+    """
+    parts = [f"{name}={value}" for name, value in sorted(counters.items())]
+    parts.extend(f"{name}_max={value}" for name, value in sorted(peaks.items()))
+    for name, h in sorted(histograms.items()):
+        if h.count:
+            parts.append(f"{name}={h.percentile(50)}/{h.percentile(99)}")
+    return " ".join(parts)
+
+
+def dump(stream=None):
+    """
+    Writes every counter, peak and histogram summary, one "name key=value ..." line each.
+
+    :param stream: file opened for writing, None to print them
+    """
+    lines = [f"counter {name} value={value}" for name, value in sorted(counters.items())]
+    lines.extend(f"peak {name} value={value}" for name, value in sorted(peaks.items()))
+    for name, h in sorted(histograms.items()):
+        s = h.summary()
+        lines.append(f"histogram {name} count={s['count']} p50={s['p50']} p95={s['p95']} p99={s['p99']} max={s['max']}")
+    for line in lines:
+        if stream is None:
+            print(line)
+        else:
+            stream.write(line + "\n")
@@ -1,58 +1,615 @@
 import machine
-import os
 import utime
 import binascii
 import _thread
-import sys
+
+from phonebook import Phonebook, CPBR_LINE_MAX
+from ringbuf import RingBuffer
+from eventqueue import EventQueue
+from sms import InboxParser, parse_cmt_header, body_complete, decode_text, split_reply
+from gate import Gate
+from outbox import Outbox
+from authstore import AuthStore, ROLE_USER, ROLE_ADMIN, ROLE_SIM
+from accesslog import AccessLog, OPENED, DENIED, LOCKED_OUT, format_record
+from callfilter import CallFilter, THROTTLED
+from linkspeed import LinkSpeed
+import metrics
+import log
+import phone
+import atparse
+import uarttrace
+from phone import INTERNATIONAL
 
 # using pin defined
 pwr_en = 14  # pin to control the power of the module
 uart_port = 0
-uart_baute = 115200
+uart_baute = 115200  # rate at boot, until a rate negotiated by LinkSpeed is saved
+uart_rxbuf = 1024  # UART RX buffer size in bytes
 
 APN = "internet" #defined for the mobile operator
-
-uart = machine.UART(uart_port, uart_baute)
-uart_lock = _thread.allocate_lock()
-
-INTERNATIONAL = 145
-UNKNOWN = 129
+sms_direct = True  # deliver SMS as +CMT: URCs instead of storing them on the SIM card
+pb_sync_ms = 600000  # interval of the incremental phonebook sync
+stats_file = "stats.txt"  # metrics and log dump, read from the host with e.g. mpremote cp :stats.txt .
+sms_max = 160  # characters of a single SMS reply
+log_query_default = 5  # records sent back for ?log without a count
+fast_boot = True  # skip the modem reset at start when it is already registered
+gprs_at_boot = False  # set up the GPRS context during init_device, otherwise on first use
+ready_timeout_ms = 30000  # time to wait for Call Ready and SMS Ready after a reset
+register_timeout_ms = 30000  # time to wait for the network registration, usually a few seconds after Call Ready
+register_poll_ms = 1000  # interval of AT+CREG? while waiting, a +CREG: URC ends the wait early
+wait_sleep_ms = 1  # sleep while blocking on the modem when nothing was read, instead of spinning (no Scheduler)
 
 GK_numbers = [
     "+48503815525"
 ]
 
+# Unsolicited result codes, matched by line prefix
+URC_PREFIXES = (
+    "RING",
+    "+CLIP:",
+    "+CMTI:",
+    "+CMT:",
+    "NO CARRIER",
+    "BUSY",
+    "NORMAL POWER DOWN",
+    "UNDER-VOLTAGE",
+    "OVER-VOLTAGE",
+    "+CPIN:",
+    "+CREG:",
+    "+CFUN:",
+    "RDY",
+    "Call Ready",
+    "SMS Ready",
+)
+URC_TABLE = tuple((prefix.encode(), prefix) for prefix in URC_PREFIXES)  # matched on the undecoded line
+events_max = 64  # URC events waiting to be handled
+
+# AT transaction status
+AT_OK = "OK"
+AT_ERROR = "ERROR"
+AT_PROMPT = ">"
+AT_TIMEOUT = "TIMEOUT"
+
+# AT command priorities, lower is written first
+PRIO_PROMPT = 0  # data after the > prompt, nothing else may be written before it
+PRIO_CALL = 1  # call control (ATH)
+PRIO_NORMAL = 2
+PRIO_BACKGROUND = 3  # phonebook scans and other bulk reads
+
+
+class ATResult:
+    """
+    Result of a single AT command transaction.
+    """
+
+    def __init__(self, status, lines, elapsed, error=None):
+        self.status = status  # AT_OK, AT_ERROR, AT_PROMPT or AT_TIMEOUT
+        self.lines = lines  # intermediate response lines, without echo and final result code
+        self.elapsed = elapsed  # time in milliseconds
+        self.error = error  # final line of a failed command (ERROR, +CME ERROR: <n>, +CMS ERROR: <n>)
+
+    @property
+    def ok(self):
+        return self.status == AT_OK
+
+    @property
+    def prompted(self):
+        return self.status == AT_PROMPT
+
+    def text(self):
+        """
+        :return: intermediate response lines joined with newlines
+        """
+        return "\n".join(self.lines)
+
+    def __str__(self):
+        # Lets log calls pass the result and join the lines only when the entry is read
+        return self.text()
+
+
+class Transaction:
+    """
+    AT command transaction, queued or in progress.
+    """
+
+    def __init__(self, cmd, timeout, on_line=None, on_done=None, raw=None, priority=PRIO_NORMAL, raw_lines=False):
+        self.cmd = cmd
+        self.raw = raw
+        prefix = response_prefix(cmd)
+        self.prefix = prefix.encode() if prefix else None  # compared with the undecoded lines
+        self.raw_lines = raw_lines  # on_line gets the information lines undecoded
+        self.timeout = timeout
+        self.priority = priority
+        self.on_line = on_line  # callback for intermediate lines
+        self.on_done = on_done  # callback called with the transaction once it is finished
+        self.lines = []
+        self.status = AT_TIMEOUT
+        self.error = None
+        self.started = None  # ticks_ms when the command was written
+        self.elapsed = 0
+        self.done = False
+
+    def feed(self, line):
+        """
+        Passes a received line to the transaction.
+        
+        :param line: decoded response line, or a memoryview of an information line
+                     if raw_lines is set (only valid during the on_line call)
+        :return: True if the line was the final result code, False otherwise
+        """
+        if not isinstance(line, str):
+            self.on_line(line)
+            return False
+        if line == self.cmd: # Command echo
+            return False
+        found = final_status(line)
+        if found:
+            self.finish(found, None if found == AT_OK else line)
+            return True
+        if self.on_line:
+            self.on_line(line)
+        else:
+            self.lines.append(line)
+        return False
+
+    def finish(self, status, error=None):
+        """
+        Ends the transaction.
+        
+        :param status: AT_OK, AT_ERROR, AT_PROMPT or AT_TIMEOUT
+        :param error: final line of a failed command
+        """
+        self.status = status
+        self.error = error
+        if self.started is not None:
+            self.elapsed = utime.ticks_diff(utime.ticks_ms(), self.started)
+            metrics.observe("at_ms", self.elapsed)
+        self.done = True
+        if self.on_done:
+            self.on_done(self)
+
+    def start(self, uart):
+        """
+        Writes the command, the timeout runs from now on.
+        
+        :param uart: machine.UART
+        """
+        self.started = utime.ticks_ms()
+        data = None
+        if self.cmd is not None:
+            data = (self.cmd + '\r\n').encode()
+        elif self.raw is not None:
+            data = self.raw
+        if data:
+            uart.write(data)
+            metrics.count("uart_tx_bytes", len(data))
+
+    def expired(self):
+        if self.started is None: # Still queued
+            return False
+        return utime.ticks_diff(utime.ticks_ms(), self.started) >= self.timeout
+
+    def result(self):
+        """
+        :return: ATResult
+        """
+        return ATResult(self.status, self.lines, self.elapsed, self.error)
+
+
+def final_status(line):
+    """
+    Checks if a response line is a final result code.
+    
+    :param line: decoded response line
+    :return: AT_OK or AT_ERROR for final result codes, None otherwise
+    """
+    if line == "OK":
+        return AT_OK
+    if line == "ERROR" or line.startswith("+CME ERROR") or line.startswith("+CMS ERROR"):
+        return AT_ERROR
+    return None
+
+
+def response_prefix(cmd):
+    """
+    Returns the prefix of the information lines a command answers with.
+    
+    :param cmd: AT command, e.g. AT+CPIN?
+    :return: response prefix, e.g. +CPIN:, or None for commands without one
+    """
+    if not cmd or not cmd.startswith("AT+"):
+        return None
+    name = cmd[2:]
+    for sep in "=?":
+        name = name.split(sep)[0]
+    return name + ":"
+
+
+def parse_operations(text):
+    """
+    Splits an admin SMS into phonebook operations, e.g. "+111 +222, -333 ?444".
+    An operation is +, - or ? directly followed by the number or separated from
+    it by spaces. International numbers are written with 00 (or as ++44...).
+    
+    :param text: message body
+    :return: list of (operation, number), empty if a token is not an operation
+    """
+    ops = []
+    op = None
+    for token in text.replace(",", " ").replace(";", " ").split():
+        if op is None:
+            if token[0] not in "+-?":
+                return []
+            op, token = token[0], token[1:]
+            if not token:
+                continue
+        ops.append((op, token))
+        op = None
+    if op is not None:
+        return []
+    return ops
+
+
+def run_sync(coro):
+    """
+    Runs a coroutine of the Modem to its end without an event loop, e.g. on the
+    host. Without a Scheduler attached the waits of the Modem block, so the
+    coroutine never suspends.
+
+    :param coro: coroutine, e.g. modem.init_device()
+    :return: its result
+    """
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    raise RuntimeError("coroutine suspended without an event loop")
+
+
 class Modem:
     
     def __init__(self, port, baute):
-        self.uart = machine.UART(port, baute)
+        self.uart = machine.UART(port, baute, rxbuf=uart_rxbuf)
+        self.trace = None  # UartTrace recording the UART, with uarttrace.enabled
+        if uarttrace.enabled:
+            self.uart = self.trace = uarttrace.UartTrace(self.uart, baute)
         self.uart_lock = _thread.allocate_lock()
+        self.rx = RingBuffer(uart_rxbuf)
+        self.link = LinkSpeed(self)  # UART baud rate, negotiated with AT+IPR
+        self.phonebook = Phonebook()
+        self.auth = AuthStore()  # authorized numbers on flash, beyond the SIM phonebook
+        self.access = AccessLog()  # call decisions on flash
+        self.calls = CallFilter()  # recently denied callers and RING rate limits
+        self.gk_keys = set(phone.key(number) for number in GK_numbers)
+        for key in self.gk_keys:
+            self.auth.add(key, ROLE_ADMIN)
+        self.events = EventQueue(events_max)  # (urc name, line, ticks_us when received)
+        self.cmt_header = None  # +CMT: header waiting for the message body
+        self.cmt_body = []
+        self.cmt_dcs = None
+        self.cmt_length = None
+        self.current = None  # Transaction waiting for its final result code
+        self.commands = []  # queued Transactions, by priority
+        self.sync_next = 0  # first slot the next incremental phonebook sync verifies
+        self.auth_pruned = False  # ROLE_SIM copies of deleted contacts removed since the last full load
+        self.gprs_ready = False
+        self.powered_on = None  # ticks_us when check_start last powered the modem on
+        self.boot_phases = []  # (phase, duration in ms) of the last init_device
+        self.gate = Gate()
+        self.clip_latency = metrics.histogram("clip_to_relay_us")
+        self.ring_received = None  # ticks_us of the RING of the call in progress
+        self.outbox = Outbox(self)
+        self.on_status = None  # awaited with (line, received) for status URCs, set by the Supervisor
+        self.on_wait = None  # called while waiting for the modem, e.g. to feed the watchdog
+        self.scheduler = None  # set by scheduler.Scheduler, the waits for the modem then let the other tasks run
+        self.urc_handlers = {
+            "RING": self.handle_ring,
+            "+CLIP:": self.handle_clip,
+            "+CMTI:": self.handle_cmti,
+            "+CMT:": self.handle_cmt,
+            "NORMAL POWER DOWN": self.handle_status,
+            "UNDER-VOLTAGE": self.handle_status,
+            "OVER-VOLTAGE": self.handle_status,
+            "+CPIN:": self.handle_status,
+            "+CREG:": self.handle_status,
+            "+CFUN:": self.handle_status,
+            "RDY": self.handle_status,
+            "Call Ready": self.handle_status,
+            "SMS Ready": self.handle_status,
+        }
+        
+    async def transact(self, cmd=None, timeout=2000, raw=None, on_line=None, priority=PRIO_NORMAL, raw_lines=False):
+        """
+        Runs a single AT command transaction. Returns as soon as the modem answers
+        with a final result code (OK, ERROR, +CME ERROR, +CMS ERROR) or the > prompt.
+        Commands queued with a higher priority are run first. Awaited through
+        Scheduler.transact once a Scheduler is attached, blocks otherwise.
+        
+        :param cmd: AT command, None to only wait for a response
+        :param timeout: time in milliseconds
+        :param raw: raw bytes to write instead of an AT command (e.g. SMS body)
+        :param on_line: callback for intermediate lines, if given the lines are not collected
+        :param priority: PRIO_CALL, PRIO_NORMAL or PRIO_BACKGROUND
+        :param raw_lines: pass the information lines to on_line as memoryviews, not decoded
+        :return: ATResult
+        """
+        if self.scheduler is not None:
+            return await self.scheduler.transact(cmd, timeout, raw, on_line, priority, raw_lines)
+        with self.uart_lock:
+            tr = self.begin(cmd, timeout, raw, on_line, priority=priority, raw_lines=raw_lines)
+        await self.complete(tr)
+        return tr.result()
+
+    def begin(self, cmd=None, timeout=2000, raw=None, on_line=None, on_done=None, priority=PRIO_NORMAL, raw_lines=False):
+        """
+        Queues an AT command transaction without waiting for the response. It is
+        written as soon as the transaction in progress and the queued ones with a
+        higher or the same priority are finished. Must be called with uart_lock held.
+        
+        :param cmd: AT command, None to only wait for a response
+        :param timeout: time in milliseconds, counted from when the command is written
+        :param raw: raw bytes to write instead of an AT command (e.g. SMS body), always
+                    written first as the modem waits for them after the > prompt
+        :param on_line: callback for intermediate lines, if given the lines are not collected
+        :param on_done: callback called with the transaction once it is finished
+        :param priority: PRIO_CALL, PRIO_NORMAL or PRIO_BACKGROUND
+        :param raw_lines: pass the information lines to on_line as memoryviews, not decoded
+        :return: Transaction
+        """
+        if raw is not None:
+            priority = PRIO_PROMPT
+        tr = Transaction(cmd, timeout, on_line, on_done, raw, priority, raw_lines)
+        i = len(self.commands)
+        while i and self.commands[i - 1].priority > priority:
+            i -= 1
+        self.commands.insert(i, tr)
+        self.start_next()
+        return tr
+
+    def start_next(self):
+        """
+        Writes the first queued command if no transaction is in progress.
+        Must be called with uart_lock held.
+        """
+        if self.current is None and self.commands:
+            tr = self.commands.pop(0)
+            self.current = tr
+            tr.start(self.uart)
+
+    def busy(self):
+        """
+        :return: True if a transaction is in progress or queued
+        """
+        return self.current is not None or bool(self.commands)
+
+    async def complete(self, tr):
+        """
+        Waits until the transaction is finished or its timeout expires. The lock
+        is only taken while the UART is read, never across the wait. Awaited
+        through Scheduler.complete once a Scheduler is attached, otherwise the
+        CPU sleeps while the modem sends nothing.
+        
+        :param tr: Transaction
+        """
+        if self.scheduler is not None:
+            await self.scheduler.complete(tr)
+            return
+        while not tr.done:
+            with self.uart_lock:
+                n = self.pump()
+            if self.on_wait:
+                self.on_wait()
+            if not n and not tr.done:
+                utime.sleep_ms(wait_sleep_ms)
+
+    def abandon(self, tr):
+        """
+        Ends a transaction that timed out or is no longer needed.
+        Must be called with uart_lock held.
+        
+        :param tr: Transaction
+        """
+        if tr in self.commands:
+            self.commands.remove(tr)
+        if self.current is tr:
+            self.current = None
+        if not tr.done:
+            tr.finish(AT_TIMEOUT)
+        self.start_next()
+
+    def pump(self):
+        """
+        Reads the UART, passes response lines to the current transaction, queues URCs,
+        ends a transaction that timed out and writes the next queued command.
+        Must be called with uart_lock held.
+        
+        :return: number of bytes read
+        """
+        n = self.rx.fill(self.uart)
+        if n:
+            metrics.count("uart_rx_bytes", n)
+        while True:
+            tr = self.current
+            line = self.receive(tr.prefix if tr else None)
+            if line is None:
+                break
+            if tr is None or not (tr.raw_lines and atparse.starts(line, tr.prefix)):
+                line = str(line, 'utf-8', 'ignore')
+            if tr is None or tr is not self.current:
+                self.events.push(None, line, utime.ticks_us())
+            elif tr.feed(line) and self.current is tr:
+                self.current = None
+                self.start_next()
+        tr = self.current
+        if tr is not None and self.rx.prompt():
+            self.current = None
+            tr.finish(AT_PROMPT)
+        elif tr is not None and tr.expired():
+            self.link.error()
+            self.abandon(tr)
+        self.start_next()
+        return n
+
+    def receive(self, prefix=None):
+        """
+        Takes the next complete line from the RX buffer. URCs are put on the event
+        queue instead of being returned. Lines are matched on their bytes and only
+        decoded when they are queued. Must be called with uart_lock held.
+        
+        :param prefix: response prefix of the current AT command as bytes, lines starting
+                       with it are never URCs
+        :return: memoryview of the line, valid until the buffer is filled again, or None
+                 if no complete line is buffered
+        """
+        while True:
+            line = self.rx.readline()
+            if line is None:
+                return None
+            received = utime.ticks_us()
+
+            if self.cmt_header is not None: # Message body of +CMT:, may have empty lines
+                self.cmt_body.append(str(line, 'utf-8', 'ignore'))
+                self.queue_cmt(received)
+                continue
+
+            if not len(line):
+                continue
+
+            name = atparse.match(line, URC_TABLE)
+            if name is None or (prefix and atparse.starts(line, prefix)):
+                return line
+            if name == "RING":
+                # The line is the name, nothing to decode
+                if self.ring_received is None:
+                    self.ring_received = received
+                if self.calls.ring(utime.ticks_ms()):
+                    self.events.push(name, name, received)
+                else:
+                    metrics.count("rings_throttled")
+                continue
+            if name == "+CLIP:":
+                metrics.count("calls")
+                if self.open_gate_fast(line, received) == THROTTLED:
+                    metrics.count("calls_throttled")
+                    continue
+            line = str(line, 'utf-8', 'ignore')
+            if name == "+CMT:":
+                self.cmt_header = line
+                self.cmt_body = []
+                try:
+                    self.cmt_dcs, self.cmt_length = parse_cmt_header(line)[2:]
+                except ValueError:
+                    self.cmt_dcs, self.cmt_length = None, None
+                if self.cmt_length == 0:
+                    self.queue_cmt(received)
+                continue
+            self.events.push(name, line, received)
+
+    def queue_cmt(self, received):
+        """
+        Queues the +CMT: event once the whole message body has been received.
         
-    def wait_resp_info(self, timeout=2000):
+        :param received: ticks_us when the last line was read
+        """
+        if self.cmt_length != 0 and not body_complete(self.cmt_body, self.cmt_dcs, self.cmt_length):
+            return
+        self.events.push("+CMT:", self.cmt_header + "\n" + "\n".join(self.cmt_body), received)
+        self.cmt_header = None
+        self.cmt_body = []
+
+    def hung_up(self, tr):
+        """
+        Records the RING -> hang up time once ATH is answered.
+        
+        :param tr: ATH Transaction
+        """
+        if self.ring_received is not None:
+            metrics.observe("ring_to_hangup_ms", utime.ticks_diff(utime.ticks_us(), self.ring_received) // 1000)
+            self.ring_received = None
+
+    def open_gate_fast(self, line, received):
+        """
+        Fast path of an incoming call: opens the gate as soon as +CLIP: of an authorized
+        caller is read. The number is parsed from the undecoded line. Callers cached as
+        denied are not looked up again. Every call is hung up, ATH is queued ahead of
+        queued commands before the decision is recorded in the access log (in RAM,
+        written when idle) unless the call is throttled.
+        
+        :param line: memoryview of the URC line in the format: +CLIP: "<number>",<type>,...
+        :param received: ticks_us when the line was read
+        :return: OPENED, DENIED, LOCKED_OUT or THROTTLED
+        """
+        start, end, toa = atparse.clip_fields(line)
+        key = phone.key_bytes(line, start, end, toa) if start >= 0 else None
+        now = utime.ticks_ms()
+        if self.calls.is_denied(key, now):
+            metrics.count("denied_cached")
+            authorized = False
+        else:
+            authorized = self.is_key_authorized(key)
+            if not authorized:
+                self.calls.deny(key, now)
+        if not authorized:
+            decision = THROTTLED if self.calls.throttle(key, now) else DENIED
+        elif not self.gate.open():
+            decision = LOCKED_OUT
+        else:
+            decision = OPENED
+        latency = utime.ticks_diff(utime.ticks_us(), received)
+        if decision == OPENED:
+            self.clip_latency.add(latency)
+            metrics.count("gate_opened")
+        self.begin("ATH", priority=PRIO_CALL, on_done=self.hung_up)
+        if decision != THROTTLED:
+            self.access.add(key, decision, latency)
+        return decision
+
+    def poll(self):
+        """
+        Reads everything the modem sent, queues URCs as events, passes response
+        lines to the transaction in progress and moves the SMS outbox on.
+        
+        :return: number of queued events
+        """
+        with self.uart_lock:
+            self.pump()
+            self.outbox.step()
+        return len(self.events)
+
+    async def wait_resp_info(self, timeout=2000):
         """
         Waits for response from modem.
         
         :param timeout: time in milliseconds
-        :return: raw modem response
-        """
-        prvmills = utime.ticks_ms()
-        info = b""
-        while (utime.ticks_ms()-prvmills) < timeout:
-            if uart.any():
-                info = b"".join([info, uart.read(1)])
-        print(info.decode())
-        return info
+        :return: ATResult
+        """
+        res = await self.transact(timeout=timeout)
+        log.debug("%s", res)
+        return res
     
-    def power_on_off(self):
+    async def pause(self, ms):
+        """
+        Waits without reading the UART: the other tasks run under the Scheduler,
+        otherwise it blocks.
+        
+        :param ms: time in milliseconds
+        """
+        if self.scheduler is not None:
+            await self.scheduler.pause(ms)
+        else:
+            utime.sleep_ms(ms)
+
+    async def power_on_off(self):
         """
         Powers on/off the modem.
         """
         pwr_key = machine.Pin(pwr_en, machine.Pin.OUT)
         pwr_key.value(1)
-        utime.sleep(2)
+        await self.pause(2000)
         pwr_key.value(0)
 
-    def send_at(self, cmd, back, timeout=2000):
+    async def send_at(self, cmd, back, timeout=2000):
         """
         Sends AT command to the modem and waits for the response.
         
@@ -61,35 +618,34 @@ class Modem:
         :param timeout: timeout in milliseconds
         :return: True if expected response found, False otherwise
         """
-        rec_buff = b''
-        with uart_lock:
-            uart.write((cmd+'\r\n').encode())
-            prvmills = utime.ticks_ms()
-            while (utime.ticks_ms()-prvmills) < timeout:
-                if uart.any():
-                    rec_buff = b"".join([rec_buff, uart.read(1)])
-        if rec_buff != b'':
-            if back not in rec_buff.decode():
-                print(cmd + ' back:\t' + rec_buff.decode())
-                return 0
-            else:
-                print(rec_buff.decode())
-                return 1
+        res = await self.transact(cmd, timeout)
+        if res.status == AT_TIMEOUT and not res.lines:
+            log.warning("%s no response", cmd)
+            return
+        response = res.text() + '\n' + (res.error or res.status)
+        if back not in response:
+            log.warning("%s back:\t%s", cmd, response)
+            return 0
         else:
-            print(cmd + ' no response')
+            log.debug("%s (%s ms)", response, res.elapsed)
+            return 1
             
-    def check_gsm(self):
+    async def check_gsm(self, reset=True):
         """
         Initialize GSM: SIM check, signal quality, operator
         
+        :param reset: reset the module first and wait until it is ready again
         :return: True if GSM module is ready, False otherwise
         """
-        print("\n--- GSM MODULE TEST ---")
+        log.debug("--- GSM MODULE TEST ---")
 
-        print("\n[INFO] Resetting GSM module...")
-        self.full_reset()
-        print("[INFO] Waiting for module to reboot...")
-        utime.sleep(10)
+        if reset:
+            log.info("Resetting GSM module...")
+            since = utime.ticks_us()
+            await self.full_reset()
+            log.info("Waiting for module to reboot...")
+            if not await self.wait_status(("Call Ready", "SMS Ready"), ready_timeout_ms, since):
+                log.warning("No Call Ready / SMS Ready after reset.")
 
         commands = [
             ("AT", "OK"),
@@ -97,521 +653,1116 @@ class Modem:
             ("AT+CPIN?", "READY"),  # SIM card ready?
             ("AT+CSQ", "OK"),  # Signal quality
             ("AT+COPS?", "OK"),  # Operator
-            ("AT+CREG?", "0,1"),  # GSM network registration
+        ]
+
+        for cmd, expected_response in commands:
+            log.debug("Sending: %s", cmd)
+            success = await self.send_at(cmd, expected_response)
+            if not success:
+                log.error("Command failed: %s", cmd)
+                return False  
+
+        if not await self.wait_registered():
+            log.error("Not registered to the GSM network.")
+            return False
+
+        log.debug("--- GSM MODULE READY ---")
+        return True
+
+    async def setup_gprs(self):
+        """
+        Sets up the GPRS context. Call handling and SMS do not need it, it is set up
+        at boot only with gprs_at_boot, otherwise by the first user.
+        
+        :return: True if the context is up, False otherwise
+        """
+        if self.gprs_ready:
+            return True
+        commands = [
             (f'AT+CSTT="{APN}","",""', "OK"),  # Set APN
             ("AT+CSTT?", "OK"),  # Check APN
             ("AT+CIICR", "OK"),  # Bring up wireless connection
             ("AT+CIFSR", "")  # Get local IP address
         ]
-
         for cmd, expected_response in commands:
-            print(f"\nSending: {cmd}")
-            success = self.send_at(cmd, expected_response)
-            if success:
-                print("[OK]")
+            log.debug("Sending: %s", cmd)
+            if not await self.send_at(cmd, expected_response, 10000):
+                log.error("Command failed: %s", cmd)
+                return False
+        self.gprs_ready = True
+        return True
+
+    async def wait_status(self, names, timeout, since=None):
+        """
+        Waits until every one of the status URCs has been received. The URCs stay
+        queued for dispatch.
+        
+        :param names: URC names, e.g. ("Call Ready", "SMS Ready")
+        :param timeout: time in milliseconds
+        :param since: ticks_us, URCs received before are not counted
+        :return: True if all of them were received, False on timeout
+        """
+        start = utime.ticks_ms()
+        while True:
+            for name in names:
+                if not self.events.has(name, since):
+                    break
             else:
-                print(f"[ERROR] Command failed: {cmd}")
-                return False  
+                return True
+            if utime.ticks_diff(utime.ticks_ms(), start) >= timeout:
+                return False
+            with self.uart_lock:
+                n = self.pump()
+            if self.on_wait:
+                self.on_wait()
+            await self.pause(0 if n else wait_sleep_ms)
 
-        print("\n--- GSM MODULE READY ---")
-        return True
+    async def is_registered(self):
+        """
+        Probes the current modem state.
+        
+        :return: True if the SIM is ready and the modem is registered (home or roaming)
+        """
+        if "READY" not in (await self.transact("AT+CPIN?")).text():
+            return False
+        return await self.network_registered()
+
+    async def network_registered(self):
+        """
+        :return: True if AT+CREG? shows the modem registered, home (,1) or roaming (,5)
+        """
+        reg = (await self.transact("AT+CREG?")).text()
+        return ",1" in reg or ",5" in reg
+
+    async def wait_registered(self, timeout=register_timeout_ms):
+        """
+        Waits for the network registration, which usually follows Call Ready by a
+        few seconds. AT+CREG? is polled every register_poll_ms, sooner when a
+        +CREG: URC arrives.
+        
+        :param timeout: time in milliseconds
+        :return: True if registered, False on timeout
+        """
+        start = utime.ticks_ms()
+        while True:
+            if await self.network_registered():
+                return True
+            left = timeout - utime.ticks_diff(utime.ticks_ms(), start)
+            if left <= 0:
+                return False
+            await self.wait_status(("+CREG:",), min(left, register_poll_ms), utime.ticks_us())
 
-    def check_start(self):
+    async def check_start(self):
         """
-        Checks if modem is ready by sending AT commands.
+        Checks if modem is ready by sending AT commands. Tries the other link
+        rates, then powers the modem on and waits for RDY if it does not answer.
         
         :return: True if modem responds with "OK", False otherwise
         """
+        self.powered_on = None
         for i in range(3):  
-            with uart_lock:
-                uart.write(b'ATE1\r\n')
-            utime.sleep(2)
-            with uart_lock:
-                uart.write(b'AT\r\n')
-            rec = self.wait_resp_info()
-            if "OK" in rec.decode():
-                print("[OK] SIM868 is ready")
+            await self.transact("ATE1")
+            if (await self.transact("AT")).ok:
+                log.info("SIM868 is ready")
+                return True
+            elif i == 0 and await self.link.find():
+                # Answers at another rate (kept by the modem, e.g. the Pico lost the saved one)
+                await self.transact("ATE1")
+                log.info("SIM868 is ready")
                 return True
             else:
-                self.power_on_off()
-                print("[INFO] Restarting SIM868...")
-                utime.sleep(8)
-        raise ValueError("[ERROR] SIM868 failed to start.")
+                since = utime.ticks_us()
+                self.powered_on = since
+                await self.power_on_off()
+                log.info("Restarting SIM868...")
+                await self.wait_status(("RDY",), 8000, since)
+        log.error("SIM868 failed to start.")
+        return False
 
-    def init_device(self):
+    async def power_cycle(self):
+        """
+        Switches the modem off with the power key if it answers, then on again.
+        Does not wait for RDY.
+        
+        :return: ticks_us when the modem was powered on
+        """
+        if (await self.transact("AT", 500)).ok:
+            since = utime.ticks_us()
+            await self.power_on_off()
+            await self.wait_status(("NORMAL POWER DOWN",), 5000, since)
+        self.powered_on = utime.ticks_us()
+        await self.power_on_off()
+        self.gprs_ready = False
+        return self.powered_on
+
+    def boot_phase(self, name, started):
+        """
+        Records the duration of a boot phase.
+        
+        :param name: phase name
+        :param started: ticks_ms when the phase started
+        :return: ticks_ms now, the start of the next phase
+        """
+        now = utime.ticks_ms()
+        self.boot_phases.append((name, utime.ticks_diff(now, started)))
+        return now
+
+    async def init_device(self):
         """
         Initializes the modem: checks startup, configures GSM, enables caller ID and configurates SMS settings.
+        With fast_boot the reset is skipped if the modem is already registered.
+        
+        :return: True if the modem is ready for calls, False otherwise (the Supervisor recovers it)
         """
-        if self.check_start():
-            if self.check_gsm():
-                self.enable_caller_id()
-                self.text_mode()
-                utime.sleep(0.5)
+        self.boot_phases = []
+        boot = utime.ticks_ms()
+        if await self.check_start():
+            t = self.boot_phase("start", boot)
+            if self.powered_on is not None:
+                # Just powered on, as good as a reset once the modem is registered
+                await self.wait_status(("Call Ready", "SMS Ready"), ready_timeout_ms, self.powered_on)
+                reset = not (fast_boot and await self.wait_registered())
+            else:
+                reset = not (fast_boot and await self.is_registered())
+            t = self.boot_phase("probe", t)
+            if await self.check_gsm(reset):
+                t = self.boot_phase("reset" if reset else "gsm", t)
+                await self.configure()
+                t = self.boot_phase("config", t)
+                await self.link.negotiate()
+                t = self.boot_phase("link", t)
+                await self.load_phonebook()
+                t = self.boot_phase("phonebook", t)
+                ring_ready = utime.ticks_diff(t, boot)
+                await self.drain_inbox() # Messages received while offline
+                t = self.boot_phase("inbox", t)
+                if gprs_at_boot:
+                    await self.setup_gprs()
+                    t = self.boot_phase("gprs", t)
+                phases = ", ".join(f"{name} {ms} ms" for name, ms in self.boot_phases)
+                log.info("Boot: %s. Ready for calls after %s ms.", phases, ring_ready)
+                return True
             
             else:
-                print("[ERROR] GSM setup failed.")
-                sys.exit()
+                log.error("GSM setup failed.")
+                return False
         else:
-            print("[ERROR] SIM module failed to start.")
-            sys.exit()
+            log.error("SIM module failed to start.")
+            return False
+
+    async def configure(self):
+        """
+        Applies the settings lost when the modem restarts: caller ID, text mode,
+        SMS delivery and registration URCs.
         
-    def full_reset(self):
+        :return: True if every setting was applied, False otherwise
+        """
+        ok = bool(await self.enable_caller_id())
+        ok = bool(await self.text_mode()) and ok
+        await self.set_sms_delivery()
+        return bool(await self.enable_registration_urc()) and ok
+        
+    async def full_reset(self):
         """
         Full modem reset.
         
         :return: raw modem response ("OK" on success)
         """
-        return self.send_at("AT+CFUN=1,1", "OK")
+        return await self.send_at("AT+CFUN=1,1", "OK")
     
-    def text_mode(self):
+    async def text_mode(self):
         """
         Sets system into text mode.
         
         :return: raw modem response ("OK" on success)
         """
-        return self.send_at("AT+CMGF=1", "OK")
+        return await self.send_at("AT+CMGF=1", "OK")
     
-    def enable_caller_id(self):
+    async def set_sms_delivery(self):
+        """
+        Configures how new SMS are reported: pushed directly as +CMT: URCs (sms_direct)
+        or stored on the SIM card and announced with +CMTI:. Falls back to storage
+        if direct delivery cannot be enabled.
+        
+        :return: True if direct delivery is enabled, False for storage mode
+        """
+        # CSDH=1 shows data coding scheme and length in the +CMT: header, the length in +CMGL:
+        csdh = await self.send_at("AT+CSDH=1", "OK")
+        if sms_direct:
+            if csdh and await self.send_at("AT+CNMI=2,2,0,0,0", "OK"):
+                log.info("SMS delivered directly (+CMT).")
+                return True
+            log.warning("Direct SMS delivery not available, using SIM storage.")
+        await self.send_at("AT+CNMI=2,1,0,0,0", "OK")
+        return False
+
+    async def enable_caller_id(self):
         """
         Enables caller ID.
         
         :return: raw modem response ("OK" on success)
         """
-        return self.send_at("AT+CLIP=1", "OK")
+        return await self.send_at("AT+CLIP=1", "OK")
+
+    async def enable_registration_urc(self):
+        """
+        Reports network registration changes as +CREG: <stat> URCs.
+        
+        :return: raw modem response ("OK" on success)
+        """
+        return await self.send_at("AT+CREG=1", "OK")
 
     def hang_up(self):
         """
-        Hangs up the current call.
+        Hangs up the current call. Does not wait, ATH is written ahead of every
+        queued command but the one in progress.
+        
+        :return: Transaction
         """        
         with self.uart_lock:
-            self.uart.write(b"ATH\r\n")
+            return self.begin("ATH", priority=PRIO_CALL)
             
-    def get_contact_range(self):
+    async def get_contact_range(self):
         """
         Returns available contact index range stored on the SIM card.
         
-        :return: raw modem response (+CPBR: (1-250),...)
+        :return: modem response (+CPBR: (1-250),...)
         """
-        with self.uart_lock:
-            self.uart.write(b'AT+CPBR=?\r\n') 
-            utime.sleep(0.5)
-            resp = self.uart.read().decode('ignore')
-            return resp
+        return (await self.transact('AT+CPBR=?')).text()
+
+    def parse_contact_range(self, resp):
+        """
+        Parses the phonebook index range from the AT+CPBR=? response.
+        
+        :param resp: raw modem response (+CPBR: (1-250),...)
+        :return: tuple (min_idx, max_idx)
+        """
+        start = resp.index('(') + 1
+        end = resp.index(')')
+        index_range = resp[start:end]
+        min_idx, max_idx = [int(x) for x in index_range.split('-')]
+        return min_idx, max_idx
+
+    async def load_phonebook(self):
+        """
+        Reads every SIM phonebook slot once and builds the in-RAM phonebook index.
+        
+        :return: True if the index was loaded, False otherwise
+        """
+        try:
+            min_idx, max_idx = self.parse_contact_range(await self.get_contact_range())
+        except Exception as e:
+            log.error("Could not read SIM contact range: %s", e)
+            return False
+
+        self.phonebook.reset(min_idx, max_idx)
+        self.calls.clear()
+        complete = True
+        for start, end in self.phonebook_chunks():
+            entries, fingerprint, ok = await self.read_chunk(start, end)
+            for i, sim_number, number_type, text in entries:
+                self.phonebook.add(i, phone.key(sim_number, number_type), sim_number)
+            if ok:
+                self.phonebook.fingerprints[start] = fingerprint
+            else:
+                complete = False
+        self.phonebook.loaded = True
+        self.sync_next = min_idx
+        log.info("Phonebook loaded: %s contacts, %s free slots.", len(self.phonebook), len(self.phonebook.free_slots))
+        self.sync_auth(complete)
+        return True
+
+    def phonebook_chunks(self):
+        """
+        :return: list of (first slot, last slot) of the chunks read with one ranged AT+CPBR
+        """
+        chunk = max(1, uart_rxbuf // CPBR_LINE_MAX)
+        pb = self.phonebook
+        return [(start, min(start + chunk - 1, pb.max_idx)) for start in range(pb.min_idx, pb.max_idx + 1, chunk)]
+
+    def chunk_of(self, slot):
+        """
+        :param slot: phonebook slot
+        :return: (first slot, last slot) of the chunk holding the slot
+        """
+        chunk = max(1, uart_rxbuf // CPBR_LINE_MAX)
+        start = self.phonebook.min_idx + (slot - self.phonebook.min_idx) // chunk * chunk
+        return start, min(start + chunk - 1, self.phonebook.max_idx)
+
+    async def read_chunk(self, start, end, timeout=3000):
+        """
+        Reads a slot range with one ranged AT+CPBR=<start>,<end>.
+        
+        :param start: first slot
+        :param end: last slot
+        :param timeout: time in milliseconds
+        :return: tuple (entries, fingerprint, ok): the (index, number, type, text) tuples,
+                 CRC32 of the +CPBR: lines and False if the read failed or lines were garbled
+        """
+        entries = []
+        fingerprint = [0]
+        garbled = [0]
+
+        def collect(line):
+            # Undecoded line, only the number and the text of an entry are copied
+            fields = atparse.cpbr_fields(line)
+            if fields:
+                i, first, last, number_type = fields
+                text_first, text_end = atparse.quoted(line, last + 1)
+                text = str(line[text_first:text_end], 'utf-8', 'ignore') if text_first >= 0 else ""
+                entries.append((i, str(line[first:last], 'utf-8', 'ignore'), number_type, text))
+                fingerprint[0] = binascii.crc32(line, fingerprint[0])
+            else:
+                # Bytes lost on the link, the entry is missing
+                garbled[0] += 1
+                self.link.error()
+
+        res = await self.transact(f'AT+CPBR={start},{end}', timeout, on_line=collect, priority=PRIO_BACKGROUND,
+                            raw_lines=True)
+        if res.status != AT_OK:
+            log.warning("AT+CPBR=%s,%s failed: %s", start, end, res.error or res.status)
+        elif garbled[0]:
+            log.warning("AT+CPBR=%s,%s: %s garbled lines", start, end, garbled[0])
+        return entries, fingerprint[0], res.ok and not garbled[0]
+
+    async def phonebook_usage(self):
+        """
+        Reads the used and total phonebook slot counts.
+        
+        :return: tuple (used, total) or None if the modem did not answer
+        """
+        res = await self.transact("AT+CPBS?")
+        for line in res.lines:
+            if line.startswith("+CPBS:"):
+                try:
+                    fields = line[6:].split(",")
+                    return int(fields[1]), int(fields[2])
+                except (ValueError, IndexError):
+                    pass
+        return None
+
+    async def refresh_chunk(self, start, end):
+        """
+        Reads a chunk and updates the index if its fingerprint changed. Contacts
+        added or removed on the SIM (e.g. with a phone) are added to or removed
+        from the flash store as well.
+        
+        :param start: first slot of the chunk
+        :param end: last slot of the chunk
+        :return: True if the chunk changed, False otherwise
+        """
+        entries, fingerprint, ok = await self.read_chunk(start, end)
+        if not ok or self.phonebook.fingerprints.get(start) == fingerprint:
+            return False
+        removed = self.phonebook.clear_range(start, end)
+        for i, sim_number, number_type, text in entries:
+            key = phone.key(sim_number, number_type)
+            self.phonebook.add(i, key, sim_number)
+            self.calls.forget(key)
+            if key is not None and key not in self.auth:
+                self.auth.add(key, ROLE_SIM)
+        for key in removed:
+            if key not in self.phonebook and self.auth.role(key) == ROLE_SIM:
+                self.auth.remove(key)
+        self.phonebook.fingerprints[start] = fingerprint
+        return True
+
+    async def sync_phonebook(self):
+        """
+        Incremental phonebook sync. AT+CPBS? tells if contacts were added or removed:
+        if the used count matches the index only the next chunk in turn is verified,
+        otherwise chunks are read until the index matches again. Chunks that failed
+        to read at the last load are read as well, then the flash store is pruned.
+        Chunks whose fingerprint did not change are not re-indexed.
+        
+        :return: number of slots read
+        """
+        if not self.phonebook.loaded:
+            await self.load_phonebook()
+            return self.phonebook.max_idx - self.phonebook.min_idx + 1
+        usage = await self.phonebook_usage()
+        if usage is None:
+            log.warning("Phonebook sync skipped, no AT+CPBS? response.")
+            return 0
+        used, total = usage
+        if total != self.phonebook.max_idx - self.phonebook.min_idx + 1:
+            await self.load_phonebook()
+            return total
+
+        chunks = self.phonebook_chunks()
+        first = 0
+        for n, (start, end) in enumerate(chunks):
+            if start <= self.sync_next <= end:
+                first = n
+        read = 0
+        changed = 0
+        for n in range(len(chunks)):
+            start, end = chunks[(first + n) % len(chunks)]
+            if await self.refresh_chunk(start, end):
+                changed += 1
+            read += end - start + 1
+            self.sync_next = end + 1 if end < self.phonebook.max_idx else self.phonebook.min_idx
+            # Chunks that failed to read are not indexed, they are read until they are
+            if len(self.phonebook) == used and len(self.phonebook.fingerprints) == len(chunks):
+                break
+        if not self.auth_pruned and len(self.phonebook.fingerprints) == len(chunks):
+            self.sync_auth()
+        log.info("Phonebook sync: %s slots read, %s chunks changed, %s contacts.", read, changed, len(self.phonebook))
+        return read
 
-    def read_sms_by_index(self, sms_index):
+    async def sync_slot(self, slot):
+        """
+        Re-reads the chunk of a slot after it was written, keeps its fingerprint current.
+        
+        :param slot: phonebook slot
+        :return: number of slots read
+        """
+        start, end = self.chunk_of(slot)
+        await self.refresh_chunk(start, end)
+        return end - start + 1
+
+    def sync_auth(self, prune=True):
+        """
+        Copies SIM contacts missing from the flash store (e.g. saved with a phone) to the
+        store as ROLE_SIM, and removes the ROLE_SIM copies of contacts that are no longer
+        on the SIM (e.g. deleted with a phone while the device was off).
+        
+        :param prune: remove stale copies, only when every phonebook chunk was read
+        :return: tuple (number of copied contacts, number of removed copies)
+        """
+        copied = 0
+        for key, number in self.phonebook.slots.values():
+            if key is not None and key not in self.auth:
+                self.auth.add(key, ROLE_SIM)
+                copied += 1
+        removed = 0
+        if prune:
+            # Collected first, removing may compact the file being read
+            stale = [number for number, role in self.auth.numbers() if role == ROLE_SIM and int(number) not in self.phonebook]
+            for number in stale:
+                self.auth.remove(number)
+            removed = len(stale)
+        self.auth_pruned = prune
+        if copied or removed:
+            log.info("%s SIM contacts copied to the flash store, %s copies of deleted contacts removed.", copied, removed)
+        return copied, removed
+
+    async def read_sms_by_index(self, sms_index):
         """
         Reads SMS from a specific memory index.
         
         :param sms_index: the index of the SMS message to read
-        :return: raw modem response containing the SMS header and message body
+        :return: modem response lines: the +CMGR: header followed by the message body
         """
-        with self.uart_lock:
-            self.uart.write(b"AT+CMGF=1\r\n")  # Set to text mode
-            utime.sleep(0.2)
-            
-            self.uart.write(f"AT+CMGR={sms_index}\r\n".encode())
-            utime.sleep(0.5)
-            return self.uart.read().decode('ignore')
+        await self.text_mode()
+        return (await self.transact(f"AT+CMGR={sms_index}")).lines
         
-    def read_contact(self, i):
+    async def read_contact(self, i):
         """
         Reads a single contact entry from the SIM card phonebook.
         
         :param i: index of contact to read
-        :return: raw modem response in the format: +CPBR: <index>,<number>,<type>,<text>
+        :return: modem response in the format: +CPBR: <index>,<number>,<type>,<text>
         """
-        with self.uart_lock:
-            self.uart.write(f'AT+CPBR={i}\r\n'.encode())
-            utime.sleep(0.3)
-            entry = self.uart.read().decode('ignore')
-            return entry
-        
-            
-    def delete_sms(self, sms_index):
+        return (await self.transact(f'AT+CPBR={i}')).text()
+
+    async def delete_sms(self, sms_index):
         """
         Deletes message from the SIM card.
 
         :param sms_index: index of the SMS to delete
         """
-        with self.uart_lock:
-            self.uart.write(f"AT+CMGD={sms_index}\r\n".encode())
-            utime.sleep(0.5)
-            
-            if self.uart.any():
-                response = self.uart.read().decode("ignore")
-                if "OK" in response:
-                    print(f"[INFO] SMS at index {sms_index} deleted.")
-                else:
-                    print(f"[WARNING] Failed to delete SMS at index {sms_index}")
-            else:
-                print(f"[WARNING] No response after attempting to delete SMS at index {sms_index}")
+        res = await self.transact(f"AT+CMGD={sms_index}")
+        if res.ok:
+            log.info("SMS at index %s deleted.", sms_index)
+        elif res.status == AT_TIMEOUT:
+            log.warning("No response after attempting to delete SMS at index %s", sms_index)
+        else:
+            log.warning("Failed to delete SMS at index %s", sms_index)
             
-    def send_sms_text(self, number, message):
+    async def send_sms_text(self, number, message):
         """
         Sends SMS message to the given phone number.
 
         :param number: recipient's phone number
         :param message: message content
+        :return: ATResult of the message body, the lines contain +CMGS: <mr> on success
         """
-        with self.uart_lock:
-            self.text_mode()
-            utime.sleep(0.5)
+        await self.text_mode()
 
-            self.uart.write(f'AT+CMGS="{number}"\r\n'.encode())
-            utime.sleep(1)
-
-            self.uart.write(message.encode() + b"\x1A")
-            
-    def uart_read(self):
-        """
-        Reads and decodes uart response.
+        res = await self.transact(f'AT+CMGS="{number}"', 5000)
+        if res.status != AT_PROMPT:
+            return res
 
-        :return: decoded uart response or an empty string if no data is available
-        """
-        with self.uart_lock:
-            if self.uart.any():
-                return self.uart.read().decode('ignore')
-            else:
-                return ""
+        return await self.transact(raw=message.encode() + b"\x1A", timeout=60000)
             
-    def delete_all_messages(self):
+    async def delete_all_messages(self):
         """
         Deletes all SMS messages from the SIM card.
         
         :return: raw modem response ("OK" on success)
         """
-        return self.send_at("AT+CMGD=1,4", "OK")
+        return await self.send_at("AT+CMGD=1,4", "OK")
     
-    def clean_number(self, number):
-        """
-        Removes the "+48" country code prefix from a phone number, if present.
-        
-        :param number: phone number
-        :return: phone number without "+48" prefix 
-        """
-        if number.startswith("+48"):
-            number = number[3:]
-        return number
-
     def is_number_valid(self, number):
         """
-        Checks if a phone number is valid (exactly 9 digits after cleaning).
+        Checks if a phone number is valid: a national number or an international
+        one (+<country code>..., 00<country code>...).
         
         :param number: phone number to validate
         :return: True if the number is valid, False otherwise
         """
-        number = self.clean_number(number)
-        return number.isdigit() and len(number) == 9
+        return phone.key(number) is not None
     
-    def is_number_in_sim(self, contact_number):
+    def is_number_in_sim(self, contact_number, toa=None):
         """
         Checks if a given phone number is stored in the SIM card's phonebook.
+        Uses the in-RAM phonebook index, the modem is not queried.
         
         :param contact_number: phone number to search for
+        :param toa: type of address shown with the number
         :return: the stored number if found, None otherwise
         """
-        resp = self.get_contact_range()
-
-        try:
-            start = resp.index('(') + 1
-            end = resp.index(')')
-            index_range = resp[start:end]
-            min_idx, max_idx = [int(x) for x in index_range.split('-')]
+        return self.phonebook.stored_number(phone.key(contact_number, toa))
 
-            for i in range(min_idx, max_idx + 1):
-                entry = self.read_contact(i)
-
-                if "+CPBR:" in entry: # If number in phonebook
-                    try:
-                        parts = entry.split(',')
-                        sim_number = parts[1].strip().strip('"')
-
-                        if sim_number == contact_number:
-                            return sim_number
-                    except:
-                        pass
-            return None
+    def is_number_authorized(self, number, toa=None):
+        """
+        Checks if a caller may open the gate: the number is in the SIM phonebook
+        or in the flash store.
+        
+        :param number: phone number
+        :param toa: type of address shown with the number
+        :return: True if authorized, False otherwise
+        """
+        return self.is_key_authorized(phone.key(number, toa))
 
-        except Exception as e:
-            print("[ERROR] Could not read SIM contacts:", e)
-            return None
+    def is_key_authorized(self, key):
+        """
+        :param key: canonical key of the caller's number, None if it is not valid
+        :return: True if the number may open the gate, False otherwise
+        """
+        if key is None:
+            return False
+        return key in self.phonebook or key in self.auth
     
     def is_number_GK(self, number):
         """
         Checks if a given number belongs to the Gate Keeper (GK) admin.
         
         :param number: phone number to check
-        :return: True if the number is in the GK list, False otherwise
+        :return: True if the number is in the GK list or an admin in the flash store, False otherwise
         """
-        return number in GK_numbers     
+        key = phone.key(number)
+        if key is None:
+            return False
+        return key in self.gk_keys or self.auth.role(key) == ROLE_ADMIN
     
-    def add_contact(self, number):
+    async def add_contact(self, number):
         """
-        Adds a contact to the SIM card if it is valid and not already saved.
+        Adds a contact to the SIM card if it is valid and not already saved, and to
+        the flash store. When the SIM phonebook is full or was not read the number
+        is only saved to the flash store.
         
         :param number: phone number to add
-        :return: status string: "number_added", "already_saved", "invalid_number" or "failed_to_save"
+        :return: status string: "number_added", "number_stored" (flash store only), "already_saved",
+                 "invalid_number" or "failed_to_save"
         """
         if not self.is_number_valid(number):
-            print("[INFO] Invalid number.")
+            log.info("Invalid number.")
             resp = "invalid_number"
             return resp
         if self.is_number_in_sim(number):
-            print(f"[INFO] Number already saved.")
+            log.info("Number already saved.")
             resp = "already_saved"
             return resp
         else:
+            key = phone.key(number)
+            self.calls.forget(key)  # may be cached as denied, authorized from now on
+            # Free slots are only known once the phonebook was read
+            slot = self.phonebook.take_free_slot() if self.phonebook.loaded else None
+            if slot is None:
+                if key in self.auth:
+                    log.info("Number already saved.")
+                    resp = "already_saved"
+                    return resp
+                self.auth.add(key, ROLE_USER)
+                log.info("SIM phonebook full or not read, number '%s' saved to the flash store.", number)
+                resp = "number_stored"
+                return resp
+
             name = ""
 
-            number_type = INTERNATIONAL if number.startswith('+') else UNKNOWN
+            # Always saved in the international format, whatever form the number was sent in
+            sim_number = phone.international(key)
+            number_type = INTERNATIONAL
     
-            command = f'AT+CPBW=1,"{number}",{number_type},"{name}"'
-            print(f"\nSending: {command}")
-            if self.send_at(command, "OK"):
-                print(f"[OK] Contact with number '{number}' saved to SIM.")
+            command = f'AT+CPBW={slot},"{sim_number}",{number_type},"{name}"'
+            log.debug("Sending: %s", command)
+            if await self.send_at(command, "OK"):
+                self.phonebook.add(slot, key, sim_number)
+                if key not in self.auth:
+                    self.auth.add(key, ROLE_SIM)
+                await self.sync_slot(slot)
+                log.info("Contact with number '%s' saved to SIM.", number)
                 resp = "number_added"
                 return resp
             else:
-                print(f"[ERROR] Failed to save contact.")
+                self.phonebook.release_slot(slot)
+                log.error("Failed to save contact.")
                 resp = "failed_to_save"
                 return resp
             
-    def delete_contact(self, number):
+    async def delete_contact(self, number):
         """
-        Deletes a contact from the SIM card phonebook.
+        Deletes a contact from the SIM card phonebook and the flash store.
         
         :param number: phone number to delete
         :return: status string: "number_deleted", "number_not_found" or "invalid_number"
         """
         if not self.is_number_valid(number):
-            print("[INFO] Invalid number.")
+            log.info("Invalid number.")
             resp = "invalid_number"
             return resp
     
-        response = self.get_contact_range()
-    
-        try:
-            start = response.index('(') + 1
-            end = response.index(')')
-            index_range = response[start:end]
-            min_idx, max_idx = [int(x) for x in index_range.split('-')]
-
-        except:
-            print("[ERROR] Failed to parse index range")
-            return
-    
-        for i in range(min_idx, max_idx + 1):
-            entry = self.read_contact(i)
-            if number in entry:
-                print(f"[INFO] Found number at index {i}, deleting...")
-                uart.write(f'AT+CPBW={i}\r\n'.encode())
-                utime.sleep(0.2)
-                print(f"[OK] Contact with number {number} deleted.")
+        key = phone.key(number)
+        i = self.phonebook.slot_of(key)
+        if i is None:
+            if self.auth.role(key) in (ROLE_USER, ROLE_SIM):
+                self.auth.remove(key)
+                log.info("Number %s deleted from the flash store.", number)
                 resp = "number_deleted"
                 return resp
+            log.info("Number %s not found in SIM contacts.", number)
+            resp = "number_not_found"
+            return resp
 
-        print(f"[INFO] Number {number} not found in SIM contacts.")
-        resp = "number_not_found"
-        return resp
+        log.info("Found number at index %s, deleting...", i)
+        if await self.send_at(f'AT+CPBW={i}', "OK"):
+            self.phonebook.remove(key)
+            if self.auth.role(key) in (ROLE_USER, ROLE_SIM):
+                self.auth.remove(key)
+            await self.sync_slot(i)
+            log.info("Contact with number %s deleted.", number)
+            resp = "number_deleted"
+            return resp
+
+        log.error("Failed to delete contact at index %s.", i)
+        return
     
-    def sms_command(self, text):
+    async def sms_command(self, text):
         """
         Returns text of the response to send depending on the received message
         
         :param text: the received SMS message text
-        :return: response text to send back via SMS, or None if no reply is needed
+        :return: response text to send back via SMS, a list of texts for a batch,
+                 or None if no reply is needed
         """
+        
+        if not text.startswith("?stats") and not text.startswith("?log"):
+            ops = parse_operations(text)
+            if len(ops) > 1:
+                return await self.batch_command(ops)
 
         if text.startswith("+"):
             number = text[1:].strip().split()[0]
-            resp = self.add_contact(number)
+            resp = await self.add_contact(number)
             if resp == "already_saved":
                 message = f"Number {number} already saved."
-                print(f"[INFO] {message}")
+                log.info("%s", message)
                 return message
             elif resp == "number_added":
                 message = f"Number {number} added to SIM card."
-                print(f"[OK] {message}")
+                log.info("%s", message)
+                return message
+            elif resp == "number_stored":
+                message = f"Number {number} authorised, SIM card not updated."
+                log.info("%s", message)
                 return message
             elif resp == "failed_to_save":
                 message = f"Failed to save the number {number}"
-                print(f"[ERROR] {message}")
+                log.error("%s", message)
                 return message
             elif resp == "invalid_number":
                 message = f"Number {number} is not valid."
-                print(f"[INFO] {message}")
+                log.info("%s", message)
                 return message
             else:
                 message = f"Failed to save the number {number}"
-                print(f"[ERROR] {message}")
+                log.error("%s", message)
                 return message
         
         elif text.startswith("-"):
             number = text[1:].strip().split()[0]
-            resp = self.delete_contact(number)
+            resp = await self.delete_contact(number)
             if resp == "number_deleted":
                 message = f"Number {number} deleted from SIM card."
-                print(f"[OK] {message}")
+                log.info("%s", message)
                 return message
             elif resp == "number_not_found":
                 message = f"Number {number} not found in SIM contacts."
-                print(f"[INFO] {message}")
+                log.info("%s", message)
                 return message
             elif resp == "invalid_number":
                 message = f"Number {number} is not valid."
-                print(f"[INFO] {message}")
+                log.info("%s", message)
                 return message
             else:
                 message = f"Failed to delete number {number}."
-                print(f"[ERROR] {message}")
+                log.error("%s", message)
                 return message
             
         
+        elif text.startswith("?stats"):
+            self.dump_stats()
+            # One SMS worth of the summary, the full dump is in stats_file
+            return metrics.report()[:sms_max]
+
+        elif text.startswith("?log"):
+            return self.log_query(text[4:].strip())
+
         elif text.startswith("?"):
             number = text[1:].strip().split()[0]
             if not self.is_number_valid(number):
                 message = f"Number {number} is not valid."
-                print(f"[INFO] {message}")
+                log.info("%s", message)
                 return message
             elif self.is_number_in_sim(number):
                 message = f"Number {number} is in SIM card."
-                print(f"[INFO] {message}")
+                log.info("%s", message)
+                return message
+            elif self.is_number_authorized(number):
+                message = f"Number {number} is in the flash store."
+                log.info("%s", message)
                 return message
             else:
                 message = f"Number {number} not found."
-                print(f"[INFO] {message}")
+                log.info("%s", message)
                 return message
 
         elif text.startswith("W trakcie") or text.startswith("Masz"):
             return
     
         else:
-            print("[ERROR] Unknown command.")
-            message = f"Unknown command. Use +, - or ?."
-            print(f"[ERROR] {message}")
+            log.error("Unknown command.")
+            message = f"Unknown command. Use +, -, ?, ?log or ?stats."
+            log.error("%s", message)
             return message
     
-    def send_sms(self, number, message):
+    async def batch_command(self, ops):
+        """
+        Executes many phonebook operations of one SMS. The numbers are validated
+        first, then the AT+CPBW writes to pre-selected free slots are queued at once
+        so each one costs a single round trip, and the changed chunks are re-read
+        once at the end. If a number is given several times the last + or - wins.
+        Queries are answered with the state after the writes. The reply starts
+        with the numbers that failed or were invalid and takes as many SMS as needed.
+        
+        :param ops: list of (operation, number) from parse_operations
+        :return: list of reply messages, each fits in one SMS
+        """
+        invalid = []
+        queries = []
+        order = []  # keys to add or delete, in message order
+        plan = {}  # key -> (operation, number)
+        for op, number in ops:
+            key = phone.key(number)
+            if key is None:
+                invalid.append(number)
+            elif op == "?":
+                queries.append((key, number))
+            else:
+                if key not in plan:
+                    order.append(key)
+                plan[key] = (op, number)
+
+        added, stored, deleted, present, missing, failed = 0, 0, 0, 0, 0, []
+        writes = []  # (key, operation, number, slot, AT+CPBW command)
+        for key in order:
+            op, number = plan[key]
+            if op == "+":
+                self.calls.forget(key)  # authorized from now on
+                if key in self.phonebook or key in self.auth:
+                    present += 1
+                    continue
+                slot = self.phonebook.take_free_slot() if self.phonebook.loaded else None
+                if slot is None:
+                    # SIM phonebook full or not read, flash store only
+                    self.auth.add(key, ROLE_USER)
+                    stored += 1
+                    continue
+                writes.append((key, op, number, slot,
+                               f'AT+CPBW={slot},"{phone.international(key)}",{INTERNATIONAL},""'))
+            else:
+                slot = self.phonebook.slot_of(key)
+                if slot is None:
+                    if self.auth.role(key) in (ROLE_USER, ROLE_SIM):
+                        self.auth.remove(key)
+                        deleted += 1
+                    else:
+                        missing += 1
+                    continue
+                writes.append((key, op, number, slot, f"AT+CPBW={slot}"))
+
+        # Queued together, each write goes out as soon as the previous one is answered
+        with self.uart_lock:
+            transactions = [self.begin(write[4]) for write in writes]
+        changed = []
+        for tr, (key, op, number, slot, cmd) in zip(transactions, writes):
+            await self.complete(tr)
+            if tr.status != AT_OK:
+                log.error("%s failed: %s", cmd, tr.error or tr.status)
+                failed.append(number)
+                if op == "+":
+                    self.phonebook.release_slot(slot)
+                continue
+            if op == "+":
+                self.phonebook.add(slot, key, phone.international(key))
+                if key not in self.auth:
+                    self.auth.add(key, ROLE_SIM)
+                added += 1
+            else:
+                self.phonebook.remove(key)
+                if self.auth.role(key) in (ROLE_USER, ROLE_SIM):
+                    self.auth.remove(key)
+                deleted += 1
+            chunk = self.chunk_of(slot)
+            if chunk not in changed:
+                changed.append(chunk)
+        for start, end in changed:
+            await self.refresh_chunk(start, end)
+        log.info("Batch: %s added, %s stored, %s deleted, %s failed.", added, stored, deleted, len(failed))
+
+        parts = []
+        if failed:
+            parts.append("Failed: " + " ".join(failed) + ".")
+        if invalid:
+            parts.append("Invalid: " + " ".join(invalid) + ".")
+        parts.append(f"Added {added}, deleted {deleted}.")
+        if stored:
+            parts.append(f"Authorised {stored}, SIM card not updated.")
+        if present:
+            parts.append(f"Already saved {present}.")
+        if missing:
+            parts.append(f"Not found {missing}.")
+        for key, number in queries:
+            if key in self.phonebook:
+                parts.append(f"{number} in SIM.")
+            elif key in self.auth:
+                parts.append(f"{number} in store.")
+            else:
+                parts.append(f"{number} not found.")
+        return split_reply(parts, sms_max)
+
+    def log_query(self, arg):
+        """
+        Answers ?log N (the last N calls) and ?log <number> (the last calls of a number)
+        from the access log, as many records as fit in one SMS.
+        
+        :param arg: text after ?log: empty, a count or a phone number
+        :return: response text, one record per line, newest first
+        """
+        if not arg:
+            records = self.access.latest(log_query_default)
+        elif arg.isdigit() and len(arg) <= 3:
+            records = self.access.latest(int(arg))
+        else:
+            key = phone.key(arg)
+            if key is None:
+                return f"Number {arg} is not valid."
+            records = self.access.find(key, log_query_default)
+            if not records:
+                return f"No calls from {arg}."
+        if not records:
+            return "No calls logged."
+        lines = []
+        length = 0
+        for record in records:
+            line = format_record(record)
+            length += len(line) + 1
+            if length > sms_max + 1:
+                break
+            lines.append(line)
+        return "\n".join(lines)
+
+    def dump_stats(self, path=None):
+        """
+        Writes the metrics and the kept log entries to a file readable on the host.
+        
+        :param path: file path, stats_file by default
+        :return: True if the file was written, False otherwise
         """
-        Sends an SMS message and waits for confirmation.
+        try:
+            with open(path or stats_file, "w") as f:
+                metrics.dump(f)
+                log.dump(f)
+            return True
+        except OSError as e:
+            log.error("Failed to write stats: %s", e)
+            return False
+
+    def send_sms(self, number, message, on_done=None):
+        """
+        Queues an SMS message, it is sent in the background by the outbox.
         
         :param number: recipient's phone number
         :param message: message content
+        :param on_done: callback called with the OutgoingSms once it is sent or failed
+        :return: OutgoingSms handle, its status ends as "sent" or "failed"
         """   
-        print(f"[INFO] Sending SMS to {number}...")
+        log.info("Queueing SMS to %s...", number)
+        return self.outbox.send(number, message, on_done)
+            
+    async def handle_uart_message(self, name, line, received=None):
+        """
+        Passes a single URC to its event handler.
+        
+        :param name: URC name from URC_PREFIXES, None for lines that are not a known URC
+        :param line: URC line (for +CMT: the header and the message body)
+        :param received: ticks_us when the line was read
+        """
+        handler = self.urc_handlers.get(name)
+        if handler:
+            await handler(line, received)
+        else:
+            log.debug("Response unknown: %s", line)
 
+    async def dispatch(self):
+        """
+        Handles all queued URC events.
+        
+        :return: number of handled events
+        """
+        handled = 0
+        while self.events:
+            name, line, received = self.events.popleft()
+            await self.handle_uart_message(name, line, received)
+            handled += 1
+        return handled
+
+    async def handle_ring(self, line, received=None):
+        """
+        Handles RING: a new call has been detected, the caller is checked on +CLIP.
+        
+        :param line: URC line
+        :param received: ticks_us when the line was read
+        """
+        log.info("Incoming call detected.")
+
+    async def handle_clip(self, line, received=None):
+        """
+        Handles +CLIP: logs the call. The gate is opened by open_gate_fast and
+        ATH is queued as soon as the line is read.
+        
+        :param line: URC line in the format: +CLIP: "<number>",<type>,...
+        :param received: ticks_us when the line was read
+        """
         try:
-            self.send_sms_text(number, message)
-
-            print("[INFO] Message sent. Waiting for confirmation...")
-
-            # Waits up to 5 seconds for a modem response
-            # Checks uart every 0.5s and prints the first available response
-            for _ in range(10):
-                utime.sleep(0.5)
-                with uart_lock:
-                    if uart.any():
-                        response = uart.read().decode('ignore')
-                        print("[MODEM RESPONSE]:\n", response)
-                        break
+            caller_number, toa = phone.parse_clip(line)
+            if caller_number is None:
+                caller_number = "Unknown"
+        
+            log.info("Caller: %s", caller_number)
+
+            key = phone.key(caller_number, toa)
+            if not self.calls.is_denied(key) and self.is_key_authorized(key):
+                log.info("Caller number is authorized. Hanging up.")
+                if self.gate.active:
+                    log.info("Gate opened.")
             else:
-                print("[WARNING] No response from modem.")
+                log.warning("Unknown number. Hanging up.")
+
         except Exception as e:
-            print("[ERROR] Exception while sending SMS:", e)
-            
-    def handle_uart_message(self, response):
+            log.error("Failed to parse CLIP: %s", e)
+
+    async def handle_cmti(self, line, received=None):
         """
-        Handles and processes a raw UART message from the modem.
+        Handles +CMTI: drains the SMS inbox. A burst of +CMTI: is handled with a
+        single drain, on the last notification.
         
-        :param response: raw UART response from the modem
+        :param line: URC line in the format: +CMTI: "SM",<index>
+        :param received: ticks_us when the line was read
+        """
+        log.info("New SMS received.")
+        if self.events.has("+CMTI:"):
+            return
+        await self.drain_inbox()
+
+    async def drain_inbox(self):
         """
-        if "RING" in response: # New call has been detected
-            print("\n[INFO] Incoming call detected.")
+        Reads all unread messages with one AT+CMGL, executes their commands in order
+        and deletes the processed messages with one AT+CMGD.
         
-            # Checks if the number is saved or not
-            if "+CLIP:" in response: # If enabled +CLIP notification
-                try:
-                    clip_line = ""
-                    for line in response.splitlines():
-                        if "+CLIP:" in line:
-                            clip_line = line
-                            break
-                    parts = clip_line.split('"')
-                    caller_number = parts[1] if len(parts) > 1 else "Unknown"
-                
-                    print(f"[CALLER] Number: {caller_number}")
-
-                    if self.is_number_in_sim(caller_number):
-                        print("[INFO] Caller number is in SIM contacts. Hanging up.")
-                        self.hang_up()
-                    
-                        # Opens the gate
-                    
-                        caller_number = ""
-                    else:
-                        print("[WARNING] Unknown number. Hanging up.")
-                        self.hang_up()
-                    
-                        caller_number = "" 
+        :return: number of processed messages
+        """
+        await self.text_mode()
+        messages = []
+        parser = InboxParser(lambda index, sender, text, dcs: messages.append((index, sender, text, dcs)))
+        res = await self.transact('AT+CMGL="REC UNREAD"', 10000, on_line=parser.feed)
+        parser.flush()
+        if not res.ok:
+            log.error("Failed to list SMS: %s", res.error or res.status)
+            return 0
 
-                except Exception as e:
-                    print("[ERROR] Failed to parse CLIP:", e)
-            else:
-                print("[ERROR] +CLIP notification not enabled.")
-                
-        elif "+CMTI:" in response: # New message has been received
+        for index, sender, text, dcs in messages:
+            log.info("SMS at index: %s", index)
             try:
-                print("\n[INFO] New SMS received.")
-                
-                # Gets index of message
-                for line in response.splitlines():
-                    if "+CMTI:" in line:
-                        parts = line.split(",")
-                        sms_index = int(parts[1].strip())
-                        break
-                    
-                sms_resp = self.read_sms_by_index(sms_index)
-                
-                print(f"[INFO] Text of SMS: {sms_resp}")
-
-                lines = sms_resp.splitlines()
-                header = lines[5] if len(lines) > 0 else "" # number, name, date, ...
-                text = "\n".join(lines[6:]).strip()
-                print(f"[DEBUG] SMS Header: {header}")
-
-                try:
-                    header_parts = header.split('"')
-                    sender_number = header_parts[3] if len(header_parts) > 3 else "Unknown"
-                    
-                except:
-                    print("[ERROR] Parsing sender info failed")
-                
-                print(f"[SMS] From: {sender_number}")
-                print(f"[SMS] Message: {text}")
-                
-                # Max 25 messages
-                if sms_index > 24:
-                    resp = self.delete_all_messages()
-                    if resp and "OK" in resp:
-                        print("[INFO] All messages deleted.")
-                    else:
-                        print("[WARNING] Failed to delete all messages.")
-                else:
-                    print(f"[INFO] Deleting SMS at index: {sms_index}")
-                    self.delete_sms(sms_index)
-                
-                if self.is_number_GK(sender_number):
-                    print(f"[INFO] Sender number is GK.")
-                    message = self.sms_command(text)
-                    if message:
-                        self.send_sms(sender_number, message)
-                    
-                else:
-                    print(f"[INFO] Not GK number.")
-                
+                await self.process_sms(sender, decode_text(text, dcs).strip())
             except Exception as e:
-                print("[ERROR] Failed to parse SMS:", e)
-                
+                log.error("Failed to process SMS: %s", e)
+
+        if messages:
+            # Listed messages are now read, deletes every read message
+            if await self.send_at("AT+CMGD=1,1", "OK"):
+                log.info("%s processed SMS deleted.", len(messages))
+            else:
+                log.warning("Failed to delete processed SMS.")
+        return len(messages)
+
+    async def handle_cmt(self, line, received=None):
+        """
+        Handles +CMT: an SMS delivered directly to the terminal, without SIM storage.
+        
+        :param line: URC header line and message body separated by a newline
+        :param received: ticks_us when the line was read
+        """
+        try:
+            log.info("New SMS received.")
+            header, _, text = line.partition("\n")
+            log.debug("SMS Header: %s", header)
+            sender, timestamp, dcs, length = parse_cmt_header(header)
+            await self.process_sms(sender, decode_text(text, dcs).strip())
+        except Exception as e:
+            log.error("Failed to parse SMS: %s", e)
+
+    async def handle_status(self, line, received=None):
+        """
+        Handles modem status URCs (power down, SIM state, registration, readiness).
+        
+        :param line: URC line
+        :param received: ticks_us when the line was read
+        """
+        log.info("Modem status: %s", line)
+        if self.on_status:
+            await self.on_status(line, received)
+
+    async def process_sms(self, sender_number, text):
+        """
+        Executes the SMS command if the sender is a GK admin and replies to the sender.
+        
+        :param sender_number: sender's phone number
+        :param text: message body
+        """
+        metrics.count("sms_in")
+        log.info("SMS from: %s", sender_number)
+        log.debug("SMS message: %s", text)
+        
+        if self.is_number_GK(sender_number):
+            log.info("Sender number is GK.")
+            metrics.count("sms_commands")
+            message = await self.sms_command(text)
+            for part in [message] if isinstance(message, str) else message or ():
+                if part:
+                    self.send_sms(sender_number, part)
+            
         else:
-            print(f"Response unknown: {response}")
-    
\ No newline at end of file
+            log.info("Not GK number.")
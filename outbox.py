@@ -0,0 +1,194 @@
+import utime
+
+import log
+import metrics
+
+outbox_max = 32  # messages waiting to be sent
+prompt_timeout_ms = 5000  # AT+CMGS -> > prompt
+send_timeout_ms = 60000  # message body -> +CMGS: <mr>, includes the network round trip
+retry_ms = (5000, 30000, 120000)  # backoff before the 2nd, 3rd, ... attempt
+send_interval_ms = 1000  # minimum time between two sends
+sends_per_hour = 60  # rate limit, 0 for none
+
+# Outgoing SMS status
+SMS_QUEUED = "queued"
+SMS_SENDING = "sending"
+SMS_SENT = "sent"
+SMS_FAILED = "failed"
+
+
+class OutgoingSms:
+    """
+    Handle of a queued SMS. The status ends as SMS_SENT or SMS_FAILED.
+    """
+
+    def __init__(self, number, text, on_done=None):
+        self.number = number
+        self.text = text
+        self.on_done = on_done  # callback called with the message once it is sent or failed
+        self.status = SMS_QUEUED
+        self.reference = None  # message reference from +CMGS: <mr>
+        self.error = None  # last error (+CMS ERROR: <n>, TIMEOUT, ...)
+        self.attempts = 0
+        self.retry_at = None  # ticks_ms of the next attempt after a failure
+
+    @property
+    def done(self):
+        return self.status in (SMS_SENT, SMS_FAILED)
+
+
+class Outbox:
+    """
+    Outbound SMS queue. Messages are sent one at a time in two non-blocking steps:
+    AT+CMGS waits for the > prompt, the body waits for +CMGS: <mr>. The UART is
+    read by the main loop in the meantime, so incoming calls are handled while
+    a message is on its way. step() has to be called from the main loop with
+    uart_lock held (see Modem.poll).
+    """
+
+    def __init__(self, modem, size=outbox_max):
+        self.modem = modem
+        self.size = size
+        self.queue = []
+        self.sending = None  # OutgoingSms in progress
+        self.tr = None  # its Transaction
+        self.last_send = None  # ticks_ms of the last attempt
+        self.sent_times = []  # ticks_ms of the attempts in the last hour
+        self.wake = None  # callback to wake up the main loop when a message is queued
+
+    def send(self, number, text, on_done=None):
+        """
+        Queues an SMS.
+
+        :param number: recipient's phone number
+        :param text: message content
+        :param on_done: callback called with the OutgoingSms once it is sent or failed
+        :return: OutgoingSms
+        """
+        sms = OutgoingSms(number, text, on_done)
+        if len(self.queue) >= self.size:
+            self.finish(sms, SMS_FAILED, "QUEUE FULL")
+            return sms
+        self.queue.append(sms)
+        if self.wake:
+            self.wake()
+        return sms
+
+    @property
+    def pending(self):
+        """
+        :return: number of messages queued or being sent
+        """
+        return len(self.queue) + (self.sending is not None)
+
+    def step(self):
+        """
+        Starts the next send when the UART is free and the rate limit allows it,
+        abandons a step that timed out.
+        """
+        tr = self.tr
+        if tr is not None:
+            if not tr.done and tr.expired():
+                self.modem.abandon(tr)
+            return
+        if self.modem.busy() or not self.queue:
+            return
+        now = utime.ticks_ms()
+        sms = self.next_ready(now)
+        if sms is None or not self.rate_allows(now):
+            return
+
+        self.queue.remove(sms)
+        self.sending = sms
+        sms.status = SMS_SENDING
+        sms.attempts += 1
+        self.last_send = now
+        self.sent_times.append(now)
+        self.tr = self.modem.begin(f'AT+CMGS="{sms.number}"', prompt_timeout_ms, on_done=self.on_prompt)
+
+    def next_ready(self, now):
+        """
+        :return: first queued message that is not waiting for a retry, None if there is none
+        """
+        for sms in self.queue:
+            if sms.retry_at is None or utime.ticks_diff(now, sms.retry_at) >= 0:
+                return sms
+        return None
+
+    def rate_allows(self, now):
+        """
+        :return: True if a message may be sent now
+        """
+        if self.last_send is not None and utime.ticks_diff(now, self.last_send) < send_interval_ms:
+            return False
+        self.sent_times = [t for t in self.sent_times if utime.ticks_diff(now, t) < 3600000]
+        return not sends_per_hour or len(self.sent_times) < sends_per_hour
+
+    def on_prompt(self, tr):
+        """
+        AT+CMGS finished: writes the body after the > prompt.
+        """
+        res = tr.result()
+        if not res.prompted:
+            if res.error is None:  # Timed out
+                self.modem.uart.write(b"\x1B")  # Leaves the prompt in case it comes late
+            self.failed(res.error or res.status)
+            return
+        self.tr = self.modem.begin(raw=self.sending.text.encode() + b"\x1A", timeout=send_timeout_ms, on_done=self.on_result)
+
+    def on_result(self, tr):
+        """
+        Message body finished: +CMGS: <mr> on success.
+        """
+        res = tr.result()
+        self.tr = None
+        sms = self.sending
+        if not res.ok:
+            self.failed(res.error or res.status)
+            return
+        self.sending = None
+        for line in res.lines:
+            if line.startswith("+CMGS:"):
+                try:
+                    sms.reference = int(line[6:])
+                except ValueError:
+                    pass
+        self.finish(sms, SMS_SENT)
+
+    def failed(self, error):
+        """
+        Schedules a retry of the message being sent or gives up after the last one.
+
+        :param error: final line or status of the failed step
+        """
+        sms = self.sending
+        self.sending = None
+        self.tr = None
+        sms.error = error
+        if sms.attempts > len(retry_ms):
+            self.finish(sms, SMS_FAILED, error)
+            return
+        delay = retry_ms[sms.attempts - 1]
+        log.warning("Failed to send SMS to %s: %s, retry in %s ms", sms.number, error, delay)
+        metrics.count("sms_retries")
+        sms.status = SMS_QUEUED
+        sms.retry_at = utime.ticks_add(utime.ticks_ms(), delay)
+        self.queue.append(sms)
+
+    def finish(self, sms, status, error=None):
+        """
+        Ends a message with its final status and calls its callback.
+        """
+        sms.status = status
+        if error is not None:
+            sms.error = error
+        metrics.count("sms_sent" if status == SMS_SENT else "sms_failed")
+        if status == SMS_SENT:
+            log.info("SMS to %s sent, reference: %s", sms.number, sms.reference)
+        else:
+            log.error("Failed to send SMS to %s: %s", sms.number, sms.error)
+        if sms.on_done:
+            try:
+                sms.on_done(sms)
+            except Exception as e:
+                log.error("SMS callback failed: %s", e)
@@ -0,0 +1,107 @@
+import atparse
+
+country_code = "48"  # calling code added to national numbers
+national_length = 9  # digits of a national number
+international_prefix = "00"  # dialing prefix written instead of +
+trunk_prefix = ""  # national dialing prefix, e.g. "0" in the UK, empty if the country has none
+
+# Type of address
+INTERNATIONAL = 145
+UNKNOWN = 129
+
+E164_MIN = 8  # shortest international number, with the country code
+E164_MAX = 15  # longest international number, with the country code
+
+_country_code = country_code.encode()
+_international_prefix = international_prefix.encode()
+_trunk_prefix = trunk_prefix.encode()
+
+
+def canonical(number, toa=None):
+    """
+    Converts a phone number in any of its written forms to international digits:
+    +48503815525, 0048503815525, 48503815525 and 503815525 all give 48503815525.
+
+    :param number: number from +CLIP:, an SMS header, the phonebook or an SMS command
+    :param toa: type of address shown with the number, 145 if it is international
+    :return: digits with the country code, no +, or None if the number is not valid
+    """
+    k = key(number, toa)
+    if k is None:
+        return None
+    return str(k)
+
+
+def key(number, toa=None):
+    """
+    Canonical key of a phone number, equal for every written form of the number.
+
+    :param number: phone number
+    :param toa: type of address shown with the number
+    :return: int or None if the number is not valid
+    """
+    number = number.strip().encode()
+    return key_bytes(number, 0, len(number), toa)
+
+
+def key_bytes(buf, start, end, toa=None):
+    """
+    Canonical key of a phone number read from a line in the RX buffer, without
+    decoding it (see canonical for the accepted forms).
+
+    :param buf: bytes, bytearray or memoryview
+    :param start: position of the first character of the number
+    :param end: position after the last one
+    :param toa: type of address shown with the number
+    :return: int or None if the number is not valid
+    """
+    value = 0  # national numbers start from the country code
+    if start < end and buf[start] == 43:  # +
+        start += 1
+    elif international_prefix and atparse.starts(buf, _international_prefix, start):
+        start += len(_international_prefix)
+    elif toa == INTERNATIONAL:
+        pass
+    elif end - start == national_length:
+        value = int(country_code)
+    elif trunk_prefix and end - start == len(trunk_prefix) + national_length and atparse.starts(buf, _trunk_prefix, start):
+        start += len(trunk_prefix)
+        value = int(country_code)
+    elif end - start == len(country_code) + national_length and atparse.starts(buf, _country_code, start):
+        pass
+    else:
+        return None
+    # International digits as written, the country code must not start with 0
+    if not value and (not E164_MIN <= end - start <= E164_MAX or buf[start] == 48):
+        return None
+    for i in range(start, end):
+        d = buf[i] - 48
+        if not 0 <= d <= 9:
+            return None
+        value = value * 10 + d
+    return value
+
+
+def international(key):
+    """
+    :param key: canonical key
+    :return: number in the international format, e.g. +48503815525
+    """
+    return "+" + str(key)
+
+
+def parse_clip(line):
+    """
+    Takes the number and its type of address from a +CLIP: line.
+
+    :param line: +CLIP: "<number>",<type>,...
+    :return: tuple (number, type) or (None, None) if the line has no number
+    """
+    parts = line.split('"', 2)
+    if len(parts) < 3:
+        return None, None
+    fields = parts[2].split(",", 2)
+    toa = None
+    if len(fields) > 1 and fields[1].strip().isdigit():
+        toa = int(fields[1])
+    return parts[1], toa
@@ -0,0 +1,126 @@
+class Phonebook:
+    """
+    In-RAM index of the SIM card phonebook.
+
+    Keeps number -> slot and slot -> number maps together with the list of
+    free slots, so lookups never have to touch the modem.
+    """
+
+    def __init__(self):
+        self.numbers = {}  # canonical key (see phone.key) -> slot
+        self.slots = {}  # slot -> (canonical key, number as stored on the SIM)
+        self.free_slots = []
+        self.min_idx = 0
+        self.max_idx = -1
+        self.fingerprints = {}  # first slot of a chunk -> CRC32 of its +CPBR: lines
+        self.loaded = False
+
+    def reset(self, min_idx, max_idx):
+        """
+        Clears the index and marks every slot in the range as free.
+
+        :param min_idx: first phonebook slot
+        :param max_idx: last phonebook slot
+        """
+        self.numbers = {}
+        self.slots = {}
+        self.min_idx = min_idx
+        self.max_idx = max_idx
+        # Reversed so that pop() hands out the lowest slot first
+        self.free_slots = list(range(max_idx, min_idx - 1, -1))
+        self.fingerprints = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, key):
+        return key in self.numbers
+
+    def slot_of(self, key):
+        """
+        :param key: canonical key of the phone number
+        :return: slot index or None if the number is not stored
+        """
+        return self.numbers.get(key)
+
+    def stored_number(self, key):
+        """
+        :param key: canonical key of the phone number
+        :return: number as stored on the SIM or None if not stored
+        """
+        slot = self.numbers.get(key)
+        if slot is None:
+            return None
+        return self.slots[slot][1]
+
+    def add(self, slot, key, number):
+        """
+        Records a number stored in the given slot.
+
+        :param slot: phonebook slot
+        :param key: canonical key of the phone number, None if the stored number is not valid
+        :param number: number as stored on the SIM
+        """
+        old = self.slots.get(slot)
+        if old is not None:
+            self.numbers.pop(old[0], None)
+        elif slot in self.free_slots:
+            self.free_slots.remove(slot)
+        self.slots[slot] = (key, number)
+        if key is not None:
+            self.numbers[key] = slot
+
+    def remove(self, key):
+        """
+        Forgets a number and returns its slot to the free list.
+
+        :param key: canonical key of the phone number
+        :return: freed slot or None if the number was not stored
+        """
+        slot = self.numbers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot]
+            self.free_slots.append(slot)
+        return slot
+
+    def clear_range(self, start, end):
+        """
+        Forgets every number stored in the slot range, the slots become free.
+
+        :param start: first slot
+        :param end: last slot
+        :return: list of the canonical keys that were stored in the range
+        """
+        keys = []
+        for slot in range(start, end + 1):
+            entry = self.slots.pop(slot, None)
+            if entry is None:
+                continue
+            if entry[0] is not None:
+                keys.append(entry[0])
+                if self.numbers.get(entry[0]) == slot:
+                    del self.numbers[entry[0]]
+            self.free_slots.append(slot)
+        return keys
+
+    def take_free_slot(self):
+        """
+        :return: a free slot removed from the free list, or None if the phonebook is full
+        """
+        if self.free_slots:
+            return self.free_slots.pop()
+        return None
+
+    def release_slot(self, slot):
+        """
+        Returns a slot taken with take_free_slot() that ended up unused.
+
+        :param slot: phonebook slot
+        """
+        if slot not in self.slots and slot not in self.free_slots:
+            self.free_slots.append(slot)
+
+
+# Longest +CPBR line: +CPBR: 250,"<40 digit number>",145,"<14 char text>"
+CPBR_LINE_MAX = 80
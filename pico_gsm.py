@@ -1,63 +1,87 @@
-import machine
 import os
-import utime
-import binascii
-import _thread
-import sys
+import gc
 
-from collections import deque
-from modem import Modem
+from modem import Modem, pb_sync_ms
+import log
+import metrics
+from scheduler import Scheduler, sleep_ms
+from supervisor import Supervisor
 
 
 # using pin defined
 pwr_en = 14  # pin to control the power of the module
 uart_port = 0
-uart_baute = 115200
-
-
-buffer = deque([], 1000)
+uart_baute = 115200  # rate at boot, until a rate negotiated by LinkSpeed is saved
+gc_threshold = 8192  # bytes allocated between automatic collections, keeps each collection short
+gc_idle_ms = 1000  # interval of the collection done while the modem is idle
 
 print(os.uname())
 
 
 modem = Modem(port=uart_port, baute=uart_baute)
+scheduler = Scheduler(modem)
+supervisor = Supervisor(modem)
 
 
 class Listener:
 
-    def run(self):
-        print("\n--- STARTING EVENT LISTENER ---")
+    async def run(self):
+        log.info("--- STARTING EVENT LISTENER ---")
 
         while True:
-            response = modem.uart_read()
-            print(f"Uart message: {response}")
-            if response:
-                buffer.append(response)
-            utime.sleep(1)
+            await scheduler.wait_rx()
+            queued = scheduler.read()
+            if queued:
+                log.debug("Uart events: %s", queued)
         
 class Handler:
     
-    def run(self):
+    async def run(self):
         while True:
-            if len(buffer) == 0:
-                continue
-                utime.sleep(0.1)
-            response = buffer.popleft()
-            print(f"[INFO] Response received: {response}")
-            modem.handle_uart_message(response)
+            await scheduler.wait_events()
+            async with scheduler.lock:
+                await modem.dispatch()
+
+
+class Housekeeping:
+
+    async def run(self):
+        while True:
+            await sleep_ms(gc_idle_ms)
+            # Flash writes and collections between calls, so they do not delay the +CLIP: path
+            if not modem.busy() and not modem.events and not scheduler.lock.locked():
+                modem.access.flush()
+                if modem.trace:
+                    modem.trace.save()
+                metrics.sample_memory()
+                gc.collect()
+
+
+class PhonebookSync:
+
+    async def run(self):
+        while True:
+            await sleep_ms(pb_sync_ms)
+            async with scheduler.lock:
+                await modem.sync_phonebook()
 
 
 # --------------------------------------------  MAIN  ----------------------------------------------
+async def start():
+    await supervisor.boot()  # if the modem is not ready the supervisor recovers it
+    gc.collect()
+    if hasattr(gc, "mem_free"):  # MicroPython, the CPython threshold counts objects
+        gc.threshold(gc_threshold)
+
+
 def main():
     try:
-        modem.init_device()
         listener = Listener()
         handler = Handler()
-        # Thread #2
-        _thread.start_new_thread(listener.run, ())
-
-        # Main thread
-        handler.run()        
+        phonebook_sync = PhonebookSync()
+        housekeeping = Housekeeping()
+        scheduler.run(start(), listener.run(), handler.run(), phonebook_sync.run(), housekeeping.run(),
+                      supervisor.run(scheduler.lock))
     except Exception as e:
         print(e)
         raise e
@@ -65,5 +89,6 @@ def main():
         # byc moze jakies czyszczenie urzadzenia, jezeli jest potrzebne
         pass
 
-main()
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,158 @@
+class RingBuffer:
+    """
+    Fixed-size receive buffer for the modem UART.
+
+    Filled in bulk with uart.readinto() and drained line by line through
+    memoryviews, so reading a response does not allocate per byte. A line
+    longer than the buffer cannot be kept: it is dropped as a whole, never
+    returned cut short.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.line = bytearray(size)  # used for lines that wrap around the end of buf, as long as any line
+        self.line_mv = memoryview(self.line)
+        self.start = 0  # position of the oldest byte
+        self.count = 0  # number of bytes stored
+        self.scanned = 0  # bytes from start already checked for a line terminator
+        self.overflows = 0
+        self.dropping = False  # the start of the buffered line was dropped, skip it
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """
+        Drops all buffered data.
+        """
+        self.start = 0
+        self.count = 0
+        self.scanned = 0
+        self.dropping = False
+
+    def fill(self, uart):
+        """
+        Moves all available UART bytes that fit into the buffer.
+
+        :param uart: machine.UART or compatible object
+        :return: number of bytes read
+        """
+        total = 0
+        while self.count < self.size:
+            available = uart.any()
+            if not available:
+                break
+            end = self.start + self.count
+            if end >= self.size:
+                end -= self.size
+                room = self.start - end
+            else:
+                room = self.size - end
+            n = uart.readinto(self.mv[end:end + min(room, available)])
+            if not n:
+                break
+            self.count += n
+            total += n
+        return total
+
+    def readline(self):
+        """
+        Takes the next complete line from the buffer.
+
+        :return: memoryview of the line without the line terminator (CR LF), or None if
+                 no complete line is buffered. The view is only valid until the next fill().
+        """
+        buf = self.buf
+        size = self.size
+        while True:
+            i = self.scanned
+            pos = self.start + i
+            if pos >= size:
+                pos -= size
+            while i < self.count:
+                if buf[pos] == 10:  # \n
+                    break
+                i += 1
+                pos += 1
+                if pos == size:
+                    pos = 0
+            else:
+                self.scanned = i
+                if self.count == size:
+                    # Full buffer without a line terminator, the line cannot be recovered
+                    # and its rest is dropped too when it arrives
+                    self.overflows += 1
+                    self.clear()
+                    self.dropping = True
+                return None
+            if not self.dropping:
+                break
+            self.dropping = False
+            self.consume(i + 1)
+
+        line = self._take(i)
+        self.consume(1)  # \n
+        return line
+
+    def prompt(self):
+        """
+        Checks if the unterminated rest of the buffer is the "> " input prompt
+        and drops it if so.
+
+        :return: True if the prompt was found, False otherwise
+        """
+        if not self.count or self.count > 4:
+            return False
+        found = False
+        for i in range(self.count):
+            c = self.buf[(self.start + i) % self.size]
+            if c == 62:  # >
+                found = True
+            elif c > 32:
+                return False
+        if found:
+            self.clear()
+        return found
+
+    def consume(self, n):
+        """
+        Drops n bytes from the front of the buffer.
+
+        :param n: number of bytes
+        """
+        n = min(n, self.count)
+        self.start += n
+        if self.start >= self.size:
+            self.start -= self.size
+        self.count -= n
+        self.scanned = max(0, self.scanned - n)
+        if not self.count:
+            self.start = 0  # Keeps the next lines contiguous
+
+    def _take(self, n):
+        """
+        Removes n bytes from the front of the buffer and returns them without
+        trailing carriage returns.
+
+        :param n: number of bytes
+        :return: memoryview of the bytes
+        """
+        start = self.start
+        end = start + n
+        if end <= self.size:
+            view = self.mv[start:end]
+        else:
+            # Line wraps around the end of buf, copy it into the line buffer
+            first = min(self.size - start, n)
+            self.line_mv[:first] = self.mv[start:start + first]
+            if n > first:
+                self.line_mv[first:n] = self.mv[:n - first]
+            view = self.line_mv[:n]
+        self.consume(end - start)
+
+        hi = len(view)
+        while hi and view[hi - 1] == 13:  # \r
+            hi -= 1
+        return view[:hi]
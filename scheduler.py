@@ -0,0 +1,184 @@
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+import machine
+
+from modem import PRIO_NORMAL
+
+poll_ms = 10  # UART poll interval when the RX interrupt is not available
+irq_poll_ms = 500  # safety poll interval when the RX interrupt is enabled
+transact_poll_ms = 1  # UART poll interval of a task awaiting an AT transaction
+
+
+def sleep_ms(ms):
+    """
+    :param ms: time in milliseconds
+    :return: awaitable sleep, works on MicroPython and CPython asyncio
+    """
+    if hasattr(asyncio, "sleep_ms"):
+        return asyncio.sleep_ms(ms)
+    return asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(awaitable, ms):
+    """
+    Waits for an awaitable with a timeout.
+
+    :param awaitable: awaitable to wait for
+    :param ms: timeout in milliseconds
+    :return: result of the awaitable, raises asyncio.TimeoutError on timeout
+    """
+    if hasattr(asyncio, "wait_for_ms"):
+        return await asyncio.wait_for_ms(awaitable, ms)
+    return await asyncio.wait_for(awaitable, ms / 1000)
+
+
+class Flag:
+    """
+    Wakeup flag for a single waiting task. Can be set from an IRQ handler or another thread.
+    """
+
+    def __init__(self):
+        if hasattr(asyncio, "ThreadSafeFlag"):
+            self.flag = asyncio.ThreadSafeFlag()
+        else:
+            self.flag = asyncio.Event()
+        self.loop = None
+
+    def set(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.flag.set)
+        else:
+            self.flag.set()
+
+    async def wait(self):
+        if isinstance(self.flag, asyncio.Event):
+            # CPython: set() may come from another thread
+            if hasattr(asyncio, "get_running_loop"):
+                self.loop = asyncio.get_running_loop()
+            await self.flag.wait()
+            self.flag.clear()
+        else:
+            await self.flag.wait()
+
+
+class Scheduler:
+    """
+    Cooperative event loop of the main program.
+
+    One task reads the UART whenever the RX interrupt fires (or every poll_ms
+    without it) and queues URCs on modem.events; the event_flag wakes up the
+    task that handles them. Once attached, the AT transactions of the Modem
+    are awaited through transact(), so the reader task keeps answering calls
+    while a handler waits for the modem. The tasks that send AT command
+    sequences (handler, phonebook sync, supervisor) take the lock, so their
+    sequences do not interleave.
+    """
+
+    def __init__(self, modem):
+        self.modem = modem
+        self.rx_flag = Flag()
+        self.event_flag = Flag()
+        self.rx_irq = self.enable_rx_irq()
+        self.lock = asyncio.Lock()  # held by a task for its AT command sequence
+        modem.outbox.wake = self.rx_flag.set  # queued SMS are sent by the reader task
+        modem.scheduler = self
+
+    def enable_rx_irq(self):
+        """
+        Wakes up the reader task from the UART RX interrupt, if the port supports it.
+
+        :return: True if the interrupt was enabled, False if the UART has to be polled
+        """
+        trigger = getattr(machine.UART, "IRQ_RXIDLE", None)
+        if trigger is None or not hasattr(self.modem.uart, "irq"):
+            return False
+        try:
+            self.modem.uart.irq(handler=lambda uart: self.rx_flag.set(), trigger=trigger)
+            return True
+        except (TypeError, ValueError, OSError):
+            return False
+
+    async def wait_rx(self):
+        """
+        Waits until the modem sent something or the poll interval passed.
+        """
+        try:
+            await wait_for_ms(self.rx_flag.wait(), irq_poll_ms if self.rx_irq else poll_ms)
+        except asyncio.TimeoutError:
+            pass
+
+    def read(self):
+        """
+        Reads the UART once, wakes up the event handler if there are events.
+
+        :return: number of queued events
+        """
+        queued = self.modem.poll()
+        if queued:
+            self.event_flag.set()
+        return queued
+
+    async def wait_events(self):
+        """
+        Waits until there are events to handle.
+        """
+        while not self.modem.events:
+            await self.event_flag.wait()
+
+    async def transact(self, cmd=None, timeout=2000, raw=None, on_line=None, priority=PRIO_NORMAL, raw_lines=False):
+        """
+        Awaitable AT command transaction, see Modem.transact.
+
+        :param cmd: AT command, None to only wait for a response
+        :param timeout: time in milliseconds
+        :param raw: raw bytes to write instead of an AT command (e.g. SMS body)
+        :param on_line: callback for intermediate lines, if given the lines are not collected
+        :param priority: PRIO_CALL, PRIO_NORMAL or PRIO_BACKGROUND, see modem
+        :param raw_lines: pass the information lines to on_line as memoryviews, not decoded
+        :return: ATResult
+        """
+        with self.modem.uart_lock:
+            tr = self.modem.begin(cmd, timeout, raw, on_line, priority=priority, raw_lines=raw_lines)
+        await self.complete(tr)
+        return tr.result()
+
+    async def complete(self, tr):
+        """
+        Waits until the transaction is finished or its timeout expires. Reads the
+        UART and sleeps transact_poll_ms between the reads when nothing came, the
+        other tasks run meanwhile. URCs read here wake up the event handler.
+
+        :param tr: Transaction
+        """
+        modem = self.modem
+        while not tr.done:
+            with modem.uart_lock:
+                n = modem.pump()
+            if modem.events:
+                self.event_flag.set()
+            if modem.on_wait:
+                modem.on_wait()
+            if not tr.done:
+                await sleep_ms(0 if n else transact_poll_ms)
+
+    async def pause(self, ms):
+        """
+        :param ms: time in milliseconds, the other tasks run meanwhile
+        """
+        await sleep_ms(ms)
+
+    def run(self, boot, *tasks):
+        """
+        Runs boot to its end, then the tasks until all of them finish.
+
+        :param boot: coroutine bringing the modem up
+        :param tasks: coroutines
+        """
+        async def main():
+            await boot
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
@@ -0,0 +1,227 @@
+import log
+
+
+def split_fields(text):
+    """
+    Splits a response on commas outside of quotes.
+
+    :param text: e.g. "REC UNREAD","+48503815525","","24/05/17,12:00:00+08"
+    :return: list of fields with quotes removed
+    """
+    fields = []
+    start = 0
+    quoted = False
+    for i, c in enumerate(text):
+        if c == '"':
+            quoted = not quoted
+        elif c == ',' and not quoted:
+            fields.append(text[start:i].strip().strip('"'))
+            start = i + 1
+    fields.append(text[start:].strip().strip('"'))
+    return fields
+
+
+def parse_sms_header(line):
+    """
+    Parses a text mode SMS header.
+
+    :param line: +CMGL: <index>,"<stat>","<sender>",... or +CMGR: "<stat>","<sender>",... or +CMT: "<sender>",...
+    :return: tuple (index, stat, sender, timestamp); index is None for +CMGR: and +CMT:, stat is None for +CMT:
+    """
+    prefix, _, rest = line.partition(":")
+    fields = split_fields(rest)
+    index = None
+    stat = None
+    if prefix == "+CMGL":
+        index = int(fields.pop(0))
+    if prefix in ("+CMGL", "+CMGR"):
+        stat = fields.pop(0)
+    sender = fields[0] if fields else ""
+    timestamp = fields[2] if len(fields) > 2 else ""
+    return index, stat, sender, timestamp
+
+
+def listing_dcs(text, length):
+    """
+    Tells a UCS2 body of an AT+CMGL listing, whose header has no data coding
+    scheme. UCS2 is shown as hex, 4 digits per character, with the length
+    counted in characters or octets; a GSM 7 bit length counts the characters
+    as shown.
+
+    :param text: message body as received
+    :param length: <length> of the +CMGL: header (AT+CSDH=1), None if not shown
+    :return: 8 for UCS2, None if unknown
+    """
+    n = len(text)
+    if length is None or not n or n % 4 or length not in (n // 4, n // 2):
+        return None
+    try:
+        int(text, 16)
+    except ValueError:
+        return None
+    return 8
+
+
+class InboxParser:
+    """
+    Streaming parser of an AT+CMGL listing in text mode: feed it the response
+    lines as they arrive, every complete message is passed to on_message.
+    """
+
+    def __init__(self, on_message):
+        """
+        :param on_message: callback called with (index, sender, text, dcs), dcs as for decode_text
+        """
+        self.on_message = on_message
+        self.header = None
+        self.length = None
+        self.body = []
+
+    def feed(self, line):
+        """
+        :param line: response line (+CMGL: header or message body)
+        """
+        if line.startswith("+CMGL:"):
+            self.flush()
+            try:
+                self.header = parse_sms_header(line)
+                fields = split_fields(line[6:])
+                self.length = int(fields[6]) if len(fields) > 6 else None
+            except ValueError:
+                log.error("Failed to parse SMS header: %s", line)
+            return
+        if self.header is not None:
+            self.body.append(line)
+
+    def flush(self):
+        """
+        Passes on the message being parsed. Call after the final OK.
+        """
+        if self.header is not None:
+            index, stat, sender, timestamp = self.header
+            text = "\n".join(self.body)
+            self.on_message(index, sender, text, listing_dcs(text, self.length))
+        self.header = None
+        self.length = None
+        self.body = []
+
+
+# GSM 03.38 default alphabet characters that differ from ASCII below 0x20
+GSM7_CONTROL = {
+    0x00: "@", 0x01: "£", 0x02: "$", 0x03: "¥", 0x04: "è", 0x05: "é", 0x06: "ù", 0x07: "ì",
+    0x08: "ò", 0x09: "Ç", 0x0B: "Ø", 0x0C: "ø", 0x0E: "Å", 0x0F: "å", 0x10: "Δ", 0x11: "_",
+    0x12: "Φ", 0x13: "Γ", 0x14: "Λ", 0x15: "Ω", 0x16: "Π", 0x17: "Ψ", 0x18: "Σ", 0x19: "Θ",
+    0x1A: "Ξ", 0x1C: "Æ", 0x1D: "æ", 0x1E: "ß", 0x1F: "É",
+}
+
+
+def is_ucs2(dcs):
+    """
+    :param dcs: data coding scheme of the message, None if unknown
+    :return: True if the message is UCS2 coded
+    """
+    return dcs is not None and dcs & 0x0C == 0x08
+
+
+def decode_ucs2(text):
+    """
+    Decodes a hex encoded UCS2 (UTF-16BE) message body, as shown in text mode.
+
+    :param text: e.g. 003F0035003000330038
+    :return: decoded text
+    """
+    units = [int(text[i:i + 4], 16) for i in range(0, len(text) - 3, 4)]
+    chars = []
+    i = 0
+    while i < len(units):
+        unit = units[i]
+        if 0xD800 <= unit < 0xDC00 and i + 1 < len(units):  # Surrogate pair
+            unit = 0x10000 + ((unit - 0xD800) << 10) + (units[i + 1] - 0xDC00)
+            i += 1
+        chars.append(chr(unit))
+        i += 1
+    return "".join(chars)
+
+
+def decode_text(text, dcs=None):
+    """
+    Decodes a text mode message body.
+
+    :param text: message body as received
+    :param dcs: data coding scheme from the header, None if unknown
+    :return: decoded text
+    """
+    if is_ucs2(dcs):
+        try:
+            return decode_ucs2(text)
+        except ValueError:
+            return text
+    if any(ord(c) < 0x20 and c not in "\n\r" for c in text):
+        return "".join(GSM7_CONTROL.get(ord(c), c) for c in text)
+    return text
+
+
+def parse_cmt_header(line):
+    """
+    Parses a +CMT: header. Data coding scheme and length are only present with AT+CSDH=1.
+
+    :param line: +CMT: "<oa>","<alpha>","<scts>"[,<tooa>,<fo>,<pid>,<dcs>,"<sca>",<tosca>,<length>]
+    :return: tuple (sender, timestamp, dcs, length); dcs and length are None if not shown
+    """
+    fields = split_fields(line.partition(":")[2])
+    sender = fields[0] if fields else ""
+    timestamp = fields[2] if len(fields) > 2 else ""
+    dcs = None
+    length = None
+    if len(fields) >= 10:
+        dcs = int(fields[6])
+        length = int(fields[9])
+    return sender, timestamp, dcs, length
+
+
+def body_complete(lines, dcs, length):
+    """
+    Checks if all lines of a +CMT: message body have been received.
+
+    :param lines: body lines received so far
+    :param dcs: data coding scheme from the header, None if unknown
+    :param length: message length from the header, None if unknown
+    :return: True if the body is complete
+    """
+    if length is None or is_ucs2(dcs):
+        # Single line: UCS2 bodies are hex, line breaks are encoded
+        return len(lines) >= 1
+    received = sum(len(line) for line in lines) + len(lines) - 1
+    # Every line holds at least one character or line break, more lines mean a broken header
+    return received >= length or len(lines) > length
+
+
+def split_reply(parts, limit):
+    """
+    Packs the parts of a reply into as few messages as possible. Parts are not
+    split unless one is longer than a message, then it is split between words.
+
+    :param parts: reply sentences, in order
+    :param limit: characters of a single message
+    :return: list of message texts, each at most limit characters
+    """
+    messages = []
+    message = ""
+    for part in parts:
+        for word in part.split() if len(part) > limit else (part,):
+            while len(word) > limit:
+                if message:
+                    messages.append(message)
+                    message = ""
+                messages.append(word[:limit])
+                word = word[limit:]
+            if not message:
+                message = word
+            elif len(message) + 1 + len(word) <= limit:
+                message += " " + word
+            else:
+                messages.append(message)
+                message = word
+    if message:
+        messages.append(message)
+    return messages
@@ -0,0 +1,264 @@
+import machine
+import utime
+
+import log
+import metrics
+from scheduler import sleep_ms
+
+# Modem states
+OFF = "OFF"  # powered down or not answering
+BOOTING = "BOOTING"  # reset or powered on, waiting for RDY / Call Ready
+READY = "READY"  # answers AT commands, not configured or not registered yet
+REGISTERED = "REGISTERED"  # configured and registered, calls and SMS are handled
+DEGRADED = "DEGRADED"  # a fault was seen, recovery in progress
+
+# Recovery steps, in the order they are tried
+STEP_REINIT = "reinit"  # apply the settings again and check the registration
+STEP_CFUN = "cfun"  # AT+CFUN=1,1 modem reset
+STEP_POWER = "power"  # power cycle with the power key
+STEPS = (STEP_REINIT, STEP_CFUN, STEP_POWER)
+step_wait_ms = {  # time a step is given to get the modem registered before the next one
+    STEP_REINIT: 10000,
+    STEP_CFUN: 30000,
+    STEP_POWER: 30000,
+}
+
+watchdog = True  # reset the Pico with machine.WDT when the main loop stops
+wdt_timeout_ms = 8000  # at most 8388 on the RP2040
+tick_ms = 500  # interval of the supervisor loop, the watchdog is fed on every tick
+probe_ms = 10000  # interval of the health probe while registered, bounds the time a silent fault goes unnoticed
+probe_timeout_ms = 1000
+probe_failures = 2  # unanswered probes in a row before the modem is considered down
+probe_retry_ms = 1000  # interval of the probes after an unanswered one
+
+
+class Supervisor:
+    """
+    Modem state machine: OFF -> BOOTING -> READY -> REGISTERED, DEGRADED on a fault.
+
+    Driven by the status URCs (RDY, Call Ready, +CPIN:, +CREG:, NORMAL POWER DOWN)
+    and by a cheap AT+CREG? probe while registered. When the modem is not
+    registered the recovery steps are tried in order, each one given
+    step_wait_ms: re-init, AT+CFUN=1,1, power cycle. A step that needs the
+    modem to answer is skipped when it does not. The time without call
+    handling is recorded in the recovery_ms histogram.
+    """
+
+    def __init__(self, modem):
+        self.modem = modem
+        self.state = OFF
+        self.changed = utime.ticks_ms()  # when the state last changed
+        self.configured = False  # settings applied since the modem last started
+        self.step = 0  # next recovery step in STEPS
+        self.next_step = self.changed  # ticks_ms when the next recovery step is due
+        self.down_since = None  # ticks_ms when the modem stopped handling calls
+        self.fault = None  # reason of the last fault
+        self.since = None  # ticks_us, status URCs received before are stale
+        self.probe_due = self.changed
+        self.probe_missed = 0
+        self.wdt = None
+        modem.on_status = self.status
+        modem.on_wait = self.feed
+
+    def start_watchdog(self):
+        """
+        Starts machine.WDT, it cannot be stopped again. Fed on every tick and
+        while the modem is waited for.
+        """
+        if watchdog and self.wdt is None:
+            self.wdt = machine.WDT(timeout=wdt_timeout_ms)
+
+    def feed(self):
+        if self.wdt is not None:
+            self.wdt.feed()
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        log.info("Modem %s -> %s", self.state, state)
+        self.state = state
+        self.changed = utime.ticks_ms()
+        if state == REGISTERED:
+            self.modem.link.clear()  # Timeouts while the modem was down are not link errors
+            self.step = 0
+            self.probe_missed = 0
+            self.probe_due = utime.ticks_add(self.changed, probe_ms)
+            if self.down_since is not None:
+                ms = utime.ticks_diff(self.changed, self.down_since)
+                metrics.observe("recovery_ms", ms)
+                metrics.count("recoveries")
+                log.warning("Modem recovered after %s ms (%s).", ms, self.fault)
+                self.down_since = None
+
+    def failed(self, reason, state=DEGRADED):
+        """
+        Records a fault and starts the recovery.
+
+        :param reason: short description, e.g. "+CREG: 2"
+        :param state: DEGRADED, OFF or BOOTING
+        """
+        if self.down_since is None:
+            metrics.count("modem_faults")
+            log.warning("Modem fault: %s", reason)
+            self.fault = reason
+            self.down_since = utime.ticks_ms()
+            self.next_step = utime.ticks_ms()
+        self.set_state(state)
+
+    async def boot(self):
+        """
+        Initializes the modem at start. On failure the recovery takes over.
+
+        :return: True if the modem is registered
+        """
+        ok = await self.modem.init_device()
+        self.since = utime.ticks_us()  # status URCs of the boot are handled by init_device
+        self.configured = ok
+        if ok and await self.modem.is_registered():
+            self.set_state(REGISTERED)
+            return True
+        self.failed("boot", DEGRADED if ok else OFF)
+        return False
+
+    async def status(self, line, received=None):
+        """
+        Updates the state from a status URC. Called by Modem.handle_status.
+
+        :param line: URC line
+        :param received: ticks_us when the line was read
+        """
+        if received is not None and self.since is not None and utime.ticks_diff(received, self.since) < 0:
+            return  # From before the last recovery step
+        if line.startswith("NORMAL POWER DOWN"):
+            self.configured = False
+            self.failed("power down", OFF)
+        elif line.startswith("UNDER-VOLTAGE") or line.startswith("OVER-VOLTAGE"):
+            metrics.count("voltage_warnings")
+        elif line == "RDY":
+            # Restarted, the settings are lost
+            self.configured = False
+            if self.state == REGISTERED:
+                self.failed("modem restarted", BOOTING)
+            else:
+                self.set_state(BOOTING)
+        elif line in ("Call Ready", "SMS Ready"):
+            if self.state in (OFF, BOOTING):
+                self.set_state(READY)
+        elif line.startswith("+CPIN:"):
+            if "READY" not in line:
+                self.failed(line)
+        elif line.startswith("+CREG:"):
+            stat = line[6:].strip().split(",")[-1]
+            if stat in ("1", "5"):
+                if self.configured and self.state != REGISTERED:
+                    await self.registered()
+            elif self.state == REGISTERED:
+                self.failed(line)
+
+    async def probe(self):
+        """
+        Health probe: the modem answers and is registered.
+        """
+        self.probe_due = utime.ticks_add(utime.ticks_ms(), probe_ms)
+        res = await self.modem.transact("AT+CREG?", probe_timeout_ms)
+        if not res.ok:
+            self.probe_missed += 1
+            metrics.count("probes_missed")
+            self.probe_due = utime.ticks_add(utime.ticks_ms(), probe_retry_ms)
+            if self.probe_missed >= probe_failures:
+                self.configured = False
+                self.failed("no answer", OFF)
+            return
+        self.probe_missed = 0
+        reg = res.text()
+        if ",1" not in reg and ",5" not in reg:
+            self.failed(reg)
+
+    async def recover(self):
+        """
+        Runs the next recovery step. Steps that need AT commands are skipped if
+        the modem does not answer.
+        """
+        modem = self.modem
+        step = STEPS[min(self.step, len(STEPS) - 1)]
+        if step != STEP_POWER and not (await modem.transact("AT", probe_timeout_ms)).ok:
+            step = STEP_POWER
+        self.step = STEPS.index(step) + 1
+        self.next_step = utime.ticks_add(utime.ticks_ms(), step_wait_ms[step])
+        metrics.count("recovery_" + step)
+        log.warning("Modem recovery: %s", step)
+        if step == STEP_REINIT:
+            await self.reinit()
+        elif step == STEP_CFUN:
+            self.since = utime.ticks_us()
+            self.configured = False
+            await modem.full_reset()
+            self.set_state(BOOTING)
+        else:
+            self.configured = False
+            self.since = await modem.power_cycle()
+            self.set_state(BOOTING)
+
+    async def reinit(self):
+        """
+        Applies the settings and checks the registration.
+        """
+        modem = self.modem
+        self.since = utime.ticks_us()
+        self.configured = await modem.configure()
+        if not self.configured:
+            return
+        if await modem.is_registered():
+            await self.registered()
+        elif self.state != DEGRADED:
+            self.set_state(READY)
+
+    async def registered(self):
+        """
+        Back to handling calls after a recovery. The setup init_device did not
+        get to when the boot failed (link rate, phonebook index) is finished first.
+        """
+        modem = self.modem
+        await modem.link.negotiate()  # Returns at once when a rate is saved
+        if not modem.phonebook.loaded:
+            await modem.load_phonebook()
+        self.set_state(REGISTERED)
+        await modem.drain_inbox()  # Messages stored while the modem was down
+
+    async def tick(self):
+        """
+        One supervisor iteration: feeds the watchdog, probes the modem (or lowers
+        the link rate after link errors) when it is registered and moves the
+        recovery on otherwise.
+        """
+        self.feed()
+        now = utime.ticks_ms()
+        if self.modem.busy() or self.modem.events:
+            return  # Status URCs are handled first
+        if self.state == REGISTERED:
+            if self.modem.link.failing:
+                if await self.modem.link.fallback():
+                    await self.modem.sync_phonebook()  # Entries lost in garbled lines
+                else:
+                    self.configured = False
+                    self.failed("no answer", OFF)
+            elif utime.ticks_diff(now, self.probe_due) >= 0:
+                await self.probe()
+            return
+        if self.state == READY and not self.configured:
+            # Started again after a reset, no need to wait for the step to time out
+            await self.reinit()
+        elif utime.ticks_diff(now, self.next_step) >= 0:
+            await self.recover()
+
+    async def run(self, lock):
+        """
+        Supervisor task of the Scheduler.
+
+        :param lock: Scheduler.lock, held while a tick sends AT commands
+        """
+        self.start_watchdog()
+        while True:
+            await sleep_ms(tick_ms)
+            async with lock:
+                await self.tick()
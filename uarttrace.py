@@ -0,0 +1,167 @@
+import struct
+import utime
+
+import log
+import metrics
+
+enabled = False  # record the modem UART to trace_file, opt-in: every chunk is copied and written to flash
+trace_file = "trace.bin"  # replayed on the host with host/replay.py, copy it with e.g. mpremote cp :trace.bin .
+trace_max = 262144  # bytes, recording stops when the file is this large
+buffer_size = 4096  # bytes of records collected in RAM before they are written
+
+HEADER_FORMAT = "<4sHHI"  # magic, version, reserved, UART rate when the recording started
+HEADER = 12
+RECORD_FORMAT = "<BHI"  # kind, length of the data, microseconds since the previous record
+RECORD = 7
+MAGIC = b"UTRC"
+VERSION = 1
+
+# Record kinds
+TX = 1  # bytes written to the modem
+RX = 2  # bytes read from the modem
+RATE = 3  # UART rate changed, the data is the new rate as "<I"
+
+
+class UartTrace:
+    """
+    Recording proxy of the modem machine.UART.
+
+    Every chunk written or read goes into a preallocated RAM buffer as a
+    record: kind, length and the time since the previous record, then the
+    bytes. Time deltas keep the records small and survive the wrap of
+    ticks_us. The buffer is appended to trace_file by save(), which the
+    main loop calls while the modem is idle, or when it is full. Recording
+    stops once trace_max bytes are written.
+    """
+
+    def __init__(self, uart, rate, path=None):
+        self.uart = uart
+        self.path = path or trace_file
+        self.buf = bytearray(buffer_size)
+        self.mv = memoryview(self.buf)
+        self.used = 0  # bytes of records in buf
+        self.written = 0  # bytes in the file
+        self.last = utime.ticks_us()  # time of the previous record
+        self.full = False  # recording stopped
+        self.rate = bytearray(4)
+        try:
+            with open(self.path, "wb") as f:
+                f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, rate))
+            self.written = HEADER
+        except OSError as e:
+            log.error("UART trace not started: %s", e)
+            self.full = True
+
+    def add(self, kind, data, n):
+        """
+        Records a chunk, split if it does not fit in the buffer.
+
+        :param kind: TX, RX or RATE
+        :param data: bytes, bytearray or memoryview
+        :param n: number of bytes of data
+        """
+        if self.full:
+            return
+        now = utime.ticks_us()
+        dt = utime.ticks_diff(now, self.last)
+        self.last = now
+        start = 0
+        while start < n:
+            part = min(n - start, buffer_size - RECORD)
+            if self.used + RECORD + part > buffer_size:
+                self.save()
+                if self.full:
+                    return
+            struct.pack_into(RECORD_FORMAT, self.buf, self.used, kind, part, dt)
+            self.used += RECORD
+            self.mv[self.used:self.used + part] = data[start:start + part]
+            self.used += part
+            start += part
+            dt = 0
+
+    def save(self):
+        """
+        Appends the recorded chunks to the trace file.
+
+        :return: number of bytes written
+        """
+        n = self.used
+        if not n:
+            return 0
+        self.used = 0
+        if self.written + n > trace_max:
+            self.full = True
+            metrics.count("trace_full")
+            log.warning("UART trace full, %s bytes recorded.", self.written)
+            return 0
+        try:
+            with open(self.path, "ab") as f:
+                f.write(self.mv[:n])
+        except OSError as e:
+            log.error("UART trace write failed: %s", e)
+            self.full = True
+            return 0
+        self.written += n
+        return n
+
+    # machine.UART
+
+    def any(self):
+        return self.uart.any()
+
+    def readinto(self, buf, nbytes=None):
+        n = self.uart.readinto(buf) if nbytes is None else self.uart.readinto(buf, nbytes)
+        if n:
+            self.add(RX, buf, n)
+        return n
+
+    def read(self, n=None):
+        data = self.uart.read() if n is None else self.uart.read(n)
+        if data:
+            self.add(RX, data, len(data))
+        return data
+
+    def write(self, buf):
+        n = self.uart.write(buf)
+        if n:
+            self.add(TX, buf, n)
+        return n
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate is None:
+            self.uart.init(**kwargs)
+            return
+        self.uart.init(baudrate=baudrate, **kwargs)
+        struct.pack_into("<I", self.rate, 0, baudrate)
+        self.add(RATE, self.rate, 4)
+
+    def __getattr__(self, name):
+        # irq, flush, txdone, deinit, ...
+        return getattr(self.uart, name)
+
+
+def records(path=None):
+    """
+    Reads a trace file.
+
+    :param path: trace file, trace_file by default
+    :return: generator of (kind, microseconds since the previous record, data),
+             raises ValueError if the file is not a trace
+    """
+    with open(path or trace_file, "rb") as f:
+        header = f.read(HEADER)
+        if len(header) != HEADER:
+            raise ValueError("not a UART trace")
+        magic, version, _, rate = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a UART trace")
+        yield RATE, 0, struct.pack("<I", rate)
+        while True:
+            head = f.read(RECORD)
+            if len(head) != RECORD:
+                return
+            kind, n, dt = struct.unpack(RECORD_FORMAT, head)
+            data = f.read(n)
+            if len(data) != n:
+                return  # Cut off, e.g. by a reset while it was written
+            yield kind, dt, data